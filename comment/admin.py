@@ -1,6 +1,19 @@
 from django.contrib import admin
 
 from comment.models import Comment
+from todo_proweb.admin import ShardedModelAdmin
+from todo_proweb.pagination import EstimatedCountPaginator
 
 # Register your models here.
-admin.site.register(Comment)
\ No newline at end of file
+
+
+@admin.register(Comment)
+class CommentAdmin(ShardedModelAdmin):
+    list_display = ('id', '__str__', 'task', 'user', 'created_at')
+    list_select_related = ('task', 'user')
+    ordering = ('-id',)
+    raw_id_fields = ('task',)
+    autocomplete_fields = ('user',)
+    readonly_fields = ('version',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
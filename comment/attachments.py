@@ -0,0 +1,178 @@
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import FileResponse, HttpResponse
+from django.utils.http import content_disposition_header
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'ATTACHMENTS', {}).get(name, default)
+
+
+def get_root():
+    return Path(_get_setting('ROOT', 'attachments'))
+
+
+def get_max_size():
+    return _get_setting('MAX_SIZE', 25 * 1024 * 1024)
+
+
+def relative_path(sha256):
+    return f'{sha256[:2]}/{sha256}'
+
+
+def content_path(sha256):
+    return get_root() / relative_path(sha256)
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Streams every uploaded file chunk by chunk into a temporary file next to the stored attachments,
+    hashing it on the way, and then moves it to the path of its SHA-256 unless the same content is
+    stored already. Files larger than ``ATTACHMENTS['MAX_SIZE']`` stop the upload and set ``too_large``.
+
+    The uploaded files only carry their name, content type, size and ``sha256``, the content is not
+    kept in memory.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        # not `file`, which MultiPartParser closes when an upload is stopped
+        self.temp_file = None
+        self.too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        root = get_root()
+        root.mkdir(parents=True, exist_ok=True)
+        self.temp_file = tempfile.NamedTemporaryFile(dir=root, prefix='.upload-', delete=False)
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > get_max_size():
+            self.too_large = True
+            self._discard()
+            raise StopUpload()
+        self.hash.update(raw_data)
+        self.temp_file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.temp_file.close()
+        sha256 = self.hash.hexdigest()
+        path = content_path(sha256)
+        if path.exists():
+            os.unlink(self.temp_file.name)
+            # marks the content as in use for prune_attachments
+            os.utime(path)
+        else:
+            path.parent.mkdir(exist_ok=True)
+            os.replace(self.temp_file.name, path)
+        self.temp_file = None
+
+        uploaded = UploadedFile(name=self.file_name, content_type=self.content_type, size=file_size,
+                                charset=self.charset, content_type_extra=self.content_type_extra)
+        uploaded.sha256 = sha256
+        return uploaded
+
+    def upload_interrupted(self):
+        self._discard()
+
+    def _discard(self):
+        if self.temp_file is not None:
+            self.temp_file.close()
+            os.unlink(self.temp_file.name)
+            self.temp_file = None
+
+
+class _FileRange:
+    """
+    Reads at most ``length`` bytes of ``file`` from its current position. Keeps ``fileno()`` so a
+    ``wsgi.file_wrapper`` like gunicorn's still sends it with ``sendfile``, up to the Content-Length.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    Returns the ``(start, end)`` of a ``Range: bytes=...`` header with a single range, ``None`` to
+    send the whole file, or raises ``ValueError`` if the range is outside the file.
+    """
+    match = _RANGE.match(header or '')
+    if match is None or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        # the last N bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+def serve(request, attachment):
+    """
+    Answers a download of ``attachment``. With ``ATTACHMENTS['ACCEL_REDIRECT']`` nginx sends the file
+    and handles Range requests, otherwise a ``FileResponse`` does, which gunicorn sends with ``sendfile``.
+    """
+    etag = f'"{attachment.sha256}"'
+    accel_redirect = _get_setting('ACCEL_REDIRECT', '')
+    if accel_redirect:
+        return HttpResponse(content_type=attachment.content_type, headers={
+            'Content-Disposition': content_disposition_header(True, attachment.name),
+            'ETag': etag,
+            'X-Accel-Redirect': f'{accel_redirect.rstrip("/")}/{relative_path(attachment.sha256)}',
+        })
+
+    file = open(content_path(attachment.sha256), 'rb')
+    size = os.fstat(file.fileno()).st_size
+    options = {
+        'as_attachment': True,
+        'filename': attachment.name,
+        'content_type': attachment.content_type,
+        'headers': {'Accept-Ranges': 'bytes', 'ETag': etag},
+    }
+    byte_range = None
+    if request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            file.close()
+            return HttpResponse(status=416, headers={'Content-Range': f'bytes */{size}'})
+
+    if byte_range is None:
+        return FileResponse(file, **options)
+
+    start, end = byte_range
+    file.seek(start)
+    response = FileResponse(_FileRange(file, end - start + 1), status=206, **options)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
@@ -0,0 +1,56 @@
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from comment import attachments
+from comment.models import Attachment, Comment
+
+
+class Command(BaseCommand):
+    help = ('Delete the attachments of deleted comments, then the stored files no attachment refers to and '
+            'interrupted uploads.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', dest='min_age', default=3600, type=int,
+                            help='Seconds since a file was last stored before it can be deleted')
+        parser.add_argument('--batch-size', dest='batch_size', default=1000, type=int)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        databases = settings.DATABASE_SHARDS or ['default']
+
+        orphans = 0
+        for using in databases:
+            comment_exists = Exists(Comment.objects.using(using).filter(pk=OuterRef('comment_id')))
+            while True:
+                ids = list(Attachment.objects.using(using).filter(~comment_exists).values_list('id', flat=True)
+                           [:batch_size])
+                if not ids:
+                    break
+                orphans += Attachment.objects.using(using).filter(id__in=ids).delete()[0]
+
+        # files stored or reused since then may belong to an attachment that is not written yet
+        cutoff = time.time() - options['min_age']
+        root = attachments.get_root()
+        files = 0
+        paths = (path for path in root.glob('*/*') if path.stat().st_mtime < cutoff)
+        while batch := {path.name: path for path in islice(paths, batch_size)}:
+            referenced = set()
+            for using in databases:
+                referenced.update(Attachment.objects.using(using).filter(sha256__in=batch)
+                                  .values_list('sha256', flat=True))
+            for sha256, path in batch.items():
+                if sha256 not in referenced:
+                    path.unlink()
+                    files += 1
+        for path in root.glob('.upload-*'):
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                files += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {orphans} attachments of deleted comments and {files} unreferenced files'
+        ))
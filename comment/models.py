@@ -1,15 +1,75 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from task.models import Task
+from todo_proweb.concurrency import VersionedQuerySet
 
 # Create your models here.
 
 
+class CommentQuerySet(VersionedQuerySet):
+
+    def delete(self):
+        task_ids = list(self.order_by().values_list('task_id', flat=True).distinct())
+        with transaction.atomic(using=self.db):
+            result = super().delete()
+            Task.objects.using(self.db).filter(pk__in=task_ids).refresh_comment_stats()
+        return result
+
+
 class Comment(models.Model):
     text = models.TextField(max_length=255, blank=False, null=False)
 
     task = models.ForeignKey('task.Task', on_delete=models.CASCADE, related_name='comments')
-    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='comments')
+    # users stay on the primary database when comments are sharded, see todo_proweb/sharding.py
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='comments', db_constraint=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    version = models.PositiveIntegerField(default=1)
+
+    objects = CommentQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+
+        using = kwargs.get('using') or router.db_for_write(Comment, instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            Task.objects.using(self._state.db).filter(pk=self.task_id).update(
+                comment_count=F('comment_count') + 1,
+                last_commented_at=Greatest(Coalesce('last_commented_at', self.created_at), self.created_at),
+            )
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(Comment, instance=self)
+        with transaction.atomic(using=using):
+            result = super().delete(*args, **kwargs)
+            last_comment = Comment.objects.filter(task=OuterRef('pk')).order_by('-created_at')
+            Task.objects.using(using).filter(pk=self.task_id).update(
+                comment_count=Greatest(F('comment_count') - 1, 0),
+                last_commented_at=Subquery(last_comment.values('created_at')[:1]),
+            )
+        return result
 
     def __str__(self):
         return self.text[:20]
+
+
+class Attachment(models.Model):
+    # left behind when the comment is deleted, so comments and tasks can still be deleted in bulk,
+    # `python manage.py prune_attachments` removes them
+    comment = models.ForeignKey(Comment, on_delete=models.DO_NOTHING, related_name='attachments',
+                                db_constraint=False)
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='attachments', db_constraint=False)
+
+    name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    # the content is stored once per hash, see comment/attachments.py
+    sha256 = models.CharField(max_length=64, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
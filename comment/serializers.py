@@ -1,33 +1,68 @@
+import logging
+
 from rest_framework import serializers
 
-from task.models import Task
-from .models import Comment
+from task import history
+from task.models import Collaborator, Task, TaskHistory
+from .models import Attachment, Comment
+
+logger = logging.getLogger(__name__)
 
 
 class CommentSerializer(serializers.ModelSerializer):
+    occurrence = serializers.DateTimeField(
+        write_only=True, required=False,
+        help_text='Original due date of the occurrence of the recurring `task` to comment on, which is saved as a '
+                  'task of its own'
+    )
+
     class Meta:
         model = Comment
         fields = '__all__'
-        read_only_fields = ('id', 'created_at', 'user')
+        read_only_fields = ('id', 'created_at', 'user', 'version')
 
     def validate_user(self, value):
         if value.user != self.context['request'].user:
             raise serializers.ValidationError('User must be the same as the authenticated user.')
         return value
 
-    def validate_task(self, value):
-        tasks = Task.objects.filter(user=self.context['request'].user)
-        print(f"user_{tasks=}")
-        if value not in tasks:
-            raise serializers.ValidationError('Task not found.')
-        return value
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is not None and request.user.is_authenticated:
+            # the task is looked up together with the access check, owners and editors can comment
+            fields['task'].queryset = Task.objects.visible_to(request.user, Collaborator.EDITOR)
+            fields['task'].error_messages['does_not_exist'] = 'Task not found.'
+        return fields
+
+    def validate(self, attrs):
+        occurrence = attrs.get('occurrence')
+        if occurrence is not None and 'task' in attrs and not attrs['task'].is_occurrence_date(occurrence):
+            raise serializers.ValidationError({'occurrence': ['No occurrence of the task is due at this date.']})
+        return attrs
 
     def create(self, validated_data):
-        print(f"{validated_data=}")
-        comment = Comment.objects.create(user=self.context['request'].user, **validated_data)
+        occurrence = validated_data.pop('occurrence', None)
+        if occurrence is not None:
+            validated_data['task'], created = validated_data['task'].materialize(occurrence)
+            if created:
+                task = validated_data['task']
+                history.record(task.id, self.context['request'].user.id, TaskHistory.CREATED,
+                               history.snapshot(task, history.TASK_FIELDS), using=task._state.db)
+        # on the shard of the task's owner, also when a collaborator comments
+        comment = Comment.objects.using(validated_data['task']._state.db).create(
+            user=self.context['request'].user, **validated_data
+        )
+        logger.info('Comment created', extra={'comment_id': comment.id, 'task_id': comment.task_id,
+                                              'user_id': comment.user_id})
+        history.record(comment.task_id, comment.user_id, TaskHistory.CREATED,
+                       history.snapshot(comment, history.COMMENT_FIELDS), comment_id=comment.id,
+                       using=comment._state.db)
         return comment
 
-    def update(self, instance, validated_data):
-        instance.text = validated_data.get('text', instance.text)
-        instance.save()
-        return instance
+
+class AttachmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Attachment
+        fields = ('id', 'comment', 'user', 'name', 'content_type', 'size', 'sha256', 'created_at')
+        read_only_fields = fields
@@ -1,3 +1,303 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from task.models import Task
+from todo_proweb.log import BackgroundHandler, JSONFormatter, SamplingFilter
+from todo_proweb.query_budget import QueryBudgetTestMixin
+from .models import Attachment, Comment
+from .views import CommentListCreateView, CommentDetailView
+
+
+class ReplicaRoutingTests(APITestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.addCleanup(caches['shared'].clear)
+        self.user = User.objects.create_user(username='user', password='password')
+        self.task = Task.objects.create(title='Task', user=self.user)
+        User.objects.using('replica').create(id=self.user.id, username='user')
+        Task.objects.using('replica').create(id=self.task.id, title='Task', user_id=self.user.id)
+        self.client.force_authenticate(self.user)
+
+    def test_get_reads_from_replica(self):
+        Comment.objects.using('replica').create(text='Replica comment', task_id=self.task.id, user_id=self.user.id)
+
+        response = self.client.get('/comment/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([comment['text'] for comment in response.data['data']], ['Replica comment'])
+
+    def test_reads_stick_to_primary_after_write(self):
+        Comment.objects.using('replica').create(text='Replica comment', task_id=self.task.id, user_id=self.user.id)
+
+        response = self.client.post('/comment/', {'task': self.task.id, 'text': 'Primary comment'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Comment.objects.using('replica').filter(text='Primary comment').exists())
+
+        response = self.client.get('/comment/')
+        self.assertEqual([comment['text'] for comment in response.data['data']], ['Primary comment'])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class CommentStatsTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.task = Task.objects.create(title='Task', user=self.user)
+        self.client.force_authenticate(self.user)
+
+    def comment(self, text):
+        self.client.post('/comment/', {'task': self.task.id, 'text': text}, format='json')
+        return Comment.objects.get(text=text)
+
+    def test_create_and_delete_keep_stats(self):
+        first = self.comment('First')
+        second = self.comment('Second')
+        self.task.refresh_from_db()
+        self.assertEqual((self.task.comment_count, self.task.last_commented_at), (2, second.created_at))
+
+        self.client.delete(f'/comment/{second.id}/')
+        self.task.refresh_from_db()
+        self.assertEqual((self.task.comment_count, self.task.last_commented_at), (1, first.created_at))
+
+    def test_bulk_delete_keeps_stats(self):
+        self.comment('First')
+        self.comment('Second')
+
+        Comment.objects.filter(task=self.task).delete()
+
+        self.task.refresh_from_db()
+        self.assertEqual((self.task.comment_count, self.task.last_commented_at), (0, None))
+
+    def test_repair_command(self):
+        last = self.comment('First')
+        Task.objects.update(comment_count=10, last_commented_at=None)
+
+        call_command('repair_comment_stats', '--batch-size', '1', stdout=StringIO())
+
+        self.task.refresh_from_db()
+        self.assertEqual((self.task.comment_count, self.task.last_commented_at), (1, last.created_at))
+
+    def test_list_by_activity(self):
+        quiet = Task.objects.create(title='Quiet', user=self.user)
+        self.comment('First')
+
+        response = self.client.get('/task/?ordering=activity')
+
+        self.assertEqual([task['title'] for task in response.data['results']], ['Task', 'Quiet'])
+        self.assertEqual(response.data['results'][0]['comment_count'], 1)
+        self.assertEqual((response.data['results'][1]['comment_count'], quiet.last_commented_at), (0, None))
+
+    def test_list_as_columns(self):
+        first = self.comment('First')
+        second = self.comment('Second')
+
+        table = self.client.get('/comment/?format=columnar').json()['data']
+
+        self.assertEqual(table['fields'], ['id', 'text', 'created_at', 'version', 'task', 'user'])
+        self.assertEqual(table['columns'][:2], [[first.id, second.id], ['First', 'Second']])
+        self.assertEqual(table['deltas'], ['created_at'])
+        self.assertEqual(sum(table['columns'][2]), round(second.created_at.timestamp() * 1_000_000))
+
+
+class StructuredLoggingTests(APITestCase):
+
+    def test_comment_create_is_logged_with_fields(self):
+        user = User.objects.create_user(username='user', password='password')
+        task = Task.objects.create(title='Task', user=user)
+        self.client.force_authenticate(user)
+
+        with self.assertLogs('comment', 'INFO') as logs:
+            self.client.post('/comment/', {'task': task.id, 'text': 'Comment'}, format='json')
+
+        record = logs.records[0]
+        self.assertEqual((record.getMessage(), record.task_id, record.user_id), ('Comment created', task.id, user.id))
+
+    def test_background_handler_writes_json_lines(self):
+        stream = StringIO()
+        handler = BackgroundHandler(stream=stream)
+        handler.setFormatter(JSONFormatter())
+        logger = logging.getLogger('comment.tests.background')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        logger.warning('Comment %s created', 1, extra={'task_id': 2})
+        handler.close()
+
+        line = json.loads(stream.getvalue())
+        self.assertEqual({key: line[key] for key in ('level', 'logger', 'message', 'task_id')},
+                         {'level': 'WARNING', 'logger': 'comment.tests.background', 'message': 'Comment 1 created',
+                          'task_id': 2})
+
+    def test_sampling_per_logger(self):
+        sampling = SamplingFilter({'comment': 0.0, 'comment.views': 1.0})
+
+        def keeps(name, level=logging.INFO):
+            return sampling.filter(logging.LogRecord(name, level, '', 0, 'message', (), None))
+
+        self.assertFalse(keeps('comment.serializers'))
+        self.assertTrue(keeps('comment.views'))
+        self.assertTrue(keeps('comment.serializers', logging.WARNING))
+        self.assertTrue(keeps('task.views'))
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class AttachmentTests(APITestCase):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        settings_override = override_settings(ATTACHMENTS={'ROOT': self.root, 'MAX_SIZE': 1024, 'ACCEL_REDIRECT': ''})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username='user', password='password')
+        self.task = Task.objects.create(title='Task', user=self.user)
+        self.comment = Comment.objects.create(text='Comment', task=self.task, user=self.user)
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content, name='notes.txt', comment=None):
+        return self.client.post(f'/comment/{(comment or self.comment).id}/attachments/',
+                                {'file': SimpleUploadedFile(name, content, content_type='text/plain')},
+                                format='multipart')
+
+    def test_upload_is_stored_once_per_content(self):
+        first = self.upload(b'0123456789')
+        second = self.upload(b'0123456789', name='copy.txt')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.data['data']['sha256'], second.data['data']['sha256'])
+        self.assertEqual(first.data['data']['size'], 10)
+        self.assertEqual([path.name for path in self.root.glob('*/*')], [first.data['data']['sha256']])
+        self.assertEqual(list(self.root.glob('.upload-*')), [])
+        response = self.client.get(f'/comment/{self.comment.id}/attachments/')
+        self.assertEqual([attachment['name'] for attachment in response.data['data']], ['notes.txt', 'copy.txt'])
+
+    def test_too_large(self):
+        response = self.upload(b'x' * 2048)
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(list(self.root.rglob('*')), [])
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_download_and_ranges(self):
+        attachment_id = self.upload(b'0123456789').data['data']['id']
+        url = f'/comment/{self.comment.id}/attachments/{attachment_id}/'
+
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (200, b'0123456789'))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="notes.txt"')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=2-4')
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (206, b'234'))
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ('bytes 2-4/10', '3'))
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+        response = self.client.get(url, HTTP_RANGE='bytes=20-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+
+    def test_download_in_a_batch(self):
+        attachment_id = self.upload(b'0123456789').data['data']['id']
+        url = f'/comment/{self.comment.id}/attachments/{attachment_id}/'
+        files = []
+
+        def tracked_open(*args):
+            files.append(open(*args))
+            return files[-1]
+
+        with mock.patch('comment.attachments.open', tracked_open, create=True):
+            response = self.client.post('/batch/', {'requests': [{'method': 'GET', 'path': url}]}, format='json')
+
+        # the file is not sent in the batch, but closed
+        self.assertEqual(response.data['data'], [{'status': 200, 'body': None}])
+        self.assertEqual([file.closed for file in files], [True])
+
+    def test_accel_redirect(self):
+        attachment = self.upload(b'0123456789').data['data']
+
+        with override_settings(ATTACHMENTS={'ROOT': self.root, 'ACCEL_REDIRECT': '/protected/attachments/'}):
+            response = self.client.get(f'/comment/{self.comment.id}/attachments/{attachment["id"]}/')
+
+        sha256 = attachment['sha256']
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/attachments/{sha256[:2]}/{sha256}')
+        self.assertEqual(response.content, b'')
+
+    def test_other_users(self):
+        attachment_id = self.upload(b'0123456789').data['data']['id']
+        self.client.force_authenticate(User.objects.create_user(username='other', password='password'))
+
+        self.assertEqual(self.client.get(f'/comment/{self.comment.id}/attachments/{attachment_id}/').status_code, 404)
+        self.assertEqual(self.upload(b'mine').status_code, 404)
+
+    def test_prune(self):
+        kept = self.upload(b'kept').data['data']['sha256']
+        pruned = self.upload(b'pruned').data['data']['sha256']
+        Comment.objects.create(text='Other', task=self.task, user=self.user)
+        Attachment.objects.filter(sha256=pruned).update(comment_id=self.comment.id + 100)
+        stale = self.root / '.upload-stale'
+        stale.touch()
+        os.utime(stale, (0, 0))
+
+        call_command('prune_attachments', '--min-age', '0', stdout=StringIO())
+
+        self.assertEqual([attachment.sha256 for attachment in Attachment.objects.all()], [kept])
+        self.assertEqual([path.name for path in self.root.glob('*/*')], [kept])
+        self.assertFalse(stale.exists())
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class CommentQueryBudgetTests(QueryBudgetTestMixin, APITestCase):
+    sizes = (1, 100, 10000)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.task = Task.objects.create(title='Task', user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def grow_comments(self, size):
+        count = Comment.objects.count()
+        Comment.objects.bulk_create(Comment(text=f'Comment {i}', task=self.task, user=self.user)
+                                    for i in range(count, size))
+
+    def test_list(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_comments(size)
+                self.assertWithinQueryBudget(CommentListCreateView, 'GET', '/comment/')
+                self.assertWithinQueryBudget(CommentListCreateView, 'GET', f'/comment/?task={self.task.id}')
+
+    def test_create(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_comments(size)
+                self.assertWithinQueryBudget(CommentListCreateView, 'POST', '/comment/',
+                                             {'task': self.task.id, 'text': 'Comment'})
+
+    def test_detail(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_comments(size)
+                comment = Comment.objects.last()
+                data = {'task': self.task.id, 'text': 'Updated'}
+                self.assertWithinQueryBudget(CommentDetailView, 'GET', f'/comment/{comment.id}/')
+                self.assertWithinQueryBudget(CommentDetailView, 'PUT', f'/comment/{comment.id}/', data)
+                self.assertWithinQueryBudget(CommentDetailView, 'PATCH', f'/comment/{comment.id}/', {'text': 'New'})
+                self.assertWithinQueryBudget(CommentDetailView, 'DELETE', f'/comment/{comment.id}/')
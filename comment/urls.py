@@ -1,8 +1,11 @@
 from django.urls import path
 
-from .views import CommentListCreateView, CommentDetailView
+from .views import CommentListCreateView, CommentDetailView, CommentAttachmentListView, CommentAttachmentDetailView
 
 urlpatterns = [
     path('', CommentListCreateView.as_view(), name='comment-list-create'),
     path('<int:comment_id>/', CommentDetailView.as_view(), name='comment-detail'),
+    path('<int:comment_id>/attachments/', CommentAttachmentListView.as_view(), name='comment-attachment-list'),
+    path('<int:comment_id>/attachments/<int:attachment_id>/', CommentAttachmentDetailView.as_view(),
+         name='comment-attachment-detail'),
     ]
@@ -1,16 +1,31 @@
+import logging
+
 from rest_framework import status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
 from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiResponse, OpenApiParameter
 
-from .models import Comment
-from .serializers import CommentSerializer
+from task import history
+from task.models import Task, TaskHistory
+from todo_proweb.concurrency import get_expected_version, VersionConflict, IF_MATCH_PARAMETER
+from todo_proweb.idempotency import idempotent, IDEMPOTENCY_KEY_PARAMETER
+
+from . import attachments
+from .models import Attachment, Comment
+from .serializers import AttachmentSerializer, CommentSerializer
+
+logger = logging.getLogger(__name__)
 
 
 class CommentListCreateView(APIView):
+    # commenting on an occurrence of a recurring task saves it first, with its labels and collaborators
+    query_budget = {'GET': 2, 'POST': 8}
+
     @extend_schema(
         request=CommentSerializer,
+        parameters=[IDEMPOTENCY_KEY_PARAMETER],
         responses={
             201: OpenApiResponse(
                 description='Comment created',
@@ -61,8 +76,11 @@ class CommentListCreateView(APIView):
             )
         },
     )
+    @idempotent
     def post(self, request):
-        print(f"{request.data=}")
+        # ids and sizes only, the text is the user's and the body is not parsed for the log
+        logger.debug('Comment requested', extra={'user_id': request.user.id,
+                                                 'size': int(request.META.get('CONTENT_LENGTH') or 0)})
         serializer = CommentSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             serializer.save()
@@ -151,7 +169,8 @@ class CommentListCreateView(APIView):
     )
     def get(self, request):
         try:
-            comments = Comment.objects.filter(user=request.user)
+            # comments of everyone on the tasks the user owns or collaborates on
+            comments = Comment.objects.filter(task__in=Task.objects.visible_to(request.user))
 
             task = request.query_params.get('task', None)
             if task:
@@ -175,6 +194,8 @@ class CommentListCreateView(APIView):
 
 
 class CommentDetailView(APIView):
+    query_budget = {'GET': 2, 'PUT': 3, 'PATCH': 3, 'DELETE': 4}
+
     @extend_schema(
         responses={
             200: OpenApiResponse(
@@ -228,7 +249,7 @@ class CommentDetailView(APIView):
                 "msg": "Comment retrieved",
                 "data": serializer.data
             }
-            return Response(data, status=status.HTTP_200_OK)
+            return Response(data, status=status.HTTP_200_OK, headers={'ETag': f'"{comment.version}"'})
         except Comment.DoesNotExist:
             return Response({"error": "Comment not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
@@ -236,6 +257,7 @@ class CommentDetailView(APIView):
 
     @extend_schema(
         request=CommentSerializer,
+        parameters=[IF_MATCH_PARAMETER],
         responses={
             200: OpenApiResponse(
                 response=CommentSerializer,
@@ -285,6 +307,17 @@ class CommentDetailView(APIView):
                     )
                 ]
             ),
+            409: OpenApiResponse(
+                description='Comment was changed by another request',
+                examples=[
+                    OpenApiExample(
+                        'Version conflict',
+                        value={
+                            'error': 'Comment was modified by another request'
+                        }
+                    )
+                ]
+            ),
             500: OpenApiResponse(
                 description='Internal server error',
                 examples=[
@@ -299,24 +332,11 @@ class CommentDetailView(APIView):
         },
     )
     def put(self, request, comment_id):
-        try:
-            comment = Comment.objects.get(id=comment_id, user=request.user)
-        except Comment.DoesNotExist:
-            return Response({"error": "Comment not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        serializer = CommentSerializer(comment, data=request.data, context={'request': request})
-        if serializer.is_valid():
-            serializer.save()
-            data = {
-                "status": "success",
-                "msg": "Comment updated",
-                "data": serializer.data
-            }
-            return Response(data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return self._update(request, comment_id, partial=False)
 
     @extend_schema(
         request=CommentSerializer,
+        parameters=[IF_MATCH_PARAMETER],
         responses={
             200: OpenApiResponse(
                 response=CommentSerializer,
@@ -366,6 +386,17 @@ class CommentDetailView(APIView):
                     )
                 ]
             ),
+            409: OpenApiResponse(
+                description='Comment was changed by another request',
+                examples=[
+                    OpenApiExample(
+                        'Version conflict',
+                        value={
+                            'error': 'Comment was modified by another request'
+                        }
+                    )
+                ]
+            ),
             500: OpenApiResponse(
                 description='Internal server error',
                 examples=[
@@ -380,21 +411,34 @@ class CommentDetailView(APIView):
         },
     )
     def patch(self, request, comment_id):
+        return self._update(request, comment_id, partial=True)
+
+    def _update(self, request, comment_id, partial):  # noqa
+        serializer = CommentSerializer(data=request.data, context={'request': request}, partial=partial)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        changes = {'text': serializer.validated_data['text']} if 'text' in serializer.validated_data else {}
         try:
-            comment = Comment.objects.get(id=comment_id, user=request.user)
+            comment = Comment.objects.filter(id=comment_id, user=request.user).versioned_update(
+                get_expected_version(request), with_previous=True, **changes
+            )
         except Comment.DoesNotExist:
             return Response({"error": "Comment not found"}, status=status.HTTP_404_NOT_FOUND)
+        except VersionConflict:
+            return Response({"error": "Comment was modified by another request"}, status=status.HTTP_409_CONFLICT)
 
-        serializer = CommentSerializer(comment, data=request.data, context={'request': request}, partial=True)
-        if serializer.is_valid():
-            serializer.save()
-            data = {
-                "status": "success",
-                "msg": "Comment updated",
-                "data": serializer.data
-            }
-            return Response(data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        changes = history.diff(comment.previous, changes)
+        if changes:
+            history.record(comment.task_id, request.user.id, TaskHistory.UPDATED, changes, comment_id=comment.id,
+                           using=comment._state.db)
+
+        data = {
+            "status": "success",
+            "msg": "Comment updated",
+            "data": CommentSerializer(comment).data
+        }
+        return Response(data, status=status.HTTP_200_OK, headers={'ETag': f'"{comment.version}"'})
 
     @extend_schema(
         responses={
@@ -442,9 +486,164 @@ class CommentDetailView(APIView):
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         comment.delete()
+        history.record(comment.task_id, request.user.id, TaskHistory.DELETED,
+                       history.snapshot(comment, history.COMMENT_FIELDS, deleted=True), comment_id=comment_id,
+                       using=comment._state.db)
         data = {
             "status": "success",
             "msg": "Comment deleted"
         }
         return Response(data, status=status.HTTP_200_OK)
 
+
+class CommentAttachmentListView(APIView):
+    query_budget = {'GET': 2, 'POST': 3}
+    parser_classes = [MultiPartParser]
+
+    def initialize_request(self, request, *args, **kwargs):
+        # set before anything reads the body, so uploads stream to disk instead of memory
+        self.upload_handler = attachments.HashingUploadHandler(request)
+        request.upload_handlers = [self.upload_handler]
+        return super().initialize_request(request, *args, **kwargs)
+
+    @extend_schema(
+        responses={
+            200: OpenApiResponse(
+                response=AttachmentSerializer(many=True),
+                description='Attachments of the comment',
+                examples=[
+                    OpenApiExample(
+                        'Attachments retrieved',
+                        value={
+                            'status': 'success',
+                            'msg': 'Attachments retrieved',
+                            'data': [
+                                {
+                                    'id': 1,
+                                    'comment': 1,
+                                    'user': 1,
+                                    'name': 'screenshot.png',
+                                    'content_type': 'image/png',
+                                    'size': 48213,
+                                    'sha256': '9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08',
+                                    'created_at': '2021-01-01T00:00:00Z'
+                                }
+                            ]
+                        }
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request, comment_id):
+        attachments = Attachment.objects.filter(
+            comment_id=comment_id, comment__task__in=Task.objects.visible_to(request.user)
+        ).order_by('id')
+        data = {
+            "status": "success",
+            "msg": "Attachments retrieved",
+            "data": AttachmentSerializer(attachments, many=True).data
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        request={
+            'multipart/form-data': {
+                'type': 'object',
+                'properties': {'file': {'type': 'string', 'format': 'binary'}},
+                'required': ['file']
+            }
+        },
+        responses={
+            201: OpenApiResponse(
+                response=AttachmentSerializer,
+                description='Attachment uploaded. Files with the same content are stored once.'
+            ),
+            400: OpenApiResponse(
+                description='No file uploaded',
+                examples=[OpenApiExample('No file uploaded', value={'error': 'No file uploaded'})]
+            ),
+            404: OpenApiResponse(
+                description='Comment not found',
+                examples=[OpenApiExample('Comment not found', value={'error': 'Comment not found'})]
+            ),
+            413: OpenApiResponse(
+                description='File too large',
+                examples=[OpenApiExample('File too large', value={'error': 'File too large'})]
+            )
+        }
+    )
+    def post(self, request, comment_id):
+        max_size = attachments.get_max_size()
+        # the multipart framing adds a little on top of the file
+        if int(request.META.get('CONTENT_LENGTH') or 0) > max_size + 64 * 1024:
+            return Response({"error": "File too large"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        try:
+            comment = Comment.objects.only('id', 'task_id').get(id=comment_id, user=request.user)
+        except Comment.DoesNotExist:
+            return Response({"error": "Comment not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        upload = request.FILES.get('file')
+        if self.upload_handler.too_large:
+            return Response({"error": "File too large"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if upload is None:
+            return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+
+        attachment = Attachment.objects.using(comment._state.db).create(
+            comment=comment, user=request.user, name=upload.name[:255],
+            content_type=upload.content_type or 'application/octet-stream', size=upload.size, sha256=upload.sha256
+        )
+        data = {
+            "status": "success",
+            "msg": "Attachment uploaded",
+            "data": AttachmentSerializer(attachment).data
+        }
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class CommentAttachmentDetailView(APIView):
+    query_budget = {'GET': 2, 'DELETE': 3}
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(name='Range', type=str, location=OpenApiParameter.HEADER, required=False,
+                             description="A single byte range, e.g. `bytes=0-1023`, to download part of the file"),
+        ],
+        responses={
+            (200, 'application/octet-stream'): OpenApiResponse(description='The file'),
+            (206, 'application/octet-stream'): OpenApiResponse(description='The requested range of the file'),
+            404: OpenApiResponse(
+                description='Attachment not found',
+                examples=[OpenApiExample('Attachment not found', value={'error': 'Attachment not found'})]
+            ),
+            416: OpenApiResponse(description='The range is outside the file')
+        }
+    )
+    def get(self, request, comment_id, attachment_id):
+        try:
+            attachment = Attachment.objects.get(
+                id=attachment_id, comment_id=comment_id, comment__task__in=Task.objects.visible_to(request.user)
+            )
+        except Attachment.DoesNotExist:
+            return Response({"error": "Attachment not found"}, status=status.HTTP_404_NOT_FOUND)
+        return attachments.serve(request, attachment)
+
+    @extend_schema(
+        responses={
+            200: OpenApiResponse(
+                description='Attachment deleted',
+                examples=[
+                    OpenApiExample('Attachment deleted', value={'status': 'success', 'msg': 'Attachment deleted'})
+                ]
+            ),
+            404: OpenApiResponse(
+                description='Attachment not found',
+                examples=[OpenApiExample('Attachment not found', value={'error': 'Attachment not found'})]
+            )
+        }
+    )
+    def delete(self, request, comment_id, attachment_id):
+        deleted, _ = Attachment.objects.filter(id=attachment_id, comment_id=comment_id, user=request.user).delete()
+        if not deleted:
+            return Response({"error": "Attachment not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"status": "success", "msg": "Attachment deleted"}, status=status.HTTP_200_OK)
@@ -4,9 +4,25 @@ import os
 load_dotenv()
 
 SECRET_KEY = os.getenv('SECRET_KEY')
-DEBUG = os.getenv('DEBUG')
+DEBUG = os.getenv('DEBUG', 'False').lower() in ('true', '1')
 DB_HOST = os.getenv('DB_HOST')
 DB_PORT = os.getenv('DB_PORT')
 DB_NAME = os.getenv('DB_NAME')
 DB_USER = os.getenv('DB_USER')
 DB_PASS = os.getenv('DB_PASS')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+DB_REPLICA_HOSTS = os.getenv('DB_REPLICA_HOSTS', '')
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 5))
+DB_SHARD_HOSTS = os.getenv('DB_SHARD_HOSTS', '')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')
+ATTACHMENTS_ROOT = os.getenv('ATTACHMENTS_ROOT', '')
+ATTACHMENT_MAX_SIZE = int(os.getenv('ATTACHMENT_MAX_SIZE', 25 * 1024 * 1024))
+ATTACHMENTS_ACCEL_REDIRECT = os.getenv('ATTACHMENTS_ACCEL_REDIRECT', '')
+PROFILING_DIR = os.getenv('PROFILING_DIR', '')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', 100))
+AUTOSAVE_ENABLED = os.getenv('AUTOSAVE_ENABLED', 'False').lower() in ('true', '1')
+AUTOSAVE_WINDOW = float(os.getenv('AUTOSAVE_WINDOW', 2))
+AUTOSAVE_CACHE = os.getenv('AUTOSAVE_CACHE', 'shared')
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', '')
@@ -0,0 +1,20 @@
+# Read by gunicorn from the working directory, next to the options given on the command line.
+
+
+def post_worker_init(worker):
+    # warm up before the worker accepts its first request, connections are opened after the fork
+    from todo_proweb.warmup import warm_up
+
+    try:
+        warm_up()
+    except Exception:  # noqa
+        worker.log.exception('Warm-up failed, GET /health/ready/ retries it')
+
+
+def worker_exit(server, worker):
+    # write the pending autosaves, then the buffered history records or spool them, before the worker goes away
+    from task.autosave import autosave_buffer
+    from task.history import history_buffer
+
+    autosave_buffer.close()
+    history_buffer.flush()
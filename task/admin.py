@@ -1,7 +1,24 @@
 from django.contrib import admin
 
 from task.models import Task
+from todo_proweb.admin import ShardedModelAdmin
+from todo_proweb.pagination import EstimatedCountPaginator
 
 # Register your models here.
 
-admin.site.register(Task)
+
+@admin.register(Task)
+class TaskAdmin(ShardedModelAdmin):
+    list_display = ('id', 'title', 'status', 'due_date', 'user', 'comment_count', 'updated_at')
+    list_select_related = ('user',)
+    # both are indexed together with the id the changelist orders by
+    list_filter = ('status', 'due_date')
+    ordering = ('-id',)
+    autocomplete_fields = ('user',)
+    # a select of every user's labels would not scale
+    raw_id_fields = ('labels',)
+    # moves have to rewrite the paths of the subtree, see Task.move_to()
+    readonly_fields = ('version', 'comment_count', 'last_commented_at', 'parent', 'subtask_count',
+                       'completed_subtask_count', 'recurrence_of', 'original_due_date')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
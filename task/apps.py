@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class TaskConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'task'
+
+    def ready(self):
+        from . import autosave
+
+        checks.register(autosave.check_cache, checks.Tags.caches)
@@ -0,0 +1,292 @@
+import atexit
+import contextlib
+import logging
+import threading
+import time
+import uuid
+from itertools import islice
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import close_old_connections
+from drf_spectacular.utils import OpenApiParameter
+
+from . import history
+from .models import Task, TaskHistory
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Autosave'
+# what an editor autosaves, patches that change anything else are written right away
+FIELDS = ('title', 'description')
+
+AUTOSAVE_PARAMETER = OpenApiParameter(
+    name=HEADER, type=str, location=OpenApiParameter.HEADER, required=False,
+    description="`1` to have a change of only the title and description merged with the next ones to the task "
+                "and written within seconds, answered with 202. Reads return it right away."
+)
+
+WRITES_KEY = 'autosave:writes'
+SAVED_KEY = 'autosave:saved'
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'AUTOSAVE', {}).get(name, default)
+
+
+def _get_cache():
+    return caches[_get_setting('CACHE', 'default')]
+
+
+def _key(task_id):
+    return f'autosave:task:{task_id}'
+
+
+def _cache_problem():
+    """Why the configured cache cannot hold the pending changes, ``None`` if it can."""
+    alias = _get_setting('CACHE', 'default')
+    if alias not in settings.CACHES:
+        return f'there is no {alias!r} cache'
+    cache = caches[alias]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        # every process has its own copy of these, other workers would neither read nor write the changes
+        return f'the {alias!r} cache is not shared between processes'
+    if isinstance(cache, DatabaseCache):
+        # every autosave would lock, merge and count its changes with writes to the database it should spare
+        return f'the {alias!r} cache is kept in the database'
+    return None
+
+
+def is_enabled():
+    return _get_setting('ENABLED', False) and _cache_problem() is None
+
+
+def check_cache(**kwargs):
+    problem = _get_setting('ENABLED', False) and _cache_problem()
+    if problem:
+        return [checks.Warning(
+            f'Autosave is off, {problem}.',
+            hint="Set CACHE_REDIS_URL for the 'shared' cache, or AUTOSAVE['CACHE'] to another cache all workers "
+                 "share outside the database, such as memcached.",
+            id='task.W001',
+        )]
+    return []
+
+
+def accepts(request, changes):
+    """Whether the validated ``changes`` of a PATCH ``request`` can be written later, merged with the next ones."""
+    return (is_enabled() and request.method == 'PATCH' and request.headers.get(HEADER, '').lower() in ('1', 'true')
+            and 'HTTP_IF_MATCH' not in request.META and 'version' not in request.data
+            and bool(changes) and set(changes) <= set(FIELDS))
+
+
+def _increment(key):
+    cache = _get_cache()
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted in the meantime
+        cache.add(key, 1, None)
+
+
+class Locked(Exception):
+    """The pending changes of a task stayed locked by another request for longer than ``AUTOSAVE['LOCK_WAIT']``."""
+
+
+@contextlib.contextmanager
+def _locked(task_id):
+    """
+    Holds the lock on the pending changes of a task, shared by every process using the same cache.
+    Raises ``Locked`` if it cannot be taken in time.
+    """
+    cache = _get_cache()
+    key = f'{_key(task_id)}:lock'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + _get_setting('LOCK_WAIT', 1)
+    # the lock expires after LOCK_TIMEOUT, so a process that died holding it does not block the task
+    while not cache.add(key, token, _get_setting('LOCK_TIMEOUT', 5)):
+        if time.monotonic() > deadline:
+            raise Locked(task_id)
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        # unless it expired and another process holds it now
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def stats():
+    """How many autosaves were written to the database and how many writes were saved by merging them."""
+    cache = _get_cache()
+    return {'writes': cache.get(WRITES_KEY, 0), 'writes_saved': cache.get(SAVED_KEY, 0)}
+
+
+def has_pending(task_id):
+    """Whether task ``task_id`` has changes waiting to be written. Takes one cache lookup."""
+    return _get_cache().get(_key(task_id)) is not None
+
+
+def write(task_id):
+    """
+    Writes the pending changes of task ``task_id`` with one UPDATE and records them in its history.
+    Returns whether there were any. Raises ``Locked`` while another request holds them.
+    """
+    cache = _get_cache()
+    # most tasks have nothing pending, they are not locked
+    if not has_pending(task_id):
+        return False
+    with _locked(task_id):
+        entry = cache.get(_key(task_id))
+        if entry is None:
+            return False
+        try:
+            task = Task.objects.using(entry['using']).filter(pk=task_id).versioned_update(
+                with_previous=True, **entry['changes']
+            )
+        except Task.DoesNotExist:
+            # deleted in the meantime
+            task = None
+        cache.delete(_key(task_id))
+    _increment(WRITES_KEY)
+    if task is not None:
+        changes = history.diff(task.previous, entry['changes'])
+        if changes:
+            history.record(task.id, entry['user_id'], TaskHistory.UPDATED, changes, using=task._state.db)
+    return True
+
+
+def write_pending(task_ids):
+    """
+    Writes the pending changes of the tasks among ``task_ids`` that have any, looking them up 500 at a time.
+    ``task_ids`` can be an iterator, the tasks are written once it is exhausted.
+    """
+    task_ids = iter(task_ids)
+    pending = []
+    while chunk := list(islice(task_ids, 500)):
+        pending.extend(int(key.rsplit(':', 1)[1]) for key in _get_cache().get_many([_key(pk) for pk in chunk]))
+    for task_id in pending:
+        write(task_id)
+
+
+def discard(task_id):
+    """Drops the pending changes of task ``task_id``, which is deleted."""
+    if _get_cache().get(_key(task_id)) is None:
+        return
+    with _locked(task_id):
+        _get_cache().delete(_key(task_id))
+
+
+def apply_pending(tasks):
+    """Sets the pending changes of ``tasks`` on them, so users read their own autosaves. Takes one cache lookup."""
+    if not is_enabled():
+        return
+    by_key = {_key(task.pk): task for task in tasks if task.pk is not None}
+    window = _get_setting('WINDOW', 2)
+    for key, entry in _get_cache().get_many(list(by_key)).items():
+        task = by_key[key]
+        for name, value in entry['changes'].items():
+            setattr(task, name, value)
+        if window and time.time() - entry['since'] > 2 * window:
+            # the process that buffered it is gone without writing it
+            autosave_buffer.schedule(task.pk, 0)
+
+
+class AutosaveBuffer:
+    """
+    Merges the autosaved changes of a task in the cache configured by ``AUTOSAVE['CACHE']``, where
+    reads of every process pick them up, and writes them ``AUTOSAVE['WINDOW']`` seconds after the
+    first one from a background thread. Every process that merged changes into a task writes them
+    when it exits, whichever comes first writes them once. Without a window the changes are only
+    written by calling ``flush()``.
+    """
+
+    def __init__(self):
+        # task id -> time.monotonic() to write its changes at
+        self.deadlines = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def add(self, task, user_id, changes):
+        """Merges ``changes`` into the pending changes of ``task`` and returns all of them."""
+        cache = _get_cache()
+        with _locked(task.pk):
+            entry = cache.get(_key(task.pk))
+            merged = entry is not None
+            if entry is None:
+                entry = {'using': task._state.db, 'changes': {}, 'since': time.time()}
+            entry['user_id'] = user_id
+            entry['changes'].update(changes)
+            cache.set(_key(task.pk), entry, _get_setting('PENDING_TIMEOUT', 60 * 60))
+        if merged:
+            _increment(SAVED_KEY)
+        self.schedule(task.pk, _get_setting('WINDOW', 2))
+        return entry['changes']
+
+    def schedule(self, task_id, delay):
+        window = _get_setting('WINDOW', 2)
+        with self.lock:
+            if task_id in self.deadlines:
+                return
+            self.deadlines[task_id] = time.monotonic() + (delay or 0)
+            if window and (self.thread is None or not self.thread.is_alive()):
+                # started on first use, so a worker forked from a preloaded app gets its own
+                self.thread = threading.Thread(target=self._run, name='autosave-flush', daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                deadline = min(self.deadlines.values(), default=None)
+            self.wake.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+            self.wake.clear()
+            close_old_connections()
+            self.flush(due=True)
+
+    def flush(self, task_ids=None, due=False):
+        """
+        Writes the pending changes of ``task_ids``, by default of every task of this process, or only of
+        the ones that are ``due``. Changes that cannot be written are retried by the next flush, and
+        logged with their content when the process exits. Returns how many tasks were written.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if task_ids is None:
+                task_ids = [pk for pk, deadline in self.deadlines.items() if not due or deadline <= now]
+            for pk in task_ids:
+                self.deadlines.pop(pk, None)
+        written = 0
+        for pk in task_ids:
+            try:
+                written += write(pk)
+            except Exception:
+                # the database, or the cache of the changes, is down or the task is locked. Caught whatever the
+                # cache backend raises, so the flush thread keeps running
+                logger.exception('Could not write the autosaved changes of task %s', pk)
+                with self.lock:
+                    self.deadlines.setdefault(pk, now + (_get_setting('WINDOW', 2) or 0))
+        return written
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            lost = list(self.deadlines)
+        for pk in lost:
+            try:
+                changes = (_get_cache().get(_key(pk)) or {}).get('changes')
+            except Exception:
+                # the cache is down, the loss is logged without the changes
+                changes = None
+            logger.error('Autosaved changes of task %s were not written', pk, extra={'task_id': pk, 'changes': changes})
+
+
+autosave_buffer = AutosaveBuffer()
+# registered after the history buffer, so it runs first and the history of the last writes is flushed too
+atexit.register(autosave_buffer.close)
@@ -0,0 +1,159 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, DatabaseError, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import TaskHistory
+
+logger = logging.getLogger(__name__)
+
+TASK_FIELDS = ('title', 'description', 'status', 'due_date')
+COMMENT_FIELDS = ('text',)
+SPOOLED_FIELDS = ('task_id', 'comment_id', 'user_id', 'action', 'changes', 'created_at')
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'HISTORY', {}).get(name, default)
+
+
+def diff(previous, changes):
+    """Returns ``{field: [old, new]}`` for every field of ``changes`` whose value differs from ``previous``."""
+    return {name: [previous.get(name), value] for name, value in changes.items() if previous.get(name) != value}
+
+
+def snapshot(instance, fields, deleted=False):
+    """Returns ``{field: [None, value]}`` of a created ``instance``, or ``{field: [value, None]}`` of a deleted one."""
+    values = {name: getattr(instance, name) for name in fields}
+    return {name: [value, None] if deleted else [None, value] for name, value in values.items()}
+
+
+def _database(record):
+    # the database of the task given to record(), else the one the router picks
+    return record._state.db or router.db_for_write(TaskHistory, instance=record)
+
+
+def _write(records):
+    by_database = {}
+    for record in records:
+        by_database.setdefault(_database(record), []).append(record)
+    for using, database_records in by_database.items():
+        TaskHistory.objects.using(using).bulk_create(database_records, batch_size=1000)
+
+
+def _spool(records):
+    spool_dir = Path(_get_setting('SPOOL_DIR', 'history_spool'))
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    path = spool_dir / f'history-{os.getpid()}-{time.time_ns()}.ndjson'
+    with open(path, 'w') as f:
+        for record in records:
+            data = {name: getattr(record, name) for name in SPOOLED_FIELDS}
+            f.write(json.dumps({**data, 'database': record._state.db}, cls=DjangoJSONEncoder))
+            f.write('\n')
+    logger.warning('Spooled %d history records to %s', len(records), path)
+
+
+def replay_spool():
+    """Writes the records spooled by any process to the database. Returns how many were written."""
+    spool_dir = Path(_get_setting('SPOOL_DIR', 'history_spool'))
+    written = 0
+    for path in sorted(spool_dir.glob('history-*.ndjson')):
+        claimed = path.with_suffix('.replaying')
+        try:
+            # only one process gets to rename the file
+            path.rename(claimed)
+        except OSError:
+            continue
+        records = []
+        with open(claimed) as f:
+            for data in map(json.loads, f):
+                database = data.pop('database', None)
+                records.append(TaskHistory(**{**data, 'created_at': parse_datetime(data['created_at'])}))
+                records[-1]._state.db = database
+        try:
+            _write(records)
+        except DatabaseError:
+            claimed.rename(path)
+            raise
+        claimed.unlink()
+        written += len(records)
+    return written
+
+
+class HistoryBuffer:
+    """
+    Keeps history records in process and writes them with ``bulk_create``, from a background thread
+    every ``HISTORY['FLUSH_INTERVAL']`` seconds or as soon as ``HISTORY['BUFFER_SIZE']`` are waiting.
+    Records that cannot be written, also on shutdown, are spooled to ``HISTORY['SPOOL_DIR']`` and
+    written by the next process that starts flushing. Without a flush interval the buffer is only
+    flushed when full or by calling ``flush()``.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def add(self, record):
+        interval = _get_setting('FLUSH_INTERVAL', 2)
+        with self.lock:
+            self.records.append(record)
+            full = len(self.records) >= _get_setting('BUFFER_SIZE', 500)
+            if interval and (self.thread is None or not self.thread.is_alive()):
+                # started on first use, so a worker forked from a preloaded app gets its own
+                self.thread = threading.Thread(target=self._run, args=(interval,), name='history-flush', daemon=True)
+                self.thread.start()
+        if full:
+            if interval:
+                self.wake.set()
+            else:
+                self.flush()
+
+    def _run(self, interval):
+        close_old_connections()
+        try:
+            replay_spool()
+        except DatabaseError:
+            logger.exception('Could not write spooled history records')
+        while True:
+            self.wake.wait(interval)
+            self.wake.clear()
+            close_old_connections()
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered records, spooling them if the database fails. Returns how many there were."""
+        with self.lock:
+            records, self.records = self.records, []
+        if records:
+            try:
+                _write(records)
+            except DatabaseError:
+                logger.exception('Could not write %d history records', len(records))
+                _spool(records)
+        return len(records)
+
+
+history_buffer = HistoryBuffer()
+atexit.register(history_buffer.flush)
+
+
+def record(task_id, user_id, action, changes, comment_id=None, using=None):
+    """
+    Queues a history record of a change to a task, or to one of its comments, once the transaction
+    making the change commits. ``using`` is the database of the task, so the record is kept on its
+    owner's shard also when a collaborator ``user_id`` made the change.
+    """
+    entry = TaskHistory(task_id=task_id, comment_id=comment_id, user_id=user_id, action=action, changes=changes,
+                        created_at=timezone.now())
+    entry._state.db = using
+    transaction.on_commit(lambda: history_buffer.add(entry), using=_database(entry))
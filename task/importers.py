@@ -0,0 +1,242 @@
+import codecs
+import csv
+import datetime
+import io
+import json
+
+from django.core.validators import MaxLengthValidator, MinLengthValidator, ProhibitNullCharactersValidator
+from django.db import connections, router, transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.fields import empty, SkipField
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+
+from . import history
+from .models import Task
+from .serializers import TaskSerializer
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+# the columns of a task that are imported, rows that set any other field of TaskSerializer are reported
+IMPORT_FIELDS = ('title', 'description', 'status', 'due_date', 'recurrence', 'recurrence_interval', 'recurrence_until')
+INSERT_COLUMNS = (
+    'title', 'description', 'status', 'due_date', 'user_id', 'created_at', 'updated_at', 'version', 'comment_count',
+    'path', 'subtask_count', 'completed_subtask_count', 'recurrence', 'recurrence_interval', 'recurrence_until'
+)
+DATETIME_INDEXES = [INSERT_COLUMNS.index(name) for name in ('due_date', 'created_at', 'updated_at', 'recurrence_until')]
+
+
+def guess_format(name):
+    if name.lower().endswith('.csv'):
+        return 'csv'
+    if name.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
+
+
+def _iter_csv(lines):
+    for row in csv.DictReader(lines):
+        # an empty cell means the column was not given, as if the key was left out of a JSON body
+        yield {key: value for key, value in row.items() if value not in ('', None)}
+
+
+def _iter_ndjson(lines):
+    for line in lines:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield serializers.ValidationError({'non_field_errors': [f'Invalid JSON: {e.msg}']})
+
+
+# the validators DRF gives a CharField for its options, which _plain_text_check() covers
+_TEXT_VALIDATORS = (MaxLengthValidator, MinLengthValidator, ProhibitNullCharactersValidator,
+                    ProhibitSurrogateCharactersValidator)
+# JSON scalars, other values are not hashable or not worth remembering
+_CACHEABLE_TYPES = (str, int, float, bool, type(None))
+_SKIPPED = object()
+
+
+def _plain_text_check(field):
+    """
+    Returns a check that a value passes ``field``, a ``CharField``, unchanged: printable ASCII, without
+    surrounding spaces and within the length limits, which covers what DRF's own validators check. Values
+    it does not accept still go through the field. ``None`` if the field has rules of its own.
+    """
+    if not all(isinstance(validator, _TEXT_VALIDATORS) for validator in field.validators):
+        return None
+    min_length, max_length = field.min_length or 1, field.max_length or float('inf')
+
+    def check(value):
+        return (type(value) is str and min_length <= len(value) <= max_length and value.isascii()
+                and value.isprintable() and value[0] != ' ' and value[-1] != ' ')
+    return check
+
+
+class TaskRowValidator:
+    """
+    Applies the field and ``validate_<field>`` rules of ``TaskSerializer`` to plain dicts.
+
+    Does what ``Serializer.to_internal_value`` does without its per-call overhead. The rules are
+    resolved once per import rather than per row: imported rows repeat the same statuses, due dates
+    and recurrences, whose validated values are memoized, and plain text passes a check compiled from
+    the field. Only ``IMPORT_FIELDS`` are validated, a row with a value for another writable field is
+    invalid.
+    """
+    max_cached_values = 10000
+
+    def __init__(self, context=None):
+        serializer = TaskSerializer(context=context or {})
+        writable = list(serializer._writable_fields)
+        self.fields = []
+        for field in writable:
+            if field.field_name not in IMPORT_FIELDS:
+                continue
+            validate_method = getattr(serializer, f'validate_{field.field_name}', None)
+            text = isinstance(field, serializers.CharField)
+            self.fields.append((
+                field.field_name, field.run_validation, validate_method,
+                # free text rarely repeats, every other column does
+                not text, _plain_text_check(field) if text and validate_method is None else None,
+            ))
+        self.unsupported = [field.field_name for field in writable if field.field_name not in IMPORT_FIELDS]
+        self.cache = {}
+
+    def validate(self, row):
+        data = {}
+        errors = {name: ['This field cannot be imported.'] for name in self.unsupported if name in row}
+        for name, run_validation, validate_method, cacheable, is_plain_text in self.fields:
+            primitive = row.get(name, empty)
+            if is_plain_text is not None and is_plain_text(primitive):
+                data[name] = primitive
+                continue
+            key = (name, type(primitive), primitive)
+            cacheable = cacheable and (primitive is empty or isinstance(primitive, _CACHEABLE_TYPES))
+            if cacheable and key in self.cache:
+                value = self.cache[key]
+                if value is not _SKIPPED:
+                    data[name] = value
+                continue
+            try:
+                value = run_validation(primitive)
+                if validate_method is not None:
+                    value = validate_method(value)
+            except serializers.ValidationError as e:
+                errors[name] = e.detail
+                continue
+            except SkipField:
+                # a column that was left out
+                value = _SKIPPED
+            if cacheable and len(self.cache) < self.max_cached_values:
+                self.cache[key] = value
+            if value is not _SKIPPED:
+                data[name] = value
+
+        if errors:
+            raise serializers.ValidationError(errors)
+        return data
+
+
+def _copy_value(value):
+    if value is None:
+        return ''
+    return '"%s"' % str(value).replace('"', '""')
+
+
+def _insert(rows, using):
+    """
+    Inserts rows of ``INSERT_COLUMNS`` values with ``COPY`` on PostgreSQL and elsewhere with INSERTs of as
+    many rows as the database takes parameters, which saves a statement per row over ``executemany``.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(Task._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(column) for column in INSERT_COLUMNS)
+
+    # rows share created_at/updated_at and often due dates, so every datetime is converted once
+    converted = {None: None}
+
+    def convert(row, to_db):
+        row = list(row)
+        for index in DATETIME_INDEXES:
+            value = row[index]
+            if value not in converted:
+                converted[value] = to_db(value)
+            row[index] = converted[value]
+        return row
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            for row in rows:
+                buffer.write(','.join(map(_copy_value, convert(row, datetime.datetime.isoformat))))
+                buffer.write('\n')
+            buffer.seek(0)
+            cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        else:
+            adapt = connection.ops.adapt_datetimefield_value
+            rows = [convert(row, adapt) for row in rows]
+            placeholders = '(%s)' % ', '.join(['%s'] * len(INSERT_COLUMNS))
+            batch_size = connection.ops.bulk_batch_size(INSERT_COLUMNS, rows)
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                cursor.execute(f'INSERT INTO {table} ({columns}) VALUES {", ".join([placeholders] * len(batch))}',
+                               [value for row in batch for value in row])
+
+
+def import_tasks(fileobj, user, file_format, chunk_size=CHUNK_SIZE):
+    """
+    Streams tasks from a binary CSV or NDJSON file object into the database for ``user``.
+
+    Rows are validated with the rules of ``TaskSerializer`` and inserted in chunks of
+    ``chunk_size`` without building model instances, every chunk with the history records of its
+    tasks in one INSERT ... SELECT. Invalid rows are skipped and reported with their 1-based row number.
+    """
+    lines = codecs.iterdecode(fileobj, 'utf-8-sig')
+    rows = _iter_csv(lines) if file_format == 'csv' else _iter_ndjson(lines)
+    validator = TaskRowValidator()
+    using = router.db_for_write(Task, instance=user)
+    now = timezone.now()
+    defaults = {name: Task._meta.get_field(name).default for name in ('status', 'recurrence', 'recurrence_interval')}
+
+    result = {"created": 0, "failed": 0, "errors": []}
+    chunk = []
+
+    def flush():
+        nonlocal now
+        tasks = Task.objects.using(using)
+        with transaction.atomic(using=using):
+            # the ids of the chunk are above the highest id before it, on the primary key index
+            last_id = tasks.aggregate(last_id=Max('id'))['last_id'] or 0
+            _insert(chunk, using)
+            tasks.filter(pk__gt=last_id, user=user, created_at=now).record_created(user.pk, history.TASK_FIELDS)
+        result["created"] += len(chunk)
+        chunk.clear()
+        # every chunk is created at a moment of its own
+        now = max(timezone.now(), now + datetime.timedelta(microseconds=1))
+
+    for number, row in enumerate(rows, start=1):
+        try:
+            if isinstance(row, Exception):
+                raise row
+            if not isinstance(row, dict):
+                raise serializers.ValidationError({'non_field_errors': ['Expected an object.']})
+            data = validator.validate(row)
+            chunk.append((data['title'], data.get('description'), data.get('status', defaults['status']),
+                          data.get('due_date'), user.pk, now, now, 1, 0, '/', 0, 0,
+                          data.get('recurrence', defaults['recurrence']),
+                          data.get('recurrence_interval', defaults['recurrence_interval']),
+                          data.get('recurrence_until')))
+        except serializers.ValidationError as e:
+            result["failed"] += 1
+            if len(result["errors"]) < MAX_REPORTED_ERRORS:
+                result["errors"].append({"row": number, "errors": e.detail})
+            continue
+
+        if len(chunk) >= chunk_size:
+            flush()
+
+    if chunk:
+        flush()
+    return result
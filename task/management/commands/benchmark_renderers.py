@@ -0,0 +1,55 @@
+import datetime
+import gzip
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from comment.models import Comment
+from comment.serializers import CommentSerializer
+from task.models import Task
+from task.serializers import TaskSerializer
+from todo_proweb.renderers import ColumnarRenderer
+
+
+class Command(BaseCommand):
+    help = 'Compare size and encode time of task and comment lists rendered as JSON and as columns.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', dest='rows', default=10000, type=int)
+        parser.add_argument('--repeat', dest='repeat', default=5, type=int)
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        # unsaved rows, nothing is read from or written to the database
+        now = datetime.datetime.now(datetime.timezone.utc)
+        tasks = []
+        for i in range(1, rows + 1):
+            created_at = now - datetime.timedelta(minutes=rows - i)
+            task = Task(id=i, title=f'Task {i}', description='Description of the task', user_id=1,
+                        status=random.choice(Task.STATUS_CHOICES)[0], due_date=created_at + datetime.timedelta(days=3),
+                        created_at=created_at, updated_at=created_at)
+            task.label_names = ['work']
+            tasks.append(task)
+        comments = [Comment(id=i, text=f'Comment {i}', task_id=i, user_id=1, created_at=task.created_at)
+                    for i, task in enumerate(tasks, 1)]
+
+        for name, data in (('tasks', TaskSerializer(tasks, many=True).data),
+                           ('comments', CommentSerializer(comments, many=True).data)):
+            results = {}
+            for renderer in (JSONRenderer(), ColumnarRenderer()):
+                body, elapsed = None, []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    body = renderer.render({"status": "success", "data": data})
+                    elapsed.append(time.perf_counter() - started)
+                results[renderer.format] = (len(body), len(gzip.compress(body)), min(elapsed) * 1000)
+                self.stdout.write(f'{name} {renderer.format:>8}: {len(body):>10} bytes, '
+                                  f'{results[renderer.format][1]:>9} gzipped, {min(elapsed) * 1000:8.1f} ms')
+
+            (json_size, json_gzipped, json_ms), (size, gzipped, ms) = results['json'], results['columnar']
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: columnar is {1 - size / json_size:.0%} smaller, {1 - gzipped / json_gzipped:.0%} '
+                f'gzipped, and encodes in {ms / json_ms:.0%} of the time'
+            ))
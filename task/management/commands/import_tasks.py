@@ -0,0 +1,38 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from task.importers import import_tasks, guess_format, IMPORT_FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Import tasks for a user from a CSV or NDJSON file, streaming it in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str)
+        parser.add_argument('--user', dest='username', required=True, type=str)
+        parser.add_argument('--format', dest='file_format', choices=IMPORT_FORMATS, default=None)
+        parser.add_argument('--chunk-size', dest='chunk_size', default=5000, type=int)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist')
+
+        file_format = options['file_format'] or guess_format(options['path'])
+        if file_format is None:
+            raise CommandError('Cannot guess the format from the file name, pass --format')
+
+        started = time.monotonic()
+        with open(options['path'], 'rb') as f:
+            result = import_tasks(f, user, file_format, chunk_size=options['chunk_size'])
+        elapsed = time.monotonic() - started
+
+        for error in result['errors']:
+            self.stderr.write(f'Row {error["row"]}: {error["errors"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result["created"]} tasks, {result["failed"]} rows failed, '
+            f'{result["created"] / elapsed if elapsed else 0:.0f} rows/s'
+        ))
@@ -0,0 +1,162 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Length, Replace
+
+from comment.models import Attachment, Comment
+from task.models import Collaborator, Dependency, Label, Task, TaskHistory
+from todo_proweb.sharding import get_shard
+
+
+def move_user(user_id, source, target, batch_size):
+    """
+    Copies the tasks of ``user_id`` with their comments, attachments, labels, collaborators and history
+    from ``source`` to ``target`` in batches, level by level of the subtask tree so parents get their new
+    id before their subtasks, then deletes them from ``source`` from the bottom up. Ids are assigned by
+    ``target`` and paths and history records rewritten with them, timestamps and counters are kept. The
+    history of a deleted comment keeps its old id, there is nothing to map it to. Attachments left on
+    ``source`` are removed by ``prune_attachments``. Dependencies are copied and saved occurrences linked
+    to their recurring task at the end. Returns the number of tasks moved.
+    """
+    task_labels = Task.labels.through
+    tasks = Task.objects.using(source).filter(user_id=user_id).annotate(
+        depth=Length('path') - Length(Replace('path', Value('/'), Value(''))),
+    )
+    depths = sorted(set(tasks.values_list('depth', flat=True)))
+    new_ids = {}
+    # old ids of saved occurrences of recurring tasks and of their recurring task
+    recurrences = {}
+
+    for depth in depths:
+        last_id = 0
+        while True:
+            batch = list(tasks.filter(depth=depth, id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            old_ids = [task.id for task in batch]
+            comments = list(Comment.objects.using(source).filter(task_id__in=old_ids).order_by('id'))
+            old_comment_ids = [comment.id for comment in comments]
+            comment_attachments = list(Attachment.objects.using(source).filter(comment_id__in=old_comment_ids))
+            collaborators = list(Collaborator.objects.using(source).filter(task_id__in=old_ids))
+            records = list(TaskHistory.objects.using(source).filter(task_id__in=old_ids).order_by('id'))
+            labelled = list(task_labels.objects.using(source).filter(task_id__in=old_ids).values_list(
+                'task_id', 'label__name'
+            ))
+            task_timestamps = [(task.created_at, task.updated_at) for task in batch]
+            comment_timestamps = [comment.created_at for comment in comments]
+
+            with transaction.atomic(using=target):
+                for task in batch:
+                    if task.recurrence_of_id is not None:
+                        recurrences[task.pk] = task.recurrence_of_id
+                        task.recurrence_of_id = None
+                    task.pk = None
+                    task.path = '/' + ''.join(f'{new_ids[pk]}/' for pk in task.ancestor_ids)
+                    task.parent_id = new_ids.get(task.parent_id)
+                Task.objects.using(target).bulk_create(batch)
+                new_ids.update((old_id, task.id) for old_id, task in zip(old_ids, batch))
+                for comment in comments:
+                    comment.pk = None
+                    comment.task_id = new_ids[comment.task_id]
+                Comment.objects.using(target).bulk_create(comments)
+                new_comment_ids = {old_id: comment.id for old_id, comment in zip(old_comment_ids, comments)}
+                for attachment in comment_attachments:
+                    attachment.pk = None
+                    attachment.comment_id = new_comment_ids[attachment.comment_id]
+                Attachment.objects.using(target).bulk_create(comment_attachments)
+                for collaborator in collaborators:
+                    collaborator.pk = None
+                    collaborator.task_id = new_ids[collaborator.task_id]
+                Collaborator.objects.using(target).bulk_create(collaborators)
+                for record in records:
+                    record.pk = None
+                    record.task_id = new_ids[record.task_id]
+                    record.comment_id = new_comment_ids.get(record.comment_id, record.comment_id)
+                TaskHistory.objects.using(target).bulk_create(records, batch_size=batch_size)
+                if labelled:
+                    names = {name for _, name in labelled}
+                    Label.objects.using(target).bulk_create([Label(user_id=user_id, name=name) for name in names],
+                                                            ignore_conflicts=True)
+                    label_ids = dict(Label.objects.using(target).filter(user_id=user_id, name__in=names)
+                                     .values_list('name', 'id'))
+                    task_labels.objects.using(target).bulk_create([
+                        task_labels(task_id=new_ids[task_id], label_id=label_ids[name]) for task_id, name in labelled
+                    ])
+
+                # bulk_create sets auto_now and auto_now_add fields to the current time
+                for task, (created_at, updated_at) in zip(batch, task_timestamps):
+                    task.created_at, task.updated_at = created_at, updated_at
+                for comment, created_at in zip(comments, comment_timestamps):
+                    comment.created_at = created_at
+                Task.objects.using(target).bulk_update(batch, ['created_at', 'updated_at'])
+                Comment.objects.using(target).bulk_update(comments, ['created_at'])
+
+    # once every task has its new id, a task can be blocked by one of a later batch
+    dependencies = list(Dependency.objects.using(source).filter(task__user_id=user_id).order_by('id'))
+    if dependencies:
+        created_at = [dependency.created_at for dependency in dependencies]
+        for dependency in dependencies:
+            dependency.pk = None
+            dependency.task_id, dependency.blocker_id = new_ids[dependency.task_id], new_ids[dependency.blocker_id]
+        with transaction.atomic(using=target):
+            Dependency.objects.using(target).bulk_create(dependencies, batch_size=batch_size)
+            for dependency, timestamp in zip(dependencies, created_at):
+                dependency.created_at = timestamp
+            Dependency.objects.using(target).bulk_update(dependencies, ['created_at'], batch_size=batch_size)
+
+    if recurrences:
+        # linked once every task has its new id, a recurring task can be in a later batch than its occurrences
+        linked = [Task(pk=new_ids[pk], recurrence_of_id=new_ids.get(recurrence_of))
+                  for pk, recurrence_of in recurrences.items()]
+        Task.objects.using(target).bulk_update(linked, ['recurrence_of'], batch_size=batch_size)
+
+    # subtasks first, so deleting a batch never cascades to tasks of a later one
+    for depth in reversed(depths):
+        while True:
+            old_ids = list(tasks.filter(depth=depth).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not old_ids:
+                break
+            with transaction.atomic(using=source):
+                # history records are not tied to their task by a foreign key
+                TaskHistory.objects.using(source).filter(task_id__in=old_ids).delete()
+                Task.objects.using(source).filter(id__in=old_ids).delete()
+    Label.objects.using(source).filter(user_id=user_id).delete()
+    return len(new_ids)
+
+
+class Command(BaseCommand):
+    help = ('Move the tasks, comments and labels of every user whose shard changed after DATABASE_SHARDS was edited '
+            'to the shard it now maps them to.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drain', dest='drain', action='append', default=[],
+                            help='Database alias removed from DATABASE_SHARDS whose users should be moved out')
+        parser.add_argument('--batch-size', dest='batch_size', default=1000, type=int)
+        parser.add_argument('--dry-run', dest='dry_run', action='store_true')
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_SHARDS:
+            raise CommandError('DATABASE_SHARDS is not set')
+        for alias in options['drain']:
+            if alias not in settings.DATABASES or alias in settings.DATABASE_SHARDS:
+                raise CommandError(f'"{alias}" is not a database removed from DATABASE_SHARDS')
+
+        users = tasks = 0
+        for source in [*settings.DATABASE_SHARDS, *options['drain']]:
+            user_ids = list(Task.objects.using(source).order_by().values_list('user_id', flat=True).distinct())
+            for user_id in user_ids:
+                target = get_shard(user_id)
+                if target == source:
+                    continue
+                if options['dry_run']:
+                    moved = Task.objects.using(source).filter(user_id=user_id).count()
+                else:
+                    moved = move_user(user_id, source, target, options['batch_size'])
+                self.stdout.write(f'User {user_id}: {moved} tasks from {source} to {target}')
+                users += 1
+                tasks += moved
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {tasks} tasks of {users} users'))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from task.models import Task
+
+
+class Command(BaseCommand):
+    help = 'Recompute comment_count and last_commented_at of every task on every shard, one id range at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', dest='batch_size', default=1000, type=int)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        updated = 0
+        for using in settings.DATABASE_SHARDS or ['default']:
+            tasks = Task.objects.using(using)
+            last_id = tasks.aggregate(last_id=Max('id'))['last_id'] or 0
+            for start in range(1, last_id + 1, batch_size):
+                with transaction.atomic(using=using):
+                    updated += tasks.filter(id__gte=start, id__lt=start + batch_size).refresh_comment_stats()
+
+        self.stdout.write(self.style.SUCCESS(f'Recomputed comment stats of {updated} tasks'))
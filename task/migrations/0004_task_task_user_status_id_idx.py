@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-19 03:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0003_task_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'status', '-id'], name='task_user_status_id_idx'),
+        ),
+    ]
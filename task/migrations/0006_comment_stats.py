@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-19 03:16
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import task.models
+
+
+def backfill_comment_stats(apps, schema_editor):
+    Task = apps.get_model('task', 'Task')
+    Comment = apps.get_model('comment', 'Comment')
+    comments = Comment.objects.filter(task=models.OuterRef('pk')).order_by().values('task')
+    Task.objects.using(schema_editor.connection.alias).update(
+        comment_count=Coalesce(
+            models.Subquery(comments.annotate(count=models.Count('id')).values('count')), models.Value(0)
+        ),
+        last_commented_at=models.Subquery(comments.annotate(last=models.Max('created_at')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0005_task_task_user_due_date_idx'),
+        ('comment', '0002_comment_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='last_commented_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_comment_stats, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=task.models.NullsLastIndex(models.F('user'), models.OrderBy(models.F('last_commented_at'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='task_user_activity_idx'),
+        ),
+    ]
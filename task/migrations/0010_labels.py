@@ -0,0 +1,73 @@
+# Generated by Django 5.1.2 on 2026-10-19 03:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# PostgreSQL only: a copy of the label ids of every task, kept up to date by statement level
+# triggers on the join table, so that label filters are answered by a GIN index on task_task
+LABEL_IDS_SQL = '''
+ALTER TABLE task_task ADD COLUMN label_ids bigint[] NOT NULL DEFAULT '{}';
+CREATE INDEX task_label_ids_gin ON task_task USING gin (label_ids);
+
+CREATE FUNCTION task_sync_label_ids() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE task_task SET label_ids = ARRAY(
+        SELECT label_id FROM task_task_labels WHERE task_task_labels.task_id = task_task.id ORDER BY label_id
+    )
+    WHERE task_task.id IN (SELECT task_id FROM changed);
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER task_labels_inserted AFTER INSERT ON task_task_labels
+    REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION task_sync_label_ids();
+CREATE TRIGGER task_labels_deleted AFTER DELETE ON task_task_labels
+    REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION task_sync_label_ids();
+'''
+
+DROP_LABEL_IDS_SQL = '''
+DROP TRIGGER task_labels_inserted ON task_task_labels;
+DROP TRIGGER task_labels_deleted ON task_task_labels;
+DROP FUNCTION task_sync_label_ids();
+ALTER TABLE task_task DROP COLUMN label_ids;
+'''
+
+
+def add_label_ids(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(LABEL_IDS_SQL)
+
+
+def drop_label_ids(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_LABEL_IDS_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0009_task_history'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Label',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='labels', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='labels',
+            field=models.ManyToManyField(blank=True, related_name='tasks', to='task.label'),
+        ),
+        migrations.AddConstraint(
+            model_name='label',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='label_user_name_unique'),
+        ),
+        migrations.RunPython(add_label_ids, drop_label_ids),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-19 04:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0013_recurring_tasks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Dependency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blocker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dependents', to='task.task')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dependencies', to='task.task')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['blocker', 'task'], name='dependency_blocker_task_idx')],
+                'constraints': [models.UniqueConstraint(fields=('task', 'blocker'), name='dependency_task_blocker_unique'), models.CheckConstraint(condition=models.Q(('task', models.F('blocker')), _negated=True), name='dependency_not_self')],
+            },
+        ),
+    ]
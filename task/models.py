@@ -1,7 +1,316 @@
+import datetime
+
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MinValueValidator
+from django.db import connections, IntegrityError, models, NotSupportedError, router, transaction
+from django.db.models import BooleanField, Case, Count, Exists, F, Func, Max, OrderBy, OuterRef, \
+    prefetch_related_objects, Q, Subquery, Value, When
+from django.db.models.deletion import Collector
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Concat, Substr
 from django.utils import timezone
 
+from todo_proweb.concurrency import VersionedQuerySet
+from . import recurrence
+
+
+# first key of the PostgreSQL advisory lock that Task.add_blocker() takes per user
+DEPENDENCY_LOCK = 4701
+
+
+class NullsLastIndex(models.Index):
+    """
+    An expression index with ``desc(nulls_last=True)`` columns. SQLite cannot declare NULLS LAST on
+    an index but already sorts NULLs last in descending order, so there the modifier is dropped.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        index = self
+        if schema_editor.connection.vendor == 'sqlite':
+            index = self.clone()
+            index.expressions = tuple(
+                OrderBy(expression.expression, descending=expression.descending)
+                if isinstance(expression, OrderBy) else expression
+                for expression in self.expressions
+            )
+        return super(NullsLastIndex, index).create_sql(model, schema_editor, using=using, **kwargs)
+
+
+class _JSONArray(Func):
+    output_field = models.JSONField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='JSONB_BUILD_ARRAY', **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='JSON_ARRAY', **extra_context)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError('JSON is only built by PostgreSQL and SQLite.')
+
+
+class _JSONChanges(Func):
+    """
+    ``{field: [old, new]}`` of ``fields``, a dict of ``(changed, old, new)`` by field name, with only the
+    fields whose ``changed`` condition holds, or that have ``None`` for it.
+    """
+    output_field = models.JSONField()
+
+    def __init__(self, fields):
+        expressions = []
+        for name, (changed, old, new) in fields.items():
+            array = _JSONArray(old, new)
+            if changed is not None:
+                array = Case(When(changed, then=array), output_field=self.output_field)
+            expressions += [Value(name), array]
+        super().__init__(*expressions)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        # the unchanged fields are NULL and stripped
+        return super().as_sql(compiler, connection, template='JSONB_STRIP_NULLS(JSONB_BUILD_OBJECT(%(expressions)s))',
+                              **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # merging into {} drops the fields that are NULL
+        return super().as_sql(compiler, connection, template="JSON_PATCH('{}', JSON_OBJECT(%(expressions)s))",
+                              **extra_context)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError('JSON is only built by PostgreSQL and SQLite.')
+
+
+class _SubtreeCollector(Collector):
+    """Collects whole subtrees, whose subtasks are loaded with them and not looked up again by parent."""
+
+    def related_objects(self, related_model, related_fields, objs):
+        if related_model is Task and [field.name for field in related_fields] == ['parent']:
+            return related_model._base_manager.none()
+        return super().related_objects(related_model, related_fields, objs)
+
+
+class TaskQuerySet(VersionedQuerySet):
+
+    def refresh_comment_stats(self):
+        """Recomputes ``comment_count`` and ``last_commented_at`` of these tasks in one UPDATE."""
+        comments = self.model._meta.get_field('comments').related_model.objects.filter(
+            task=OuterRef('pk')
+        ).order_by().values('task')
+        return self.update(
+            comment_count=Coalesce(Subquery(comments.annotate(count=Count('id')).values('count')), Value(0)),
+            last_commented_at=Subquery(comments.annotate(last=Max('created_at')).values('last')),
+        )
+
+    def visible_to(self, user, role=None):
+        """
+        Filters these tasks down to the ones ``user`` owns or collaborates on, with ``role`` or a role
+        that includes it. The membership is checked in the same query, on the (task, user) index.
+        """
+        memberships = Collaborator.objects.filter(task=OuterRef('pk'), user=user)
+        if role is not None:
+            memberships = memberships.filter(role__in=Collaborator.ROLES_INCLUDING[role])
+        return self.filter(Q(user=user) | Exists(memberships))
+
+    def subtree(self, task):
+        """Filters these tasks down to ``task`` and every task below it, with a prefix match on the indexed path."""
+        return self.filter(Q(pk=task.pk) | Q(path__startswith=task.subtree_path))
+
+    def delete_subtree(self, task):
+        """
+        Deletes ``task`` and every task below it, with what cascades from them, like ``subtree(task).delete()``
+        but without another query for the subtasks of every level, which the subtree already holds.
+        """
+        tasks = self.subtree(task).order_by()
+        tasks._for_write = True
+        collector = _SubtreeCollector(using=tasks.db, origin=task)
+        collector.collect(tasks)
+        return collector.delete()
+
+    def roll_up(self, deltas):
+        """
+        Adds ``(subtasks, completed)`` of ``deltas``, a dict by task id, to ``subtask_count`` and
+        ``completed_subtask_count`` of these tasks in one UPDATE.
+        """
+        deltas = {pk: delta for pk, delta in deltas.items() if delta != (0, 0)}
+        if not deltas:
+            return 0
+
+        def change(index):
+            return Case(*(When(pk=pk, then=Value(delta[index])) for pk, delta in deltas.items()), default=Value(0))
+
+        return self.filter(pk__in=deltas).update(
+            subtask_count=F('subtask_count') + change(0),
+            completed_subtask_count=F('completed_subtask_count') + change(1),
+        )
+
+    def patch(self, due_date_shift=None, history_user_id=None, **changes):
+        """
+        Sets ``changes`` on every one of these tasks, and moves their due dates by ``due_date_shift``, in one
+        UPDATE that bumps their ``version`` and ``updated_at`` and skips the tasks that already have the
+        values. Returns how many tasks changed. With ``history_user_id`` every changed task gets the change
+        in its history, written by one more statement, see ``_record_patch()``.
+        A changed ``status`` adds the tasks that become or stop being completed to
+        ``completed_subtask_count`` of their ancestors, counted per path in one query.
+        """
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        tasks = self.using(using)
+        if changes and due_date_shift is None:
+            tasks = tasks.exclude(**changes)
+        if due_date_shift is not None:
+            changes['due_date'] = F('due_date') + Value(due_date_shift, output_field=models.DurationField())
+
+        with transaction.atomic(using=using):
+            if history_user_id is not None:
+                # the rows before the UPDATE changes them, in the same transaction
+                tasks._record_patch(history_user_id, changes, shifted=due_date_shift is not None)
+            deltas = {}
+            if 'status' in changes:
+                # subtasks that become completed, or stop being completed
+                completed = changes['status'] == Task.COMPLETED
+                flipped = tasks.exclude(path='/').filter(~Q(status=Task.COMPLETED) if completed else Q(
+                    status=Task.COMPLETED
+                )).order_by()
+                sign = 1 if completed else -1
+                for path, count in flipped.values_list('path').annotate(count=Count('id')):
+                    for pk in Task(path=path).ancestor_ids:
+                        deltas[pk] = (0, deltas.get(pk, (0, 0))[1] + sign * count)
+            updated = tasks.update(version=F('version') + 1, updated_at=timezone.now(), **changes)
+            Task.objects.using(using).roll_up(deltas)
+        return updated
+
+    def _record_patch(self, user_id, changes, shifted):
+        """
+        Adds the ``{field: [old, new]}`` of ``changes`` to the history of every one of these tasks, as
+        done by ``user_id``, with one INSERT ... SELECT that builds the changes in the database.
+        """
+        fields = {}
+        for name, value in changes.items():
+            if name == 'due_date' and shifted:
+                changed = Q(due_date__isnull=False)
+            else:
+                changed = ~Q(**{name: value})
+                value = Value(value, output_field=self.model._meta.get_field(name))
+            fields[name] = (changed, F(name), value)
+        self._record_history(user_id, TaskHistory.UPDATED, fields)
+
+    def record_created(self, user_id, names):
+        """
+        Adds the creation of every one of these tasks to its history, as done by ``user_id``, with the
+        ``{field: [None, value]}`` of the fields ``names`` like ``history.snapshot()``, in one INSERT ... SELECT.
+        """
+        self._record_history(user_id, TaskHistory.CREATED, {
+            name: (None, Value(None, output_field=self.model._meta.get_field(name)), F(name))
+            for name in names
+        })
+
+    def _record_history(self, user_id, action, fields):
+        rows = self.order_by().values(
+            history_task_id=F('id'), history_comment_id=Value(None, output_field=models.BigIntegerField()),
+            history_user_id=Value(user_id), history_action=Value(action),
+            history_changes=_JSONChanges(fields), history_created_at=Value(timezone.now()),
+        )
+        select, params = rows.query.get_compiler(self.db).as_sql()
+        qn = connections[self.db].ops.quote_name
+        columns = ', '.join(qn(TaskHistory._meta.get_field(name).column)
+                            for name in ('task_id', 'comment_id', 'user', 'action', 'changes', 'created_at'))
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(f'INSERT INTO {qn(TaskHistory._meta.db_table)} ({columns}) {select}', params)
+
+    def recurring(self, start, end):
+        """Filters these tasks down to the recurring ones with occurrences due between ``start`` and ``end``."""
+        return self.exclude(recurrence=Task.NO_RECURRENCE).filter(due_date__lt=end).filter(
+            Q(recurrence_until__isnull=True) | Q(recurrence_until__gte=start)
+        )
+
+    def actionable(self, user):
+        """
+        Filters these tasks down to the ones that are not completed and not blocked by an open task, directly
+        or through other open tasks. The blocked tasks are collected by a recursive CTE in the same query,
+        starting from the dependencies on open tasks of ``user`` and of the owners of tasks shared with ``user``,
+        as a task can only depend on tasks of its owner.
+        """
+        qn = connections[self.db].ops.quote_name
+        owners = f"""
+            SELECT t.{qn('user_id')} FROM {qn(Collaborator._meta.db_table)} c
+            INNER JOIN {qn(self.model._meta.db_table)} t ON t.{qn('id')} = c.{qn('task_id')}
+            WHERE c.{qn('user_id')} = %s
+        """
+        blocked = f"""
+            WITH RECURSIVE blocked(id) AS (
+                SELECT d.{qn('task_id')} FROM {qn(Dependency._meta.db_table)} d
+                INNER JOIN {qn(self.model._meta.db_table)} b ON b.{qn('id')} = d.{qn('blocker_id')}
+                WHERE (b.{qn('user_id')} = %s OR b.{qn('user_id')} IN ({owners})) AND b.{qn('status')} <> %s
+                UNION
+                SELECT d.{qn('task_id')} FROM {qn(Dependency._meta.db_table)} d
+                INNER JOIN blocked ON d.{qn('blocker_id')} = blocked.id
+                INNER JOIN {qn(self.model._meta.db_table)} b ON b.{qn('id')} = blocked.id
+                WHERE b.{qn('status')} <> %s
+            )
+            SELECT id FROM blocked
+        """
+        return self.exclude(status=Task.COMPLETED).exclude(
+            pk__in=RawSQL(blocked, (user.pk, user.pk, Task.COMPLETED, Task.COMPLETED))
+        )
+
+    def with_blockers(self, pk):
+        """
+        Filters these tasks down to task ``pk`` and every task blocking it, directly or through other
+        tasks, collected by a recursive CTE in the same query.
+        """
+        return self.filter(pk__in=RawSQL(f'{_blockers_cte(connections[self.db])} SELECT id FROM blockers', (pk,)))
+
+    def with_labels(self, user, names, match='any'):
+        """
+        Filters these tasks of ``user`` down to the ones with any, or with ``match='all'`` every, label
+        of ``names``. PostgreSQL compares the GIN indexed ``label_ids`` array of the task row, which
+        triggers on the join table keep up to date, other databases look the labels up in the join table.
+        """
+        names = sorted(set(names))
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            qn = connection.ops.quote_name
+            label_ids = (f'ARRAY(SELECT {qn("id")} FROM {qn(Label._meta.db_table)} '
+                         f'WHERE {qn("user_id")} = %s AND {qn("name")} = ANY(%s))')
+            column = f'{qn(self.model._meta.db_table)}.{qn("label_ids")}'
+            if match == 'all':
+                # every name has to be a label of the user, or the containment check would ignore it
+                condition = RawSQL(f'{column} @> {label_ids} AND cardinality({label_ids}) = %s',
+                                   (user.pk, names, user.pk, names, len(names)), output_field=BooleanField())
+            else:
+                condition = RawSQL(f'{column} && {label_ids}', (user.pk, names), output_field=BooleanField())
+            return self.filter(condition)
+
+        task_labels = self.model.labels.through.objects.filter(task=OuterRef('pk'), label__user=user)
+        if match == 'all':
+            return self.filter(*(Exists(task_labels.filter(label__name=name)) for name in names))
+        return self.filter(Exists(task_labels.filter(label__name__in=names)))
+
+
+def _blockers_cte(connection):
+    """``blockers``, a recursive CTE of the task with the id of its parameter and every task blocking it."""
+    qn = connection.ops.quote_name
+    return f"""
+        WITH RECURSIVE blockers(id) AS (
+            SELECT CAST(%s AS bigint)
+            UNION
+            SELECT d.{qn('blocker_id')} FROM {qn(Dependency._meta.db_table)} d
+            INNER JOIN blockers ON d.{qn('task_id')} = blockers.id
+        )
+    """
+
+
+class Label(models.Model):
+    name = models.CharField(max_length=50)
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='labels', db_constraint=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='label_user_name_unique'),
+        ]
+
+    def __str__(self):
+        return self.name
+
 
 class Task(models.Model):
     PENDING = 'P'
@@ -14,19 +323,326 @@ class Task(models.Model):
         (COMPLETED, 'Completed')
     ]
 
+    NO_RECURRENCE = ''
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    MONTHLY = 'monthly'
+    YEARLY = 'yearly'
+
+    RECURRENCE_CHOICES = [
+        (NO_RECURRENCE, 'Does not repeat'),
+        (DAILY, 'Daily'),
+        (WEEKLY, 'Weekly'),
+        (MONTHLY, 'Monthly'),
+        (YEARLY, 'Yearly')
+    ]
+
     title = models.CharField(max_length=100, blank=False)
     description = models.TextField(blank=True, null=True, max_length=255)
     status = models.CharField(max_length=2, choices=STATUS_CHOICES, default=PENDING)
     due_date = models.DateTimeField(blank=True, null=True)
 
-    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='tasks')
+    # users stay on the primary database when tasks are sharded, see todo_proweb/sharding.py
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='tasks', db_constraint=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1)
+
+    # kept up to date by Comment.save()/delete() and CommentQuerySet.delete(),
+    # `python manage.py repair_comment_stats` recomputes them
+    comment_count = models.PositiveIntegerField(default=0)
+    last_commented_at = models.DateTimeField(blank=True, null=True)
+
+    # the join table is the source of truth, on PostgreSQL triggers copy the label ids of a task
+    # into the GIN indexed task_task.label_ids array that TaskQuerySet.with_labels() filters on
+    labels = models.ManyToManyField(Label, related_name='tasks', blank=True)
+
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name='subtasks', blank=True, null=True)
+    # ids of the ancestors, '/1/5/' for a subtask of task 5 which is a subtask of task 1,
+    # so a subtree is one prefix match and a move rewrites the prefix of its paths
+    path = models.TextField(default='/', editable=False)
+    # number of tasks anywhere below this one and how many of them are completed,
+    # kept up to date with TaskQuerySet.roll_up() from the ids in the path
+    subtask_count = models.PositiveIntegerField(default=0)
+    completed_subtask_count = models.PositiveIntegerField(default=0)
+
+    # a recurring task is due every `recurrence_interval` days, weeks, months or years from its due date,
+    # in UTC. Its occurrences are computed for the dates that are asked for, see Task.occurrences(), and
+    # only saved as tasks of their own by Task.materialize() once they are changed or commented on
+    recurrence = models.CharField(max_length=7, choices=RECURRENCE_CHOICES, blank=True, default=NO_RECURRENCE)
+    recurrence_interval = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1)])
+    recurrence_until = models.DateTimeField(blank=True, null=True)
+    # set on a saved occurrence, to the recurring task and the date it was originally due
+    recurrence_of = models.ForeignKey('self', on_delete=models.SET_NULL, related_name='occurrences', blank=True,
+                                      null=True)
+    original_due_date = models.DateTimeField(blank=True, null=True)
+
+    objects = TaskQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'status', '-id'], name='task_user_status_id_idx'),
+            models.Index(fields=['user', 'due_date'], name='task_user_due_date_idx'),
+            NullsLastIndex(F('user'), F('last_commented_at').desc(nulls_last=True), F('id').desc(),
+                           name='task_user_activity_idx'),
+            # for the admin changelist, which lists every user's tasks
+            models.Index(fields=['status', '-id'], name='task_status_id_idx'),
+            models.Index(fields=['due_date', '-id'], name='task_due_date_id_idx'),
+            # the operator class lets PostgreSQL answer prefix matches from the index
+            models.Index(fields=['path'], name='task_path_idx', opclasses=['text_pattern_ops']),
+            models.Index(fields=['user', 'due_date'], condition=~Q(recurrence=''), name='task_recurring_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['recurrence_of', 'original_due_date'], name='task_occurrence_unique'),
+        ]
 
     def clean(self):
         if self.due_date and self.due_date < timezone.now():
             raise ValidationError('Due date cannot be in the past.')
 
+    @property
+    def ancestor_ids(self):
+        return [int(pk) for pk in self.path.strip('/').split('/') if pk]
+
+    @property
+    def subtree_path(self):
+        """Path of the tasks directly below this one, and prefix of the paths of every task below it."""
+        return f'{self.path}{self.pk}/'
+
+    def is_within(self, pk):
+        """Whether this task is the task ``pk`` or below it."""
+        return self.pk == pk or pk in self.ancestor_ids
+
+    def roll_up_counts(self):
+        """``(subtasks, completed)`` this task and its subtasks add to the counters of its ancestors."""
+        return self.subtask_count + 1, self.completed_subtask_count + (self.status == self.COMPLETED)
+
+    def move_to(self, parent):
+        """
+        Moves this task with its subtasks below ``parent``, or to the top for ``None``. Rewrites their
+        paths in one UPDATE and the counters of the old and new ancestors in another.
+        """
+        if parent is not None and parent.is_within(self.pk):
+            raise ValueError('A task cannot be moved below itself.')
+        old_path, new_path = self.path, parent.subtree_path if parent is not None else '/'
+        if new_path == old_path:
+            return
+
+        using = self._state.db
+        subtasks, completed = self.roll_up_counts()
+        deltas = {pk: (-subtasks, -completed) for pk in self.ancestor_ids}
+        for pk in [*parent.ancestor_ids, parent.pk] if parent is not None else []:
+            # ancestors the task stays below end up unchanged
+            old_subtasks, old_completed = deltas.get(pk, (0, 0))
+            deltas[pk] = (old_subtasks + subtasks, old_completed + completed)
+
+        with transaction.atomic(using=using):
+            Task.objects.using(using).subtree(self).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                parent=Case(When(pk=self.pk, then=Value(parent.pk if parent is not None else None)),
+                            default=F('parent'), output_field=models.BigIntegerField()),
+            )
+            Task.objects.using(using).roll_up(deltas)
+        self.parent, self.path = parent, new_path
+
+    def set_labels(self, names):
+        """Replaces the labels of this task with the labels of its user called ``names``, creating missing ones."""
+        names = sorted(set(names))
+        using = self._state.db
+        labels = []
+        if names:
+            Label.objects.using(using).bulk_create([Label(user_id=self.user_id, name=name) for name in names],
+                                                   ignore_conflicts=True)
+            labels = list(Label.objects.using(using).filter(user_id=self.user_id, name__in=names))
+        task_labels = Task.labels.through.objects.using(using)
+        task_labels.filter(task_id=self.pk).exclude(label_id__in=[label.id for label in labels]).delete()
+        task_labels.bulk_create([Task.labels.through(task_id=self.pk, label_id=label.id) for label in labels],
+                                ignore_conflicts=True)
+        # read by TaskSerializer instead of querying the labels again
+        self.label_names = names
+
+    def add_blocker(self, blocker):
+        """
+        Makes ``blocker`` block this task, returns whether it did not yet. Raises ``ValueError`` if this
+        task already blocks ``blocker``, directly or through other tasks, or is ``blocker``, which the
+        INSERT checks with a recursive CTE over the blockers of ``blocker`` in the same statement.
+        """
+        using = self._state.db
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        sql = f"""
+            {_blockers_cte(connection)}
+            INSERT INTO {qn(Dependency._meta.db_table)} ({qn('task_id')}, {qn('blocker_id')}, {qn('created_at')})
+            SELECT %s, %s, %s WHERE NOT EXISTS (SELECT 1 FROM blockers WHERE id = %s)
+            ON CONFLICT DO NOTHING
+            RETURNING {qn('id')}
+        """
+        params = (blocker.pk, self.pk, blocker.pk, connection.ops.adapt_datetimefield_value(timezone.now()), self.pk)
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # a concurrent change to the dependencies of the same user could close a cycle
+                cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', (DEPENDENCY_LOCK, self.user_id))
+            cursor.execute(sql, params)
+            if cursor.fetchone() is not None:
+                return True
+        if Dependency.objects.using(using).filter(task=self, blocker=blocker).exists():
+            return False
+        raise ValueError('A task cannot be blocked by a task it blocks.')
+
+    def occurrence_dates(self, start, end):
+        """Lazily yields the due dates of the occurrences of this recurring task between ``start`` and ``end``."""
+        return recurrence.occurrences(self.due_date.astimezone(datetime.timezone.utc), self.recurrence,
+                                      self.recurrence_interval, self.recurrence_until, start, end)
+
+    def is_occurrence_date(self, due_date):
+        return bool(self.recurrence) and self.due_date is not None and recurrence.is_occurrence(
+            self.due_date.astimezone(datetime.timezone.utc), self.recurrence, self.recurrence_interval,
+            self.recurrence_until, due_date
+        )
+
+    def occurrence(self, due_date):
+        """An unsaved occurrence of this recurring task due at ``due_date``, with its prefetched labels."""
+        occurrence = Task(
+            title=self.title, description=self.description, status=self.status, due_date=due_date,
+            user_id=self.user_id, created_at=self.created_at, updated_at=self.updated_at,
+            recurrence_of_id=self.pk, original_due_date=due_date,
+        )
+        occurrence.label_names = [label.name for label in self.labels.all()]
+        return occurrence
+
+    def materialize(self, due_date):
+        """
+        Returns the occurrence of this recurring task originally due at ``due_date`` as a saved task, with
+        whether it was created now. Raises ``ValueError`` if no occurrence is due then.
+        """
+        if not self.is_occurrence_date(due_date):
+            raise ValueError('No occurrence of the task is due at this date.')
+        using = self._state.db
+        prefetch_related_objects([self], 'labels')
+        saved = Task.objects.using(using).filter(recurrence_of=self, original_due_date=due_date)
+        task = saved.first()
+        if task is not None:
+            return task, False
+        occurrence = self.occurrence(due_date)
+        try:
+            with transaction.atomic(using=using):
+                occurrence.save(using=using)
+        except IntegrityError:
+            # saved by a concurrent request
+            return saved.get(), False
+        Task.labels.through.objects.using(using).bulk_create(
+            [Task.labels.through(task_id=occurrence.pk, label_id=label.pk) for label in self.labels.all()]
+        )
+        # collaborators of the recurring task keep their access to its occurrences
+        Collaborator.objects.using(using).bulk_create([
+            Collaborator(task_id=occurrence.pk, user_id=user_id, role=role)
+            for user_id, role in self.collaborators.using(using).values_list('user_id', 'role')
+        ])
+        return occurrence, True
+
     def __str__(self):
         return self.title
+
+
+def expand_occurrences(series, start, end):
+    """
+    Unsaved occurrences of the recurring tasks ``series``, with prefetched labels, due between ``start``
+    and ``end``, leaving out the ones that were saved as tasks of their own. Takes one query.
+    """
+    if not series:
+        return []
+    saved = set(Task.objects.using(series[0]._state.db).filter(
+        recurrence_of__in=[task.pk for task in series], original_due_date__gte=start, original_due_date__lt=end
+    ).values_list('recurrence_of_id', 'original_due_date'))
+    return [
+        task.occurrence(due_date)
+        for task in series
+        for due_date in task.occurrence_dates(start, end)
+        if (task.pk, due_date) not in saved
+    ]
+
+
+class Dependency(models.Model):
+    # `task` cannot start before `blocker` is completed, see Task.add_blocker() and TaskQuerySet.actionable()
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='dependencies')
+    blocker = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='dependents')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'blocker'], name='dependency_task_blocker_unique'),
+            models.CheckConstraint(condition=~Q(task=F('blocker')), name='dependency_not_self'),
+        ]
+        indexes = [
+            # the recursive CTEs walk the graph in both directions
+            models.Index(fields=['blocker', 'task'], name='dependency_blocker_task_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.task_id} blocked by {self.blocker_id}'
+
+
+class Collaborator(models.Model):
+    VIEWER = 'viewer'
+    EDITOR = 'editor'
+
+    ROLE_CHOICES = [
+        (VIEWER, 'Viewer'),
+        (EDITOR, 'Editor'),
+    ]
+    # editors can do everything viewers can
+    ROLES_INCLUDING = {
+        VIEWER: [VIEWER, EDITOR],
+        EDITOR: [EDITOR],
+    }
+
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='collaborators')
+    # stored with the task, on the shard of its owner, which is only queried for collaborators
+    # mapped to the same shard, see todo_proweb/sharding.py
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='collaborations',
+                             db_constraint=False)
+    role = models.CharField(max_length=6, choices=ROLE_CHOICES, default=VIEWER)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'user'], name='collaborator_task_user_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'task'], name='collaborator_user_task_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.role} of task {self.task_id}'
+
+
+class TaskHistory(models.Model):
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+
+    ACTION_CHOICES = [
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+    ]
+
+    # plain ids, the history of a task or comment outlives it
+    task_id = models.BigIntegerField()
+    comment_id = models.BigIntegerField(blank=True, null=True)
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='+', db_constraint=False)
+
+    action = models.CharField(max_length=7, choices=ACTION_CHOICES)
+    # {field: [old, new]}
+    changes = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # set when the change is made, records are written later in batches by task.history
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['task_id', '-id'], name='task_history_task_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.action} task {self.task_id}'
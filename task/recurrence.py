@@ -0,0 +1,55 @@
+import calendar
+import datetime
+
+# length of one step of a rule, in days or in months
+_DAYS = {'daily': 1, 'weekly': 7}
+_MONTHS = {'monthly': 1, 'yearly': 12}
+
+
+def _add_months(value, months):
+    month = value.month - 1 + months
+    year, month = value.year + month // 12, month % 12 + 1
+    # the 31st falls on the last day of shorter months
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+
+def nth(start, rule, steps):
+    """Due date ``steps`` steps of ``rule`` after ``start``."""
+    if rule in _DAYS:
+        return start + datetime.timedelta(days=_DAYS[rule] * steps)
+    return _add_months(start, _MONTHS[rule] * steps)
+
+
+def _first_index(start, rule, interval, after):
+    """Index of the first occurrence at or after ``after``, computed without going through the ones before it."""
+    if after <= start:
+        return 0
+    if rule in _DAYS:
+        step = datetime.timedelta(days=_DAYS[rule] * interval)
+        return -((start - after) // step)
+    months = (after.year - start.year) * 12 + after.month - start.month
+    index = max(months // (_MONTHS[rule] * interval) - 1, 0)
+    while nth(start, rule, index * interval) < after:
+        index += 1
+    return index
+
+
+def occurrences(start, rule, interval, until, window_start, window_end):
+    """
+    Yields the due dates of the occurrences of a task first due at ``start`` and repeating every
+    ``interval`` steps of ``rule`` up to ``until``, from ``window_start`` up to, not including,
+    ``window_end``. Nothing is computed for the occurrences before the window.
+    """
+    index = _first_index(start, rule, interval, window_start)
+    while True:
+        due_date = nth(start, rule, index * interval)
+        if due_date >= window_end or (until is not None and due_date > until):
+            return
+        yield due_date
+        index += 1
+
+
+def is_occurrence(start, rule, interval, until, due_date):
+    """Whether an occurrence is due at exactly ``due_date``."""
+    window_end = due_date + datetime.timedelta(microseconds=1)
+    return next(occurrences(start, rule, interval, until, due_date, window_end), None) == due_date
@@ -2,7 +2,24 @@ from django.utils import timezone
 
 from rest_framework import serializers
 
-from .models import Task
+from . import history
+from .models import Collaborator, Label, Task, TaskHistory
+
+
+class LabelNamesField(serializers.ListField):
+    """Names of the labels of a task, read from its prefetched labels or the names it was just given."""
+    child = serializers.CharField(max_length=Label._meta.get_field('name').max_length)
+
+    def get_attribute(self, instance):
+        if hasattr(instance, 'label_names'):
+            return instance.label_names
+        return [label.name for label in instance.labels.all()]
+
+
+class TaskHistorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TaskHistory
+        fields = ('id', 'comment_id', 'user', 'action', 'changes', 'created_at')
 
 
 class TaskSerializer(serializers.ModelSerializer):
@@ -14,12 +31,19 @@ class TaskSerializer(serializers.ModelSerializer):
 
     status = serializers.ChoiceField(choices=STATUS_CHOICES)
     due_date = serializers.DateTimeField()
-
+    labels = LabelNamesField(required=False)
 
     class Meta:
         model = Task
         fields = '__all__'
-        read_only_fields = ('id', 'created_at', 'updated_at', 'user')
+        read_only_fields = (
+            'id', 'created_at', 'updated_at', 'user', 'version', 'comment_count', 'last_commented_at', 'path',
+            'subtask_count', 'completed_subtask_count', 'recurrence_of', 'original_due_date'
+        )
+        # the unique (recurrence_of, original_due_date) of occurrences is read only here, DRF 3.16 would make
+        # both fields required for its validator. Occurrences are only saved by Task.materialize(), which
+        # relies on the constraint itself
+        validators = []
 
     def validate_due_date(self, value): # noqa
         if value and value < timezone.now():
@@ -31,14 +55,66 @@ class TaskSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Status cannot be set to completed.')
         return value
 
+    def validate_parent(self, value):
+        if value is not None and value.user_id != self.context['request'].user.id:
+            raise serializers.ValidationError(f'Invalid pk "{value.pk}" - object does not exist.')
+        return value
+
     def create(self, validated_data):
+        labels = validated_data.pop('labels', [])
+        fields = ['parent_id' if name == 'parent' else name for name in validated_data]
+        parent = validated_data.get('parent')
+        if parent is not None:
+            validated_data['path'] = parent.subtree_path
         task = Task.objects.create(user=self.context['request'].user, **validated_data)
+        if parent is not None:
+            Task.objects.using(task._state.db).roll_up(dict.fromkeys(task.ancestor_ids, task.roll_up_counts()))
+        if labels:
+            task.set_labels(labels)
+        else:
+            task.label_names = []
+        history.record(task.id, task.user_id, TaskHistory.CREATED, history.snapshot(task, fields),
+                       using=task._state.db)
         return task
 
-    def update(self, instance, validated_data):
-        instance.title = validated_data.get('title', instance.title)
-        instance.description = validated_data.get('description', instance.description)
-        instance.status = validated_data.get('status', instance.status)
-        instance.due_date = validated_data.get('due_date', instance.due_date)
-        instance.save()
-        return instance
+
+class TaskPatchSerializer(serializers.ModelSerializer):
+    """Changes a bulk update makes to every matching task, the columns it can set in a single UPDATE."""
+    status = serializers.ChoiceField(choices=Task.STATUS_CHOICES)
+    due_date = serializers.DateTimeField(allow_null=True)
+    due_date_shift = serializers.DurationField(help_text='Moves the due dates by this duration, e.g. "P7D"')
+
+    class Meta:
+        model = Task
+        fields = ('title', 'description', 'status', 'due_date', 'due_date_shift')
+
+    validate_due_date = TaskSerializer.validate_due_date
+
+    def validate(self, attrs):
+        unknown = sorted(set(self.initial_data) - set(self.fields))
+        if unknown:
+            raise serializers.ValidationError({name: ['This field cannot be changed in bulk.'] for name in unknown})
+        if not attrs:
+            raise serializers.ValidationError('The patch changes nothing.')
+        if 'due_date' in attrs and 'due_date_shift' in attrs:
+            raise serializers.ValidationError('Set either due_date or due_date_shift.')
+        return attrs
+
+
+class LabelSerializer(serializers.ModelSerializer):
+    task_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Label
+        fields = ('id', 'name', 'task_count')
+
+
+class CollaboratorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Collaborator
+        fields = ('user', 'role', 'created_at')
+        read_only_fields = ('created_at',)
+
+
+class BlockerSerializer(serializers.Serializer):
+    blocker = serializers.IntegerField(help_text='Id of the task that has to be completed first')
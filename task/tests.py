@@ -1,3 +1,1789 @@
-from django.test import TestCase
+import datetime
+import gzip
+import hashlib
+import json
+import pstats
+import shutil
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.db.models import F
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from comment.models import Comment
+from todo_proweb.concurrency import VersionConflict
+from todo_proweb.query_budget import QueryBudgetTestMixin, QueryRecorder
+from todo_proweb.sharding import HashRing, get_shard
+from todo_proweb import profiling, warmup
+from todo_proweb.idempotency import IN_FLIGHT
+from todo_proweb.schema import CachedSpectacularAPIView
+from . import autosave, history
+from .importers import import_tasks
+from .models import Collaborator, Dependency, Label, Task, TaskHistory
+from .views import TaskListAPIView, TaskDetailAPIView, TaskBoardAPIView, TaskCalendarAPIView, LabelListAPIView, \
+    TaskTreeAPIView, TaskOccurrenceAPIView, TaskActionableAPIView, TaskBlockerListAPIView, TaskBulkUpdateAPIView
+
+
+class ReplicaRoutingTests(APITestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.addCleanup(caches['shared'].clear)
+        self.user = User.objects.create_user(username='user', password='password')
+        User.objects.using('replica').create(id=self.user.id, username='user')
+        self.client.force_authenticate(self.user)
+        self.task_data = {'title': 'Primary task', 'status': Task.PENDING, 'due_date': '2099-01-01T00:00:00Z'}
+
+    def test_get_reads_from_replica(self):
+        Task.objects.using('replica').create(title='Replica task', user_id=self.user.id)
+
+        response = self.client.get('/task/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([task['title'] for task in response.data['results']], ['Replica task'])
+
+    def test_write_goes_to_primary(self):
+        response = self.client.post('/task/', self.task_data, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Task.objects.using('default').filter(title='Primary task').exists())
+        self.assertFalse(Task.objects.using('replica').exists())
+
+    def test_reads_stick_to_primary_after_write(self):
+        Task.objects.using('replica').create(title='Replica task', user_id=self.user.id)
+        self.client.post('/task/', self.task_data, format='json')
+
+        response = self.client.get('/task/')
+
+        self.assertEqual([task['title'] for task in response.data['results']], ['Primary task'])
+
+    def test_pin_is_per_user(self):
+        other = User.objects.create_user(username='other', password='password')
+        User.objects.using('replica').create(id=other.id, username='other')
+        Task.objects.using('replica').create(title='Replica task', user_id=other.id)
+        self.client.post('/task/', self.task_data, format='json')
+
+        self.client.force_authenticate(other)
+        response = self.client.get('/task/')
+
+        self.assertEqual([task['title'] for task in response.data['results']], ['Replica task'])
+
+    @override_settings(REPLICA_PIN_SECONDS=0)
+    def test_reads_return_to_replica_after_pin_expires(self):
+        Task.objects.using('replica').create(title='Replica task', user_id=self.user.id)
+        self.client.post('/task/', self.task_data, format='json')
+
+        response = self.client.get('/task/')
+
+        self.assertEqual([task['title'] for task in response.data['results']], ['Replica task'])
+
+    def test_failed_write_does_not_pin(self):
+        Task.objects.using('replica').create(title='Replica task', user_id=self.user.id)
+        self.client.post('/task/', {'title': ''}, format='json')
+
+        response = self.client.get('/task/')
+
+        self.assertEqual([task['title'] for task in response.data['results']], ['Replica task'])
+
+    def test_pin_is_a_signed_cookie(self):
+        Task.objects.using('replica').create(title='Replica task', user_id=self.user.id)
+        response = self.client.post('/task/', self.task_data, format='json')
+        self.assertTrue(response.cookies['replica_pin']['httponly'])
+
+        # an unsigned cookie, without the pin kept for clients that drop cookies
+        caches['shared'].clear()
+        self.client.cookies['replica_pin'] = str(self.user.pk)
+        with self.assertNumQueries(0, using='default'):
+            response = self.client.get('/task/')
+
+        self.assertEqual([task['title'] for task in response.data['results']], ['Replica task'])
+
+    def test_clients_without_cookies_are_pinned_by_user(self):
+        Task.objects.using('replica').create(title='Replica task', user_id=self.user.id)
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.client.post('/task/', self.task_data, format='json')
+        self.client.cookies.clear()
+
+        response = self.client.get('/task/')
+        self.assertEqual([task['title'] for task in response.data['results']], ['Primary task'])
+        with override_settings(REPLICA_PIN_CACHE=None):
+            response = self.client.get('/task/')
+        self.assertEqual([task['title'] for task in response.data['results']], ['Replica task'])
+
+    def test_batch_writes_pin(self):
+        Task.objects.using('replica').create(title='Replica task', user_id=self.user.id)
+        response = self.client.post('/batch/', {'requests': [{'method': 'POST', 'path': '/task/',
+                                                              'body': self.task_data}]}, format='json')
+        self.assertEqual(response.data['data'][0]['status'], 201)
+        self.client.cookies.clear()
+
+        response = self.client.get('/task/')
+
+        self.assertEqual([task['title'] for task in response.data['results']], ['Primary task'])
+
+
+class VersionedUpdateTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.task = Task.objects.create(title='Task', user=self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_patch_is_a_single_update_and_bumps_version(self):
+        with QueryRecorder() as recorder:
+            response = self.client.patch(f'/task/{self.task.id}/', {'title': 'Renamed'}, format='json',
+                                         HTTP_IF_MATCH='"1"')
+
+        # the previous values for the history come from a CTE of the UPDATE
+        writes = [query for query in recorder.queries if not query.startswith('SELECT')]
+        self.assertEqual([query.split()[0] for query in writes], ['WITH'])
+        self.assertIn(' RETURNING ', writes[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(response.data['data']['title'], 'Renamed')
+        self.task.refresh_from_db()
+        self.assertEqual((self.task.title, self.task.version), ('Renamed', 2))
+
+    def test_previous_values_are_returned_by_the_update(self):
+        due_date = datetime.datetime(2099, 1, 1, tzinfo=datetime.timezone.utc)
+        Task.objects.filter(pk=self.task.pk).update(due_date=due_date)
+
+        with self.assertNumQueries(1):
+            task = Task.objects.filter(pk=self.task.pk).versioned_update(
+                version=1, with_previous=True, title='Renamed', due_date=None
+            )
+
+        self.assertEqual((task.title, task.due_date, task.version), ('Renamed', None, 2))
+        self.assertEqual((task.previous['title'], task.previous['due_date'], task.previous['version']),
+                         ('Task', due_date, 1))
+        with self.assertRaises(VersionConflict):
+            Task.objects.filter(pk=self.task.pk).versioned_update(version=1, with_previous=True, title='Stale')
+
+    def test_stale_version_is_rejected(self):
+        Task.objects.filter(id=self.task.id).versioned_update(title='Changed elsewhere')
+
+        response = self.client.patch(f'/task/{self.task.id}/', {'title': 'Renamed'}, format='json',
+                                     HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(response.status_code, 409)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.title, 'Changed elsewhere')
+
+    def test_other_users_task_is_not_found(self):
+        other = User.objects.create_user(username='other', password='password')
+        self.client.force_authenticate(other)
+
+        response = self.client.patch(f'/task/{self.task.id}/', {'title': 'Renamed'}, format='json',
+                                     HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class TaskBoardTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+        Task.objects.bulk_create(Task(title=f'Pending {i}', user=self.user) for i in range(5))
+        Task.objects.create(title='Completed', status=Task.COMPLETED, user=self.user)
+
+    def test_board_columns(self):
+        response = self.client.get('/task/board/?limit=2')
+
+        board = response.data['data']
+        self.assertEqual([task['title'] for task in board['P']['results']], ['Pending 4', 'Pending 3'])
+        self.assertEqual(board['P']['count'], 5)
+        self.assertEqual((board['C']['count'], board['C']['next']), (1, None))
+        self.assertEqual(board['IP'], {'count': 0, 'next': None, 'results': []})
+
+    def test_load_more_of_a_column(self):
+        cursor = self.client.get('/task/board/?limit=2').data['data']['P']['next']
+
+        response = self.client.get(f'/task/board/?limit=2&status=P&cursor={cursor}')
+
+        column = response.data['data']['P']
+        self.assertEqual([task['title'] for task in column['results']], ['Pending 2', 'Pending 1'])
+        self.assertEqual(column['count'], 3)
+        self.assertEqual(list(response.data['data']), ['P'])
+
+    def test_shared_tasks_are_on_the_collaborators_board(self):
+        other = User.objects.create_user(username='other', password='password')
+        shared = Task.objects.create(title='Shared', status=Task.IN_PROGRESS, user=other)
+        Task.objects.create(title='Private', status=Task.IN_PROGRESS, user=other)
+        Collaborator.objects.create(task=shared, user=self.user, role=Collaborator.VIEWER)
+
+        board = self.client.get('/task/board/').data['data']
+
+        self.assertEqual([task['title'] for task in board['IP']['results']], ['Shared'])
+        self.assertEqual(board['P']['count'], 5)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class TaskCalendarTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+        utc = datetime.timezone.utc
+        Task.objects.bulk_create([
+            Task(title='Late evening', due_date=datetime.datetime(2024, 10, 1, 20, 0, tzinfo=utc), user=self.user),
+            Task(title='Morning 1', due_date=datetime.datetime(2024, 10, 2, 8, 0, tzinfo=utc), user=self.user),
+            Task(title='Morning 2', due_date=datetime.datetime(2024, 10, 2, 9, 0, tzinfo=utc), user=self.user),
+            Task(title='Morning 3', due_date=datetime.datetime(2024, 10, 2, 10, 0, tzinfo=utc), user=self.user),
+            Task(title='Next month', due_date=datetime.datetime(2024, 11, 1, 10, 0, tzinfo=utc), user=self.user),
+        ])
+
+    def test_days_in_utc(self):
+        response = self.client.get('/task/calendar/?from=2024-10-01&to=2024-10-31&per_day=2')
+
+        days = response.data['data']
+        self.assertEqual([(day['date'], day['count']) for day in days], [('2024-10-01', 1), ('2024-10-02', 3)])
+        self.assertEqual([task['title'] for task in days[1]['results']], ['Morning 1', 'Morning 2'])
+
+    def test_days_in_requester_timezone(self):
+        response = self.client.get('/task/calendar/?from=2024-10-02&to=2024-10-02&tz=Asia/Tashkent')
+
+        days = response.data['data']
+        self.assertEqual([(day['date'], day['count']) for day in days], [('2024-10-02', 4)])
+        self.assertEqual(days[0]['results'][0]['due_date'], '2024-10-02T01:00:00+05:00')
+
+    def test_shared_tasks_are_on_the_collaborators_calendar(self):
+        other = User.objects.create_user(username='other', password='password')
+        due_date = datetime.datetime(2024, 10, 3, 8, 0, tzinfo=datetime.timezone.utc)
+        shared = Task.objects.create(title='Shared', due_date=due_date, user=other)
+        weekly = Task.objects.create(title='Weekly', due_date=due_date, recurrence=Task.WEEKLY, user=other)
+        Task.objects.create(title='Private', due_date=due_date, user=other)
+        for task in (shared, weekly):
+            Collaborator.objects.create(task=task, user=self.user, role=Collaborator.VIEWER)
+
+        days = self.client.get('/task/calendar/?from=2024-10-03&to=2024-10-10').data['data']
+
+        self.assertEqual([(day['date'], [task['title'] for task in day['results']]) for day in days],
+                         [('2024-10-03', ['Weekly', 'Shared']), ('2024-10-10', ['Weekly'])])
+
+    def test_invalid_timezone(self):
+        response = self.client.get('/task/calendar/?from=2024-10-01&to=2024-10-31&tz=Mars/Olympus')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_per_day(self):
+        for per_day in ('0', '-1', 'many'):
+            with self.subTest(per_day=per_day):
+                response = self.client.get(f'/task/calendar/?from=2024-10-01&to=2024-10-31&per_day={per_day}')
+
+                self.assertEqual(response.status_code, 400)
+
+    def test_per_day_is_capped(self):
+        due_date = datetime.datetime(2024, 10, 3, tzinfo=datetime.timezone.utc)
+        Task.objects.bulk_create(Task(title=f'Task {i}', due_date=due_date, user=self.user)
+                                 for i in range(TaskCalendarAPIView.max_per_day + 1))
+
+        response = self.client.get('/task/calendar/?from=2024-10-03&to=2024-10-03&per_day=1000')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data'][0]['results']), TaskCalendarAPIView.max_per_day)
+
+
+class TaskImportTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+
+    def test_csv_import_reports_invalid_rows(self):
+        upload = SimpleUploadedFile('tasks.csv', (
+            'title,description,status,due_date\n'
+            'First,"With, comma",P,2099-01-01T00:00:00Z\n'
+            ',,P,2099-01-01T00:00:00Z\n'
+            'Past,,C,2000-01-01T00:00:00Z\n'
+            'Second,,IP,2099-01-02T00:00:00Z\n'
+        ).encode())
+
+        response = self.client.post('/task/import/', {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['data']['created'], response.data['data']['failed']), (2, 2))
+        self.assertEqual([error['row'] for error in response.data['data']['errors']], [2, 3])
+        self.assertEqual(list(self.user.tasks.order_by('id').values_list('title', 'description', 'status')),
+                         [('First', 'With, comma', 'P'), ('Second', None, 'IP')])
+
+    def test_rejects_columns_that_are_not_imported(self):
+        parent = Task.objects.create(title='Parent', user=self.user)
+        upload = SimpleUploadedFile('tasks.ndjson', (
+            f'{{"title": "Child", "status": "P", "due_date": "2099-01-01T00:00:00Z", "parent": {parent.id}}}\n'
+            '{"title": "Labelled", "status": "P", "due_date": "2099-01-01T00:00:00Z", "labels": ["work"]}\n'
+            '{"title": "Plain", "status": "P", "due_date": "2099-01-01T00:00:00Z", "color": "red"}\n'
+        ).encode())
+
+        # no lookup of the parent per row, only the highest id, the INSERT and the history
+        with QueryRecorder() as recorder:
+            result = import_tasks(upload, self.user, 'ndjson')
+
+        self.assertEqual(recorder.count, 3)
+        self.assertEqual((result['created'], result['failed']), (1, 2))
+        self.assertEqual([error['errors'] for error in result['errors']], [
+            {'parent': ['This field cannot be imported.']}, {'labels': ['This field cannot be imported.']}
+        ])
+        self.assertEqual(list(self.user.tasks.values_list('title', flat=True).order_by('id')), ['Parent', 'Plain'])
+
+    def test_imports_recurring_tasks(self):
+        upload = SimpleUploadedFile('tasks.csv', (
+            'title,status,due_date,recurrence,recurrence_interval,recurrence_until\n'
+            'Standup,P,2099-01-01T09:00:00Z,daily,2,2099-02-01T00:00:00Z\n'
+            'Once,P,2099-01-01T09:00:00Z,,,\n'
+            'Never,P,2099-01-01T09:00:00Z,hourly,0,\n'
+        ).encode())
+
+        result = import_tasks(upload, self.user, 'csv')
+
+        self.assertEqual((result['created'], result['failed']), (2, 1))
+        self.assertEqual(set(result['errors'][0]['errors']), {'recurrence', 'recurrence_interval'})
+        self.assertEqual(list(self.user.tasks.order_by('id').values_list('recurrence', 'recurrence_interval',
+                                                                         'recurrence_until')),
+                         [('daily', 2, datetime.datetime(2099, 2, 1, tzinfo=datetime.timezone.utc)), ('', 1, None)])
+
+    def test_ndjson_import_in_chunks(self):
+        lines = ''.join(f'{{"title": "Task {i}", "status": "P", "due_date": "2099-01-01T00:00:00Z"}}\n'
+                        for i in range(12))
+        upload = SimpleUploadedFile('tasks.ndjson', (lines + 'not json\n').encode())
+
+        result = import_tasks(upload, self.user, 'ndjson', chunk_size=5)
+
+        self.assertEqual((result['created'], result['failed']), (12, 1))
+        self.assertEqual(self.user.tasks.count(), 12)
+        self.assertEqual(self.user.tasks.first().version, 1)
+        # one record per task, also with the chunks sharing the second they were created in
+        created = TaskHistory.objects.filter(action=TaskHistory.CREATED).order_by('task_id')
+        self.assertEqual(list(created.values_list('task_id', flat=True)),
+                         list(self.user.tasks.order_by('id').values_list('id', flat=True)))
+        changes = created.first().changes
+        self.assertEqual(set(changes), {'title', 'description', 'status', 'due_date'})
+        self.assertEqual((changes['title'], changes['description'], changes['status']),
+                         ([None, 'Task 0'], [None, None], [None, 'P']))
+
+
+SHARDS = ['default', 'shard_1', 'shard_2']
+
+
+class HashRingTests(APITestCase):
+
+    def test_keys_spread_over_aliases(self):
+        ring = HashRing(['a', 'b', 'c'])
+
+        counts = {alias: 0 for alias in 'abc'}
+        for key in range(3000):
+            counts[ring.get(key)] += 1
+
+        self.assertTrue(all(count > 700 for count in counts.values()), counts)
+
+    def test_adding_an_alias_only_moves_keys_to_it(self):
+        ring, bigger_ring = HashRing(['a', 'b', 'c']), HashRing(['a', 'b', 'c', 'd'])
+
+        moved = [key for key in range(3000) if ring.get(key) != bigger_ring.get(key)]
+
+        self.assertEqual({bigger_ring.get(key) for key in moved}, {'d'})
+        self.assertLess(len(moved), 3000 * 0.35)
+
+
+@override_settings(DATABASE_REPLICAS=[], DATABASE_SHARDS=SHARDS)
+class ShardingTests(APITestCase):
+    databases = set(SHARDS)
+
+    def user_on(self, shard):
+        while True:
+            user = User.objects.create_user(username=f'user{User.objects.count()}', password='password')
+            if get_shard(user.id) == shard:
+                return user
+
+    def test_requests_use_the_users_shard(self):
+        user = self.user_on('shard_1')
+        self.client.force_authenticate(user)
+
+        task_data = {'title': 'Sharded', 'status': Task.PENDING, 'due_date': '2099-01-01T00:00:00Z'}
+        response = self.client.post('/task/', task_data, format='json')
+        self.assertEqual(response.status_code, 201)
+        task = Task.objects.using('shard_1').get(title='Sharded')
+        self.assertFalse(Task.objects.using('default').exists() or Task.objects.using('shard_2').exists())
+
+        response = self.client.post('/comment/', {'task': task.id, 'text': 'Comment'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Task.objects.using('shard_1').get(id=task.id).comment_count, 1)
+
+        response = self.client.patch(f'/task/{task.id}/', {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/task/')
+        self.assertEqual([task['title'] for task in response.data['results']], ['Renamed'])
+
+        self.client.force_authenticate(self.user_on('shard_2'))
+        self.assertEqual(self.client.get('/task/').data['results'], [])
+
+    def test_atomic_batch_is_rolled_back_on_the_users_shard(self):
+        self.client.force_authenticate(self.user_on('shard_1'))
+        task_data = {'title': 'Sharded', 'status': Task.PENDING, 'due_date': '2099-01-01T00:00:00Z'}
+        response = self.client.post('/batch/', {'requests': [{'method': 'POST', 'path': '/task/', 'body': task_data},
+                                                             {'method': 'POST', 'path': '/task/', 'body': {}}],
+                                                'atomic': True}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Task.objects.using('shard_1').exists())
+
+    def test_comments_and_history_stay_with_the_task(self):
+        owner, editor = self.user_on('shard_1'), self.user_on('shard_2')
+        task = Task(title='Task', user=owner)
+        task.save()
+        comment = Comment(task=task, user=editor, text='Comment')
+        comment.save()
+        self.assertEqual((task._state.db, comment._state.db), ('shard_1', 'shard_1'))
+        with self.captureOnCommitCallbacks(using='shard_1', execute=True):
+            history.record(task.id, editor.id, TaskHistory.UPDATED, {'title': ['Task', 'Edited']}, using='shard_1')
+        history.history_buffer.flush()
+        self.assertEqual(TaskHistory.objects.using('shard_1').get().user_id, editor.id)
+        self.assertFalse(TaskHistory.objects.using('shard_2').exists())
+
+    def test_tasks_are_only_shared_on_the_owners_shard(self):
+        owner = self.user_on('shard_1')
+        task = Task(title='Task', user=owner)
+        task.save()
+        self.client.force_authenticate(owner)
+
+        response = self.client.post(f'/task/{task.id}/collaborators/', {'user': self.user_on('shard_2').id},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f'/task/{task.id}/collaborators/', {'user': self.user_on('shard_1').id},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Collaborator.objects.using('shard_1').count(), 1)
+
+    def test_admin_reads_the_picked_shard(self):
+        staff = self.user_on('shard_1')
+        User.objects.filter(pk=staff.pk).update(is_staff=True, is_superuser=True)
+        self.client.force_login(staff)
+        owners = {shard: self.user_on(shard) for shard in SHARDS}
+        for shard, owner in owners.items():
+            task = Task(title=f'Task on {shard}', user=owner)
+            task.save()
+            Comment(task=task, user=owner, text=f'Comment on {shard}').save()
+
+        response = self.client.get('/admin/task/task/?shard=shard_2')
+        self.assertContains(response, 'Task on shard_2')
+        self.assertNotContains(response, 'Task on shard_1')
+        # users are only kept on the primary database
+        response = self.client.get('/admin/comment/comment/')
+        self.assertContains(response, 'Comment on default')
+        self.assertNotContains(response, 'Comment on shard_1')
+        response = self.client.get('/admin/comment/comment/?shard=shard_1')
+        self.assertContains(response, 'Comment on shard_1')
+        self.assertContains(response, owners['shard_1'].username)
+
+        task = Task.objects.using('shard_2').get()
+        path = f'/admin/task/task/{task.id}/change/?_changelist_filters=shard%3Dshard_2'
+        self.assertContains(self.client.get(path), 'Task on shard_2')
+        response = self.client.post(path, {'title': 'Edited', 'status': task.status, 'user': task.user_id,
+                                           'recurrence_interval': task.recurrence_interval})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Task.objects.using('shard_2').get().title, 'Edited')
+        self.assertEqual(Task.objects.using('shard_1').get().title, 'Task on shard_1')
+
+    def test_comment_stats_are_repaired_on_every_shard(self):
+        for shard in SHARDS:
+            task = Task(title='Task', user=self.user_on(shard))
+            task.save()
+            Comment(task=task, user=task.user, text='Comment').save()
+            Task.objects.using(shard).update(comment_count=10)
+
+        call_command('repair_comment_stats', stdout=StringIO())
+
+        for shard in SHARDS:
+            self.assertEqual(Task.objects.using(shard).get().comment_count, 1)
+
+    def test_rebalance_moves_users_to_their_shard(self):
+        users = [self.user_on(shard) for shard in SHARDS]
+        with override_settings(DATABASE_SHARDS=['default']):
+            for user in users:
+                task = Task.objects.create(title=f'Task of {user.username}', user=user)
+                comment = Comment.objects.create(text='Comment', task=task, user=user)
+            subtask = Task.objects.create(title='Subtask', user=users[2], parent=task, path=task.subtree_path)
+            subtask.set_labels(['work'])
+            task.add_blocker(subtask)
+            TaskHistory.objects.bulk_create([
+                TaskHistory(task_id=task.id, user=users[2], action=TaskHistory.CREATED, changes={'title': [None, 'T']}),
+                TaskHistory(task_id=task.id, comment_id=comment.id, user=users[2], action=TaskHistory.CREATED,
+                            changes={'text': [None, 'Comment']}),
+                TaskHistory(task_id=subtask.id, user=users[2], action=TaskHistory.UPDATED,
+                            changes={'status': ['P', 'C']}),
+            ])
+
+        call_command('rebalance_shards', '--batch-size', '1', stdout=StringIO())
+
+        for user, shard in zip(users, SHARDS):
+            task = Task.objects.using(shard).get(user=user, parent=None)
+            self.assertEqual((task.title, task.comment_count), (f'Task of {user.username}', 1))
+            self.assertEqual(list(Task.objects.using('default').filter(user=user).exclude(pk=task.pk)), [])
+        moved_comment = Comment.objects.using('shard_2').get(user=users[2])
+        self.assertEqual(moved_comment.created_at, comment.created_at)
+        moved_subtask = Task.objects.using('shard_2').get(title='Subtask')
+        self.assertEqual(moved_subtask.path, f'/{moved_subtask.parent_id}/')
+        self.assertEqual([label.name for label in moved_subtask.labels.all()], ['work'])
+        self.assertEqual(list(Dependency.objects.using('shard_2').values_list('task', 'blocker')),
+                         [(moved_subtask.parent_id, moved_subtask.id)])
+        self.assertEqual(list(TaskHistory.objects.using('shard_2').order_by('id').values_list('task_id', 'comment_id')),
+                         [(moved_subtask.parent_id, None), (moved_subtask.parent_id, moved_comment.id),
+                          (moved_subtask.id, None)])
+        self.assertFalse(TaskHistory.objects.using('default').exists())
+
+        out = StringIO()
+        call_command('rebalance_shards', stdout=out)
+        self.assertIn('Moved 0 tasks of 0 users', out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class AdminChangelistTests(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, path):
+        with QueryRecorder() as recorder:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return recorder.count
+
+    def test_query_count_does_not_grow_with_rows(self):
+        counts = []
+        for size in (1, 500):
+            users = User.objects.bulk_create(User(username=f'user{size}-{i}') for i in range(size))
+            tasks = Task.objects.bulk_create(Task(title='Task', user=user, due_date='2099-01-01T00:00:00Z')
+                                             for user in users)
+            Comment.objects.bulk_create(Comment(text='Comment', task=task, user=task.user) for task in tasks)
+            counts.append((self.changelist_queries('/admin/task/task/?status__exact=P'),
+                           self.changelist_queries('/admin/comment/comment/')))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_edit_form_does_not_list_users(self):
+        User.objects.bulk_create(User(username=f'user{i}') for i in range(50))
+        task = Task.objects.create(title='Task', user=self.admin)
+
+        response = self.client.get(f'/admin/task/task/{task.id}/change/')
+
+        self.assertNotContains(response, 'user49')
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class TaskHistoryTests(APITestCase):
+
+    def setUp(self):
+        history.history_buffer.records.clear()
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+
+    def test_changes_of_task_and_comments(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            task_id = self.client.post('/task/', {'title': 'Task', 'status': Task.PENDING,
+                                                  'due_date': '2099-01-01T00:00:00Z'}, format='json').data['data']['id']
+            self.client.patch(f'/task/{task_id}/', {'status': Task.COMPLETED, 'title': 'Task'}, format='json')
+            comment_id = self.client.post('/comment/', {'task': task_id, 'text': 'First'},
+                                          format='json').data['data']['id']
+            self.client.patch(f'/comment/{comment_id}/', {'text': 'Edited'}, format='json')
+            self.client.delete(f'/comment/{comment_id}/')
+        self.assertEqual(TaskHistory.objects.count(), 0)
+        history.history_buffer.flush()
+
+        response = self.client.get(f'/task/{task_id}/history/?page_size=3')
+        records = response.data['results']
+        response = self.client.get(response.data['next'])
+        records += response.data['results']
+
+        self.assertEqual([(record['action'], record['comment_id']) for record in records], [
+            ('deleted', comment_id), ('updated', comment_id), ('created', comment_id),
+            ('updated', None), ('created', None),
+        ])
+        self.assertEqual(records[1]['changes'], {'text': ['First', 'Edited']})
+        self.assertEqual(records[3]['changes'], {'status': ['P', 'C']})
+        self.assertEqual(records[4]['changes']['due_date'], [None, '2099-01-01T00:00:00Z'])
+        self.assertIsNone(response.data['next'])
+
+    def test_collaborators_see_all_changes_and_other_users_none(self):
+        task = Task.objects.create(title='Task', user=self.user)
+        editor = User.objects.create_user(username='editor', password='password')
+        Collaborator.objects.create(task=task, user=editor, role=Collaborator.EDITOR)
+        with self.captureOnCommitCallbacks(execute=True):
+            history.record(task.id, self.user.id, TaskHistory.CREATED, {})
+            history.record(task.id, editor.id, TaskHistory.UPDATED, {'title': ['Task', 'Edited']})
+        history.history_buffer.flush()
+
+        for user in (self.user, editor):
+            self.client.force_authenticate(user)
+            response = self.client.get(f'/task/{task.id}/history/')
+            self.assertEqual([record['user'] for record in response.data['results']], [editor.id, self.user.id])
+
+        self.client.force_authenticate(User.objects.create_user(username='other', password='password'))
+        response = self.client.get(f'/task/{task.id}/history/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_failed_flush_is_spooled_and_replayed(self):
+        spool_dir = tempfile.mkdtemp()
+        task = Task.objects.create(title='Task', user=self.user)
+        with override_settings(HISTORY={'FLUSH_INTERVAL': None, 'SPOOL_DIR': spool_dir}):
+            with self.captureOnCommitCallbacks(execute=True):
+                history.record(task.id, self.user.id, TaskHistory.UPDATED, {'title': ['Old', 'Task']})
+            with mock.patch('task.history._write', side_effect=DatabaseError), self.assertLogs('task.history'):
+                history.history_buffer.flush()
+            self.assertEqual(len(list(Path(spool_dir).iterdir())), 1)
+
+            self.assertEqual(history.replay_spool(), 1)
+
+        self.assertEqual(list(Path(spool_dir).iterdir()), [])
+        self.assertEqual(TaskHistory.objects.get().changes, {'title': ['Old', 'Task']})
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class TaskLabelTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+        self.work = Task.objects.create(title='Work', user=self.user)
+        self.work.set_labels(['work'])
+        self.both = Task.objects.create(title='Both', user=self.user)
+        self.both.set_labels(['work', 'urgent'])
+        Task.objects.create(title='None', user=self.user)
+
+    def titles(self, url):
+        return sorted(task['title'] for task in self.client.get(url).data['results'])
+
+    def test_filter_any_and_all(self):
+        self.assertEqual(self.titles('/task/?labels=work'), ['Both', 'Work'])
+        self.assertEqual(self.titles('/task/?labels=urgent,work'), ['Both', 'Work'])
+        self.assertEqual(self.titles('/task/?labels=urgent,work&match=all'), ['Both'])
+        self.assertEqual(self.titles('/task/?labels=urgent,missing&match=all'), [])
+        self.assertEqual(self.client.get('/task/?labels=work&match=some').status_code, 400)
+
+    def test_labels_of_other_users_do_not_match(self):
+        other = User.objects.create_user(username='other', password='password')
+        task = Task.objects.create(title='Other', user=other)
+        task.set_labels(['work'])
+
+        self.assertEqual(self.titles('/task/?labels=work'), ['Both', 'Work'])
+
+    def test_set_labels_on_create_and_update(self):
+        response = self.client.post('/task/', {'title': 'New', 'status': Task.PENDING,
+                                               'due_date': '2099-01-01T00:00:00Z', 'labels': ['home', 'work']},
+                                    format='json')
+        self.assertEqual(response.data['data']['labels'], ['home', 'work'])
+        task_id = response.data['data']['id']
+
+        response = self.client.patch(f'/task/{task_id}/', {'labels': ['home']}, format='json')
+
+        self.assertEqual(response.data['data']['labels'], ['home'])
+        self.assertEqual(self.client.get(f'/task/{task_id}/').data['data']['labels'], ['home'])
+        self.assertEqual(Label.objects.filter(user=self.user).count(), 3)
+
+    def test_label_counts(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/task/labels/')
+
+        self.assertEqual([(label['name'], label['task_count']) for label in response.data['data']],
+                         [('urgent', 1), ('work', 2)])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class SubtaskTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+        self.root = self.create('Root')
+        self.child = self.create('Child', self.root)
+        self.grandchild = self.create('Grandchild', self.child)
+        self.sibling = self.create('Sibling', self.root)
+
+    def create(self, title, parent=None):
+        data = {'title': title, 'status': Task.PENDING, 'due_date': '2099-01-01T00:00:00Z'}
+        if parent is not None:
+            data['parent'] = parent.id
+        response = self.client.post('/task/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Task.objects.get(id=response.data['data']['id'])
+
+    def counts(self, *tasks):
+        return [(task.subtask_count, task.completed_subtask_count)
+                for task in Task.objects.filter(id__in=[task.id for task in tasks]).order_by('id')]
+
+    def test_paths_and_counts(self):
+        self.assertEqual(self.grandchild.path, f'/{self.root.id}/{self.child.id}/')
+        self.assertEqual(self.counts(self.root, self.child, self.grandchild), [(3, 0), (1, 0), (0, 0)])
+
+        self.client.patch(f'/task/{self.grandchild.id}/', {'status': Task.COMPLETED}, format='json')
+        self.assertEqual(self.counts(self.root, self.child), [(3, 1), (1, 1)])
+
+        self.client.patch(f'/task/{self.grandchild.id}/', {'status': Task.PENDING}, format='json')
+        self.assertEqual(self.counts(self.root, self.child), [(3, 0), (1, 0)])
+
+    def test_tree(self):
+        with QueryRecorder() as recorder:
+            response = self.client.get(f'/task/{self.root.id}/tree/')
+
+        self.assertEqual(len(recorder.queries), 3)
+        tree = response.data['data']
+        self.assertEqual(tree['title'], 'Root')
+        self.assertEqual([task['title'] for task in tree['subtasks']], ['Child', 'Sibling'])
+        self.assertEqual([task['title'] for task in tree['subtasks'][0]['subtasks']], ['Grandchild'])
+        self.assertEqual(self.client.get(f'/task/{self.child.id}/tree/').data['data']['subtask_count'], 1)
+
+    def test_move_subtree(self):
+        self.client.patch(f'/task/{self.grandchild.id}/', {'status': Task.COMPLETED}, format='json')
+
+        response = self.client.patch(f'/task/{self.child.id}/', {'parent': self.sibling.id}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.path, f'/{self.root.id}/{self.sibling.id}/{self.child.id}/')
+        self.assertEqual(self.counts(self.root, self.child, self.sibling), [(3, 1), (1, 1), (2, 1)])
+
+        self.client.patch(f'/task/{self.child.id}/', {'parent': None}, format='json')
+
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.path, f'/{self.child.id}/')
+        self.assertEqual(self.counts(self.root, self.child, self.sibling), [(1, 0), (1, 1), (0, 0)])
+
+    def test_cannot_move_below_itself(self):
+        response = self.client.patch(f'/task/{self.root.id}/', {'parent': self.grandchild.id}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.root.refresh_from_db()
+        self.assertIsNone(self.root.parent_id)
+
+    def test_parent_of_other_user(self):
+        self.client.force_authenticate(User.objects.create_user(username='other', password='password'))
+
+        response = self.client.post('/task/', {'title': 'Other', 'status': Task.PENDING,
+                                               'due_date': '2099-01-01T00:00:00Z', 'parent': self.root.id},
+                                    format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_delete_subtree(self):
+        self.client.patch(f'/task/{self.grandchild.id}/', {'status': Task.COMPLETED}, format='json')
+
+        self.client.delete(f'/task/{self.child.id}/')
+
+        self.assertFalse(Task.objects.filter(id__in=[self.child.id, self.grandchild.id]).exists())
+        self.assertEqual(self.counts(self.root), [(1, 0)])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class SharingTests(APITestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.editor = User.objects.create_user(username='editor', password='password')
+        self.viewer = User.objects.create_user(username='viewer', password='password')
+        self.task = Task.objects.create(title='Shared', user=self.owner)
+        Task.objects.create(title='Private', user=self.owner)
+        Comment.objects.create(text='By owner', task=self.task, user=self.owner)
+        self.client.force_authenticate(self.owner)
+        for user, role in ((self.editor, Collaborator.EDITOR), (self.viewer, Collaborator.VIEWER)):
+            response = self.client.post(f'/task/{self.task.id}/collaborators/', {'user': user.id, 'role': role},
+                                        format='json')
+            self.assertEqual(response.status_code, 201)
+
+    def test_shared_tasks_are_listed_in_the_same_queries(self):
+        Task.objects.create(title='Own', user=self.viewer)
+        self.client.force_authenticate(self.viewer)
+
+        with self.assertNumQueries(3):
+            response = self.client.get('/task/')
+
+        self.assertEqual(sorted(task['title'] for task in response.data['results']), ['Own', 'Shared'])
+        self.assertEqual(self.client.get(f'/task/{self.task.id}/').status_code, 200)
+
+    def test_roles(self):
+        self.client.force_authenticate(self.viewer)
+        self.assertEqual(self.client.patch(f'/task/{self.task.id}/', {'title': 'Viewed'}, format='json').status_code,
+                         404)
+        self.assertEqual(self.client.post('/comment/', {'task': self.task.id, 'text': 'Hi'}, format='json').status_code,
+                         400)
+
+        self.client.force_authenticate(self.editor)
+        self.assertEqual(self.client.patch(f'/task/{self.task.id}/', {'title': 'Edited'}, format='json').status_code,
+                         200)
+        self.assertEqual(self.client.post('/comment/', {'task': self.task.id, 'text': 'Hi'}, format='json').status_code,
+                         201)
+        self.assertEqual(self.client.delete(f'/task/{self.task.id}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/task/{self.task.id}/collaborators/').data['data'], [])
+
+        self.client.force_authenticate(self.viewer)
+        response = self.client.get(f'/comment/?task={self.task.id}')
+        self.assertEqual([comment['text'] for comment in response.data['data']], ['By owner', 'Hi'])
+
+    def test_change_role_and_unshare(self):
+        self.client.post(f'/task/{self.task.id}/collaborators/', {'user': self.viewer.id, 'role': Collaborator.EDITOR},
+                         format='json')
+        response = self.client.get(f'/task/{self.task.id}/collaborators/')
+        self.assertEqual([(c['user'], c['role']) for c in response.data['data']],
+                         [(self.editor.id, 'editor'), (self.viewer.id, 'editor')])
+
+        response = self.client.delete(f'/task/{self.task.id}/collaborators/{self.viewer.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.client.force_authenticate(self.viewer)
+        self.assertEqual(self.client.get(f'/task/{self.task.id}/').status_code, 404)
+        self.assertEqual(self.client.get('/task/').data['results'], [])
+
+    def test_strangers_see_nothing(self):
+        self.client.force_authenticate(User.objects.create_user(username='stranger', password='password'))
+
+        self.assertEqual(self.client.get(f'/task/{self.task.id}/').status_code, 404)
+        self.assertEqual(self.client.get('/comment/').data['data'], [])
+        response = self.client.post(f'/task/{self.task.id}/collaborators/', {'user': self.viewer.id}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class DependencyTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+        # design <- build <- release, docs is independent
+        self.design, self.build, self.release, self.docs = (
+            Task.objects.create(title=title, user=self.user) for title in ('Design', 'Build', 'Release', 'Docs')
+        )
+        for task, blocker in ((self.build, self.design), (self.release, self.build)):
+            response = self.client.post(f'/task/{task.id}/blockers/', {'blocker': blocker.id}, format='json')
+            self.assertEqual(response.status_code, 201)
+
+    def actionable(self):
+        return [task['title'] for task in self.client.get('/task/actionable/').data['data']]
+
+    def test_actionable_follows_the_whole_chain(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.actionable(), ['Design', 'Docs'])
+
+        Task.objects.filter(pk=self.design.pk).update(status=Task.COMPLETED)
+        self.assertEqual(self.actionable(), ['Build', 'Docs'])
+
+        # release only waits for build, which is completed, whatever still blocks build
+        Task.objects.filter(pk=self.design.pk).update(status=Task.PENDING)
+        Task.objects.filter(pk=self.build.pk).update(status=Task.COMPLETED)
+        self.assertEqual(self.actionable(), ['Design', 'Release', 'Docs'])
+
+    def test_blockers_are_transitive(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/task/{self.release.id}/blockers/')
+
+        self.assertEqual([task['title'] for task in response.data['data']], ['Design', 'Build'])
+        self.assertEqual(self.client.get(f'/task/{self.docs.id}/blockers/').data['data'], [])
+
+    def test_cycles_are_rejected(self):
+        for task, blocker in ((self.design, self.release), (self.design, self.build), (self.docs, self.docs)):
+            response = self.client.post(f'/task/{task.id}/blockers/', {'blocker': blocker.id}, format='json')
+            self.assertEqual(response.status_code, 400, (task.title, blocker.title))
+
+        response = self.client.post(f'/task/{self.release.id}/blockers/', {'blocker': self.build.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(f'/task/{self.release.id}/blockers/', {'blocker': self.design.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Dependency.objects.count(), 3)
+
+    def test_remove_blocker_and_delete_task(self):
+        response = self.client.delete(f'/task/{self.build.id}/blockers/{self.design.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.actionable(), ['Design', 'Build', 'Docs'])
+        self.client.delete(f'/task/{self.build.id}/')
+        self.assertEqual(self.actionable(), ['Design', 'Release', 'Docs'])
+        self.assertFalse(Dependency.objects.exists())
+
+    def test_other_users(self):
+        other = Task.objects.create(title='Other', user=User.objects.create_user(username='other', password='x'))
+
+        response = self.client.post(f'/task/{self.docs.id}/blockers/', {'blocker': other.id}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.client.force_authenticate(other.user)
+        self.assertEqual(self.client.get(f'/task/{self.release.id}/blockers/').status_code, 404)
+        self.assertEqual(self.actionable(), ['Other'])
+
+    def test_shared_tasks_are_actionable_for_collaborators(self):
+        viewer = User.objects.create_user(username='viewer', password='password')
+        for task in (self.release, self.docs):
+            Collaborator.objects.create(task=task, user=viewer, role=Collaborator.VIEWER)
+        self.client.force_authenticate(viewer)
+
+        # release is still blocked through tasks that are not shared with the viewer
+        self.assertEqual(self.actionable(), ['Docs'])
+        Task.objects.filter(pk__in=[self.design.pk, self.build.pk]).update(status=Task.COMPLETED)
+        self.assertEqual(self.actionable(), ['Release', 'Docs'])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class TaskBulkUpdateTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+        self.now = timezone.now()
+        self.parent = Task.objects.create(title='Parent', user=self.user)
+        self.overdue = Task.objects.create(title='Overdue', user=self.user, parent=self.parent,
+                                           path=self.parent.subtree_path,
+                                           due_date=self.now - datetime.timedelta(days=1))
+        self.done = Task.objects.create(title='Done', user=self.user, status=Task.COMPLETED,
+                                        due_date=self.now - datetime.timedelta(days=2))
+        self.later = Task.objects.create(title='Later', user=self.user, due_date=self.now + datetime.timedelta(days=3))
+        Task.objects.filter(pk=self.parent.pk).update(subtask_count=1)
+        other = User.objects.create_user(username='other', password='password')
+        self.foreign = Task.objects.create(title='Foreign', user=other, due_date=self.now - datetime.timedelta(days=1))
+
+    def bulk_update(self, data):
+        return self.client.post('/task/bulk-update/', data, format='json')
+
+    def test_completes_overdue_tasks_in_one_update(self):
+        data = {'filter': {'due_before': self.now.isoformat()}, 'patch': {'status': Task.COMPLETED}}
+        # counting the subtasks per path, the history, the UPDATE and the counters of the ancestors
+        with QueryRecorder() as recorder:
+            response = self.bulk_update(data)
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(response.status_code, 200)
+        # the task that already was completed is not counted
+        self.assertEqual(response.data['data'], {'updated': 1})
+
+        overdue = Task.objects.get(pk=self.overdue.pk)
+        self.assertEqual((overdue.status, overdue.version), (Task.COMPLETED, 2))
+        self.assertEqual(Task.objects.get(pk=self.done.pk).version, 1)
+        self.assertEqual(Task.objects.get(pk=self.foreign.pk).status, Task.PENDING)
+        self.assertEqual(Task.objects.get(pk=self.parent.pk).completed_subtask_count, 1)
+        record = TaskHistory.objects.get()
+        self.assertEqual((record.task_id, record.user_id, record.changes),
+                         (self.overdue.pk, self.user.pk, {'status': [Task.PENDING, Task.COMPLETED]}))
+
+        response = self.bulk_update({'filter': {'status': 'C'}, 'patch': {'status': Task.PENDING}})
+        self.assertEqual(response.data['data'], {'updated': 2})
+        self.assertEqual(Task.objects.get(pk=self.parent.pk).completed_subtask_count, 0)
+
+    def test_shifts_due_dates(self):
+        response = self.bulk_update({'filter': {'due_after': self.now.isoformat()},
+                                     'patch': {'due_date_shift': 'P7D'}})
+        self.assertEqual(response.data['data'], {'updated': 1})
+        self.assertEqual(Task.objects.get(pk=self.later.pk).due_date, self.later.due_date + datetime.timedelta(days=7))
+        changes = TaskHistory.objects.get(task_id=self.later.pk).changes
+        old, new = map(datetime.datetime.fromisoformat, changes['due_date'])
+        self.assertEqual(new - old, datetime.timedelta(days=7))
+        self.assertEqual(Task.objects.get(pk=self.overdue.pk).due_date, self.overdue.due_date)
+
+    def test_history_has_only_the_changed_fields(self):
+        response = self.bulk_update({'filter': {'due_before': self.now.isoformat()},
+                                     'patch': {'title': 'Overdue', 'description': 'Late'}})
+        self.assertEqual(response.data['data'], {'updated': 2})
+
+        self.assertEqual(dict(TaskHistory.objects.values_list('task_id', 'changes')), {
+            self.overdue.pk: {'description': [None, 'Late']},
+            self.done.pk: {'title': ['Done', 'Overdue'], 'description': [None, 'Late']},
+        })
+
+    def test_uses_the_list_filters(self):
+        self.later.labels.add(Label.objects.create(user=self.user, name='work'))
+        year = self.later.due_date.year
+        response = self.bulk_update({'filter': {'year': year, 'labels': ['work']}, 'patch': {'title': 'Renamed'}})
+        self.assertEqual(response.data['data'], {'updated': 1})
+        self.assertEqual(Task.objects.get(pk=self.later.pk).title, 'Renamed')
+
+        response = self.bulk_update({'filter': {'status': 'X'}, 'patch': {'title': 'Renamed'}})
+        self.assertEqual((response.status_code, response.data), (400, {'msg': 'Invalid status filter'}))
+        response = self.bulk_update({'filter': {'due_before': 'soon'}, 'patch': {'title': 'Renamed'}})
+        self.assertEqual(response.data, {'msg': 'Invalid due_before format'})
+
+    def test_validates_the_patch(self):
+        for patch in ({}, {'labels': ['work']}, {'status': 'X'}, {'due_date': '2000-01-01T00:00:00Z'},
+                      {'due_date': '2099-01-01T00:00:00Z', 'due_date_shift': 'P1D'}):
+            with self.subTest(patch=patch):
+                response = self.bulk_update({'patch': patch})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('patch', response.data)
+        self.assertFalse(Task.objects.filter(version__gt=1).exists())
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class IdempotencyTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+
+    def create(self, title, key='key'):
+        data = {'title': title, 'status': Task.PENDING, 'due_date': '2099-01-01T00:00:00Z'}
+        return self.client.post('/task/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replays_the_first_response(self):
+        first = self.create('Task')
+        self.assertEqual(first.status_code, 201)
+        retry = self.create('Task')
+        self.assertEqual((retry.status_code, retry.data), (201, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Task.objects.count(), 1)
+
+        # another key or another user creates another task
+        self.assertEqual(self.create('Task', key='other').status_code, 201)
+        self.client.force_authenticate(User.objects.create_user(username='other', password='password'))
+        self.assertEqual(self.create('Task').status_code, 201)
+        self.assertEqual(Task.objects.count(), 3)
+
+    def test_rejects_the_key_with_a_different_body(self):
+        self.create('Task')
+        response = self.create('Another task')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Task.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY={'CACHE': 'idempotency', 'WAIT_TIMEOUT': 0})
+    def test_conflicts_while_the_first_request_is_in_flight(self):
+        digest = hashlib.sha256(b'key').hexdigest()
+        caches['idempotency'].set(f'idempotency:{self.user.pk}:/task/:{digest}', IN_FLIGHT)
+        response = self.create('Task')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(IDEMPOTENCY={'CACHE': 'idempotency', 'WAIT_TIMEOUT': 0.1})
+    def test_waits_while_the_key_is_held_without_a_response(self):
+        # a concurrent request holds the key, but its entry is gone whenever this one looks
+        cache = caches['idempotency']
+        with mock.patch.object(cache, 'add', return_value=False), mock.patch.object(cache, 'get', return_value=None), \
+                mock.patch('todo_proweb.idempotency.time.sleep', wraps=time.sleep) as sleep:
+            response = self.create('Task')
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(1 <= sleep.call_count <= 3, sleep.call_count)
+        self.assertFalse(Task.objects.exists())
+
+    def test_retries_after_a_server_error(self):
+        with mock.patch('task.serializers.TaskSerializer.save', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.create('Task')
+        response = self.create('Task')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Task.objects.count(), 1)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class BatchTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+        self.task_data = {'title': 'Task', 'status': Task.PENDING, 'due_date': '2099-01-01T00:00:00Z'}
+
+    def batch(self, requests, **options):
+        return self.client.post('/batch/', {'requests': requests, **options}, format='json')
+
+    def test_runs_the_requests_in_order(self):
+        response = self.batch([{'method': 'POST', 'path': '/task/', 'body': self.task_data},
+                               {'method': 'POST', 'path': '/task/', 'body': {'title': ''}},
+                               {'method': 'GET', 'path': '/task/?status=P'},
+                               {'method': 'GET', 'path': '/task/missing/'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['data']], [201, 400, 200, 404])
+        self.assertEqual([task['title'] for task in response.data['data'][2]['body']['results']], ['Task'])
+
+    def test_a_failing_request_does_not_fail_the_others(self):
+        with mock.patch('task.serializers.TaskSerializer.save', side_effect=[DatabaseError, None]), \
+                self.assertLogs('todo_proweb.batch', 'ERROR'):
+            response = self.batch([{'method': 'POST', 'path': '/task/', 'body': self.task_data},
+                                   {'method': 'GET', 'path': '/task/'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['data']], [500, 200])
+
+    def test_atomic_batch_is_rolled_back(self):
+        response = self.batch([{'method': 'POST', 'path': '/task/', 'body': self.task_data},
+                               {'method': 'POST', 'path': '/task/', 'body': {'title': ''}},
+                               {'method': 'POST', 'path': '/task/', 'body': self.task_data}], atomic=True)
+        self.assertEqual((response.status_code, response.data['msg']), (400, 'Batch rolled back'))
+        self.assertEqual([result['status'] for result in response.data['data']], [201, 400])
+        self.assertFalse(Task.objects.exists())
+
+        response = self.batch([{'method': 'POST', 'path': '/task/', 'body': self.task_data}] * 2, atomic=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Task.objects.count(), 2)
+
+    def test_only_gets_run_in_parallel(self):
+        response = self.batch([{'method': 'GET', 'path': '/task/'}, {'method': 'POST', 'path': '/task/'}],
+                              parallel=True)
+        self.assertEqual(response.status_code, 400)
+        response = self.batch([{'method': 'GET', 'path': '/task/'}], parallel=True, atomic=True)
+        self.assertEqual(response.status_code, 400)
+
+    def test_limits(self):
+        response = self.batch([{'method': 'GET', 'path': '/task/'}] * 21)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.batch([]).status_code, 400)
+        for path in ('/admin/', '/batch/', '/profiling/', 'task/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.batch([{'method': 'GET', 'path': path}]).status_code, 400)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ParallelBatchTests(APITransactionTestCase):
+    # committed, so the connections of the batch threads see the tasks
+    databases = {'default', 'replica'}
+
+    def test_runs_gets_in_parallel(self):
+        user = User.objects.create_user(username='user', password='password')
+        Task.objects.create(title='Task', user=user)
+        self.client.force_authenticate(user)
+        response = self.client.post('/batch/', {'requests': [{'method': 'GET', 'path': '/task/'},
+                                                             {'method': 'GET', 'path': '/comment/'},
+                                                             {'method': 'GET', 'path': '/task/missing/'}],
+                                                'parallel': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['data']], [200, 200, 404])
+        self.assertEqual([task['title'] for task in response.data['data'][0]['body']['results']], ['Task'])
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_gets_read_like_requests_of_their_own(self):
+        caches['shared'].clear()
+        self.addCleanup(caches['shared'].clear)
+        user = User.objects.create_user(username='user', password='password')
+        User.objects.using('replica').create(id=user.id, username='user')
+        Task.objects.create(title='Primary task', user=user)
+        Task.objects.using('replica').create(title='Replica task', user_id=user.id)
+        self.client.force_authenticate(user)
+
+        def titles():
+            response = self.client.post('/batch/', {'requests': [{'method': 'GET', 'path': '/task/'}] * 2,
+                                                    'parallel': True}, format='json')
+            return [[task['title'] for task in result['body']['results']] for result in response.data['data']]
+
+        # a batch of reads does not pin the user
+        self.assertEqual(titles(), [['Replica task']] * 2)
+        self.assertEqual(titles(), [['Replica task']] * 2)
+        # after a write the parallel reads follow the user to the primary database
+        response = self.client.post('/task/', {'title': 'Written', 'status': Task.PENDING,
+                                               'due_date': '2099-01-01T00:00:00Z'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        history.history_buffer.flush()
+        self.assertEqual([sorted(result) for result in titles()], [['Primary task', 'Written']] * 2)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class RecurringTaskTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+        self.standup = Task.objects.create(
+            title='Standup', user=self.user, recurrence=Task.DAILY,
+            due_date=datetime.datetime(2099, 1, 1, 9, tzinfo=datetime.timezone.utc),
+        )
+        self.standup.set_labels(['work'])
+        Task.objects.create(title='Once', user=self.user,
+                            due_date=datetime.datetime(2099, 1, 2, 12, tzinfo=datetime.timezone.utc))
+
+    def test_occurrences_are_listed_without_saving_them(self):
+        response = self.client.get('/task/?year=2099&page_size=1000')
+
+        self.assertEqual(response.data['count'], 366)
+        self.assertEqual([(task['id'], task['title'], task['due_date']) for task in response.data['results'][:3]], [
+            (None, 'Standup', '2099-01-01T09:00:00Z'),
+            (None, 'Standup', '2099-01-02T09:00:00Z'),
+            (Task.objects.get(title='Once').id, 'Once', '2099-01-02T12:00:00Z'),
+        ])
+        self.assertEqual(response.data['results'][0]['recurrence_of'], self.standup.id)
+        self.assertEqual(response.data['results'][0]['labels'], ['work'])
+        self.assertEqual(Task.objects.count(), 2)
+        # without a due date filter the recurring task is listed once
+        self.assertEqual(self.client.get('/task/').data['count'], 2)
+
+    def test_complete_and_comment_on_occurrences(self):
+        response = self.client.patch(f'/task/{self.standup.id}/occurrences/2099-01-03T09:00:00Z/',
+                                     {'status': Task.COMPLETED}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['status'], Task.COMPLETED)
+        self.assertEqual(response.data['data']['labels'], ['work'])
+        response = self.client.post('/comment/', {'task': self.standup.id, 'occurrence': '2099-01-04T09:00:00Z',
+                                                  'text': 'Moved to 10:00'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Task.objects.filter(recurrence_of=self.standup).count(), 2)
+
+        response = self.client.get('/task/?year=2099&month=1&day=3')
+        self.assertEqual([(task['status'], task['recurrence_of']) for task in response.data['results']],
+                         [(Task.COMPLETED, self.standup.id)])
+        response = self.client.get('/task/?year=2099&month=1&day=4')
+        self.assertEqual([task['comment_count'] for task in response.data['results']], [1])
+        self.assertEqual(self.client.get('/task/?year=2099&month=1').data['count'], 32)
+
+    def test_saving_an_occurrence_twice_returns_it(self):
+        path = f'/task/{self.standup.id}/occurrences/2099-01-05T09:00:00Z/'
+
+        first, second = self.client.post(path), self.client.post(path)
+
+        self.assertEqual((first.status_code, second.status_code), (201, 200))
+        self.assertEqual(first.data['data']['id'], second.data['data']['id'])
+
+    def test_invalid_occurrences(self):
+        for due_date in ('2099-01-05T10:00:00Z', '2098-12-31T09:00:00Z', 'tomorrow'):
+            response = self.client.post(f'/task/{self.standup.id}/occurrences/{due_date}/')
+            self.assertEqual(response.status_code, 400, due_date)
+        response = self.client.patch(f'/task/{self.standup.id}/occurrences/2099-01-05T09:00:00Z/',
+                                     {'status': 'X'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Task.objects.filter(recurrence_of=self.standup).exists())
+
+        self.client.force_authenticate(User.objects.create_user(username='stranger', password='password'))
+        response = self.client.post(f'/task/{self.standup.id}/occurrences/2099-01-05T09:00:00Z/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_calendar(self):
+        self.standup.recurrence_until = datetime.datetime(2099, 1, 3, tzinfo=datetime.timezone.utc)
+        self.standup.save()
+
+        response = self.client.get('/task/calendar/?from=2099-01-01&to=2099-01-31')
+
+        self.assertEqual([(day['date'], day['count'], [task['title'] for task in day['results']])
+                          for day in response.data['data']],
+                         [('2099-01-01', 1, ['Standup']), ('2099-01-02', 2, ['Standup', 'Once'])])
+
+    def test_monthly_occurrences_skip_ahead_and_stay_on_the_day(self):
+        task = Task(recurrence=Task.MONTHLY, recurrence_interval=1,
+                    due_date=datetime.datetime(2024, 1, 31, tzinfo=datetime.timezone.utc))
+        start = datetime.datetime(2124, 1, 1, tzinfo=datetime.timezone.utc)
+        end = datetime.datetime(2124, 5, 1, tzinfo=datetime.timezone.utc)
+
+        self.assertEqual([due_date.date().isoformat() for due_date in task.occurrence_dates(start, end)],
+                         ['2124-01-31', '2124-02-29', '2124-03-31', '2124-04-30'])
+
+
+class HealthCheckTests(APITestCase):
+
+    def setUp(self):
+        warmup._warm.clear()
+
+    def test_liveness(self):
+        response = self.client.get('/health/live/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(warmup.is_warm())
+
+    def test_ready_only_after_warm_up(self):
+        response = self.client.get('/health/ready/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(warmup.is_warm())
+
+
+SCHEMA = 'openapi: 3.0.3\ninfo:\n  title: Schema file\n  version: 1.0.0\npaths: {}\n'
+
+
+@override_settings(DEBUG=False)
+class SchemaTests(APITestCase):
+
+    def setUp(self):
+        schema_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, schema_dir)
+        self.schema_file = schema_dir / 'schema.yml'
+        self.schema_file.write_text(SCHEMA)
+        self.enterContext(override_settings(OPENAPI_SCHEMA_FILE=self.schema_file))
+        self.reset_cache()
+        self.addCleanup(self.reset_cache)
+
+    @staticmethod
+    def reset_cache():
+        CachedSpectacularAPIView._schema = None
+        CachedSpectacularAPIView._rendered = {}
+
+    def test_served_from_the_schema_file_once(self):
+        response = self.client.get('/schema/')
+        self.schema_file.write_text(SCHEMA.replace('Schema file', 'Changed'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.oai.openapi')
+        self.assertIn(b'title: Schema file', response.content)
+        self.assertEqual(self.client.get('/schema/').content, response.content)
+
+    def test_not_modified_for_a_matching_etag(self):
+        etag = self.client.get('/schema/')['ETag']
+
+        response = self.client.get('/schema/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get('/schema/', HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        self.assertEqual(self.client.get('/schema/', HTTP_IF_NONE_MATCH=f'"other", W/{etag}').status_code, 304)
+        self.assertEqual(self.client.get('/schema/', HTTP_IF_NONE_MATCH='*').status_code, 304)
+
+    def test_gzip(self):
+        plain = self.client.get('/schema/')
+
+        response = self.client.get('/schema/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], plain['ETag'])
+        self.assertEqual(response['Vary'], 'Accept, Accept-Encoding')
+        self.assertNotIn('Content-Encoding', plain)
+
+    def test_gzip_is_not_sent_with_quality_zero(self):
+        for accept_encoding in ('gzip;q=0, deflate', 'x-gzip', '*;q=0', 'br, *;q=0.5, gzip; q=0'):
+            response = self.client.get('/schema/', HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertNotIn('Content-Encoding', response, accept_encoding)
+        for accept_encoding in ('GZIP;q=0.5', 'br, *', 'identity;q=1, gzip;q=0.1'):
+            response = self.client.get('/schema/', HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertEqual(response['Content-Encoding'], 'gzip', accept_encoding)
+
+    def test_cached_per_media_type(self):
+        yaml_response = self.client.get('/schema/')
+        json_response = self.client.get('/schema/', HTTP_ACCEPT='application/json')
+
+        self.assertEqual(json_response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(json_response.content)['info']['title'], 'Schema file')
+        self.assertNotEqual(json_response['ETag'], yaml_response['ETag'])
+        self.assertEqual(set(CachedSpectacularAPIView._rendered), {'application/vnd.oai.openapi', 'application/json'})
+        self.assertEqual(self.client.get('/schema/')['ETag'], yaml_response['ETag'])
+
+    @override_settings(DEBUG=True)
+    def test_generated_on_each_request_with_debug(self):
+        response = self.client.get('/schema/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'Schema file', response.content)
+        self.assertIn(b'/task/', response.content)
+        self.assertNotIn('ETag', response)
+        self.assertIsNone(CachedSpectacularAPIView._schema)
+        self.assertEqual(CachedSpectacularAPIView._rendered, {})
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ProfilingTests(APITestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        self.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.user = User.objects.create_user(username='user', password='password')
+        Task.objects.create(title='Task', user=self.user)
+
+    def profile_settings(self, **settings):
+        return override_settings(PROFILING={'DIR': self.profile_dir, 'SAMPLE_RATE': 0, 'MAX_PROFILES': 2, **settings})
+
+    def test_requests_with_a_signed_header_are_profiled(self):
+        self.client.force_authenticate(self.staff)
+        with self.profile_settings():
+            token = self.client.post('/profiles/token/').data['data']['value']
+            response = self.client.get('/task/', HTTP_X_PROFILE=token)
+            self.assertEqual(self.client.get('/task/', HTTP_X_PROFILE=token + 'x').status_code, 200)
+
+            profiles = self.client.get('/profiles/').data['data']
+            self.assertEqual([(p['id'], p['path'], p['requested']) for p in profiles],
+                             [(response['X-Profile-Id'], '/task/', True)])
+            self.assertGreater(profiles[0]['queries'], 0)
+
+            sql = self.client.get(f'/profiles/{profiles[0]["id"]}/sql/')
+            self.assertIn(b'FROM "task_task"', b''.join(sql.streaming_content))
+            stats = self.client.get(f'/profiles/{profiles[0]["id"]}/pstats/')
+            with tempfile.NamedTemporaryFile() as f:
+                f.write(b''.join(stats.streaming_content))
+                f.flush()
+                self.assertTrue(pstats.Stats(f.name).total_calls)
+
+    def test_header_only_profiles_the_user_it_was_issued_to(self):
+        other = User.objects.create_user(username='other', password='password', is_staff=True)
+        self.client.force_authenticate(self.staff)
+        with self.profile_settings():
+            token = self.client.post('/profiles/token/').data['data']['value']
+            for user in (self.user, other):
+                self.client.force_authenticate(user)
+                response = self.client.get('/task/', HTTP_X_PROFILE=token)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('X-Profile-Id', response)
+            self.client.force_authenticate(None)
+            self.assertNotIn('X-Profile-Id', self.client.get('/task/', HTTP_X_PROFILE=token))
+
+            self.assertEqual(profiling.list_profiles(), [])
+
+    def test_sampled_profiles_are_bounded(self):
+        self.client.force_authenticate(self.user)
+        with self.profile_settings(SAMPLE_RATE=1):
+            for _ in range(3):
+                self.assertNotIn('X-Profile-Id', self.client.get('/task/'))
+
+            self.assertEqual(len(list(Path(self.profile_dir).glob('*.pstats'))), 2)
+            self.assertEqual(len(profiling.list_profiles()), 2)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.user)
+
+        self.assertEqual(self.client.get('/profiles/').status_code, 403)
+        self.assertEqual(self.client.post('/profiles/token/').status_code, 403)
+        self.assertEqual(self.client.get('/profiles/1-0123abcd/pstats/').status_code, 403)
+
+
+AUTOSAVE = {'ENABLED': True, 'WINDOW': None, 'CACHE': 'shared'}
+
+
+@override_settings(DATABASE_REPLICAS=[], AUTOSAVE=AUTOSAVE)
+class AutosaveTests(APITestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.addCleanup(caches['shared'].clear)
+        self.addCleanup(autosave.autosave_buffer.deadlines.clear)
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+        self.task = Task.objects.create(title='Draft', user=self.user)
+
+    def autosave(self, data):
+        return self.client.patch(f'/task/{self.task.id}/', data, format='json', HTTP_X_AUTOSAVE='1')
+
+    def test_patches_are_merged_into_one_write(self):
+        for title in ('Dr', 'Draft 2', 'Draft 3'):
+            # the task with its labels, no writes
+            with self.assertNumQueries(2):
+                response = self.autosave({'title': title})
+            self.assertEqual(response.status_code, 202)
+        response = self.autosave({'description': 'Notes'})
+        self.assertEqual((response.data['data']['title'], response.data['data']['description']), ('Draft 3', 'Notes'))
+
+        # read your writes before they are written
+        task = Task.objects.get(pk=self.task.pk)
+        self.assertEqual((task.title, task.version), ('Draft', 1))
+        self.assertEqual(self.client.get(f'/task/{self.task.id}/').data['data']['title'], 'Draft 3')
+        self.assertEqual(self.client.get('/task/').data['results'][0]['description'], 'Notes')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(autosave.autosave_buffer.flush(), 1)
+        history.history_buffer.flush()
+        task = Task.objects.get(pk=self.task.pk)
+        self.assertEqual((task.title, task.description, task.version), ('Draft 3', 'Notes', 2))
+        self.assertEqual(TaskHistory.objects.get(task_id=task.id).changes,
+                         {'title': ['Draft', 'Draft 3'], 'description': [None, 'Notes']})
+        self.assertEqual(autosave.stats(), {'writes': 1, 'writes_saved': 3})
+        self.assertEqual(autosave.autosave_buffer.flush(), 0)
+
+        self.assertEqual(self.client.get('/task/autosave/').status_code, 403)
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='password'))
+        self.assertEqual(self.client.get('/task/autosave/').data['data'], {'writes': 1, 'writes_saved': 3})
+
+    def test_board_calendar_and_actionable_show_pending_changes(self):
+        due_date = datetime.datetime(2099, 1, 1, tzinfo=datetime.timezone.utc)
+        Task.objects.filter(pk=self.task.pk).update(due_date=due_date)
+        self.autosave({'title': 'Draft 2'})
+
+        board = self.client.get('/task/board/').data['data']
+        self.assertEqual([task['title'] for task in board['P']['results']], ['Draft 2'])
+        days = self.client.get('/task/calendar/?from=2099-01-01&to=2099-01-01').data['data']
+        self.assertEqual([task['title'] for task in days[0]['results']], ['Draft 2'])
+        self.assertEqual([task['title'] for task in self.client.get('/task/actionable/').data['data']], ['Draft 2'])
+        self.assertEqual(Task.objects.get(pk=self.task.pk).title, 'Draft')
+
+    def test_other_changes_are_written_after_the_pending_ones(self):
+        self.autosave({'title': 'Draft 2'})
+        response = self.client.patch(f'/task/{self.task.id}/', {'status': Task.IN_PROGRESS}, format='json',
+                                     HTTP_X_AUTOSAVE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['data']['title'], response.data['data']['version']), ('Draft 2', 3))
+        self.assertEqual(autosave.autosave_buffer.flush(), 0)
+
+    def test_only_opted_in_patches_are_merged(self):
+        self.assertEqual(self.client.patch(f'/task/{self.task.id}/', {'title': 'Now'}, format='json').status_code,
+                         200)
+        self.assertEqual(self.client.patch(f'/task/{self.task.id}/', {'title': 'Versioned'}, format='json',
+                                           HTTP_X_AUTOSAVE='1', HTTP_IF_MATCH='"2"').status_code, 200)
+        with override_settings(AUTOSAVE={**AUTOSAVE, 'ENABLED': False}):
+            self.assertEqual(self.autosave({'title': 'Disabled'}).status_code, 200)
+        # not shared between workers, kept in the database, missing
+        for cache in ('default', 'idempotency', 'missing'):
+            with self.subTest(cache=cache), override_settings(AUTOSAVE={**AUTOSAVE, 'CACHE': cache}):
+                self.assertEqual(self.autosave({'title': cache}).status_code, 200)
+                self.assertEqual([warning.id for warning in autosave.check_cache()], ['task.W001'])
+        self.assertEqual(autosave.check_cache(), [])
+        self.assertEqual(Task.objects.get(pk=self.task.pk).version, 7)
+
+        other = User.objects.create_user(username='other', password='password')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.autosave({'title': 'Not mine'}).status_code, 404)
+
+    def test_nothing_pending_is_not_locked(self):
+        with mock.patch.object(autosave, '_locked') as locked:
+            response = self.client.patch(f'/task/{self.task.id}/', {'title': 'Now'}, format='json')
+            self.assertEqual(self.client.delete(f'/task/{self.task.id}/').status_code, 200)
+
+        self.assertEqual(response.status_code, 200)
+        locked.assert_not_called()
+
+    def test_strangers_do_not_write_pending_changes(self):
+        self.autosave({'title': 'Draft 2'})
+        cache = caches['shared']
+        cache.set(f'autosave:task:{self.task.id}:lock', 'other')
+        self.client.force_authenticate(User.objects.create_user(username='stranger', password='password'))
+
+        with mock.patch.object(autosave, 'write', wraps=autosave.write) as write:
+            response = self.client.patch(f'/task/{self.task.id}/', {'status': Task.IN_PROGRESS}, format='json')
+
+        self.assertEqual(response.status_code, 404)
+        write.assert_not_called()
+        self.assertEqual(Task.objects.get(pk=self.task.pk).title, 'Draft')
+        self.assertTrue(autosave.has_pending(self.task.id))
+
+    def test_locked_changes_conflict(self):
+        self.autosave({'title': 'Draft 2'})
+        lock = f'autosave:task:{self.task.id}:lock'
+        cache = caches['shared']
+        cache.set(lock, 'other')
+        with override_settings(AUTOSAVE={**AUTOSAVE, 'LOCK_WAIT': 0}):
+            self.assertEqual(self.autosave({'title': 'Draft 3'}).status_code, 409)
+            self.assertEqual(self.client.patch(f'/task/{self.task.id}/', {'status': Task.IN_PROGRESS},
+                                               format='json').status_code, 409)
+            with self.assertLogs('task.autosave', 'ERROR'):
+                self.assertEqual(autosave.autosave_buffer.flush(), 0)
+        # the lock of the other request is left alone
+        self.assertEqual(cache.get(lock), 'other')
+
+        cache.delete(lock)
+        self.assertEqual(autosave.autosave_buffer.flush(), 1)
+        self.assertEqual(Task.objects.get(pk=self.task.pk).title, 'Draft 2')
+
+    def test_cache_errors_are_retried_and_logged_at_exit(self):
+        self.autosave({'title': 'Draft 2'})
+        # such as redis.ConnectionError
+        with mock.patch.object(caches['shared'], 'get', side_effect=ConnectionError('down')):
+            with self.assertLogs('task.autosave', 'ERROR'):
+                self.assertEqual(autosave.autosave_buffer.flush(), 0)
+            with self.assertLogs('task.autosave', 'ERROR') as logs:
+                autosave.autosave_buffer.close()
+        self.assertIn(f'Autosaved changes of task {self.task.id} were not written', logs.output[-1])
+
+        self.assertEqual(autosave.autosave_buffer.flush([self.task.id]), 1)
+        self.assertEqual(Task.objects.get(pk=self.task.pk).title, 'Draft 2')
+
+    def test_pending_changes_of_a_deleted_task_are_dropped(self):
+        self.autosave({'title': 'Draft 2'})
+        self.assertEqual(self.client.delete(f'/task/{self.task.id}/').status_code, 200)
+        self.assertEqual(autosave.autosave_buffer.flush(), 0)
+        self.assertFalse(Task.objects.exists())
+
+    def test_bulk_updates_are_applied_over_pending_changes(self):
+        other = Task.objects.create(title='Other', user=self.user)
+        self.autosave({'title': 'Draft 2', 'description': 'Notes'})
+
+        response = self.client.post('/task/bulk-update/', {'patch': {'title': 'Renamed'}}, format='json')
+        self.assertEqual(response.data['data'], {'updated': 2})
+        self.assertEqual(autosave.autosave_buffer.flush(), 0)
+        task = Task.objects.get(pk=self.task.pk)
+        self.assertEqual((task.title, task.description, task.version), ('Renamed', 'Notes', 3))
+        self.assertEqual(Task.objects.get(pk=other.pk).title, 'Renamed')
+
+    def test_pending_changes_are_looked_up_in_chunks(self):
+        tasks = Task.objects.bulk_create(Task(title='Task', user=self.user) for _ in range(1100))
+        for task in (tasks[0], tasks[700]):
+            self.task = task
+            self.autosave({'title': f'Pending {task.pk}'})
+
+        with mock.patch.object(caches['shared'], 'get_many', wraps=caches['shared'].get_many) as get_many:
+            autosave.write_pending(task.pk for task in tasks)
+
+        self.assertEqual([len(call.args[0]) for call in get_many.call_args_list], [500, 500, 100])
+        self.assertEqual(Task.objects.filter(title__startswith='Pending').count(), 2)
+
+    def test_bulk_updates_skip_the_lookup_without_autosave(self):
+        with override_settings(AUTOSAVE={**AUTOSAVE, 'ENABLED': False}), \
+                mock.patch.object(autosave, 'write_pending') as write:
+            response = self.client.post('/task/bulk-update/', {'patch': {'title': 'Renamed'}}, format='json')
+        self.assertEqual(response.data['data'], {'updated': 1})
+        write.assert_not_called()
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ColumnarRendererTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(self.user)
+        due_date = datetime.datetime(2099, 1, 1, tzinfo=datetime.timezone.utc)
+        for i, task_status in enumerate((Task.PENDING, Task.COMPLETED, Task.PENDING, None)):
+            Task.objects.create(title=f'Task {i}', user=self.user, status=task_status or Task.IN_PROGRESS,
+                                due_date=due_date + datetime.timedelta(hours=i) if task_status else None)
+
+    @staticmethod
+    def decode(table):
+        columns = []
+        for name, column in zip(table['fields'], table['columns']):
+            if name in table['dictionaries']:
+                column = [None if value is None else table['dictionaries'][name][value] for value in column]
+            elif name in table['deltas']:
+                decoded, moment = [], 0
+                for value in column:
+                    if value is not None:
+                        moment += value
+                    decoded.append(None if value is None else datetime.datetime.fromtimestamp(
+                        moment / 1_000_000, datetime.timezone.utc
+                    ))
+                column = decoded
+            columns.append(column)
+        return [dict(zip(table['fields'], values)) for values in zip(*columns)]
+
+    def test_task_list_as_columns(self):
+        rows = self.client.get('/task/?page_size=100').json()['results']
+        for row in rows:
+            for name in ('due_date', 'created_at', 'updated_at'):
+                row[name] = row[name] and datetime.datetime.fromisoformat(row[name])
+        for response in (self.client.get('/task/?page_size=100&format=columnar'),
+                         self.client.get('/task/?page_size=100', HTTP_ACCEPT='application/vnd.todo.columnar+json')):
+            self.assertEqual(response['Content-Type'], 'application/vnd.todo.columnar+json')
+            table = response.json()['results']
+            self.assertEqual(table['dictionaries']['status'], [Task.PENDING, Task.COMPLETED, Task.IN_PROGRESS])
+            self.assertEqual(table['columns'][table['fields'].index('status')], [0, 1, 0, 2])
+            self.assertIn('due_date', table['deltas'])
+            # an hour between the due dates
+            self.assertEqual(table['columns'][table['fields'].index('due_date')][1:],
+                             [3600_000_000, 3600_000_000, None])
+
+            self.assertEqual(self.decode(table), rows)
+
+    def test_other_responses_stay_plain_json(self):
+        task = Task.objects.first()
+        response = self.client.get(f'/task/{task.id}/?format=columnar')
+        self.assertEqual(response.json()['data']['id'], task.id)
+        self.assertEqual(self.client.get('/task/?format=xml').status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class TaskQueryBudgetTests(QueryBudgetTestMixin, APITestCase):
+    sizes = (1, 100, 10000)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.task_data = {'title': 'Task', 'status': Task.PENDING, 'due_date': '2099-01-01T00:00:00Z'}
+
+    def grow_tasks(self, size):
+        count = Task.objects.count()
+        Task.objects.bulk_create(Task(title=f'Task {i}', user=self.user) for i in range(count, size))
+
+    def test_list(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_tasks(size)
+                self.assertWithinQueryBudget(TaskListAPIView, 'GET', '/task/')
+                self.assertWithinQueryBudget(TaskListAPIView, 'GET', '/task/?status=P&page_size=100')
+
+    def test_create(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_tasks(size)
+                self.assertWithinQueryBudget(TaskListAPIView, 'POST', '/task/', self.task_data)
+
+    def test_detail(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_tasks(size)
+                task = Task.objects.last()
+                self.assertWithinQueryBudget(TaskDetailAPIView, 'GET', f'/task/{task.id}/')
+                self.assertWithinQueryBudget(TaskDetailAPIView, 'PUT', f'/task/{task.id}/', self.task_data)
+                self.assertWithinQueryBudget(TaskDetailAPIView, 'PATCH', f'/task/{task.id}/', {'title': 'New'})
+
+    def test_board(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_tasks(size)
+                self.assertWithinQueryBudget(TaskBoardAPIView, 'GET', '/task/board/')
+
+    def test_calendar(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_tasks(size)
+                Task.objects.filter(due_date=None).update(
+                    due_date=datetime.datetime(2024, 10, 2, tzinfo=datetime.timezone.utc)
+                )
+                self.assertWithinQueryBudget(TaskCalendarAPIView, 'GET',
+                                             '/task/calendar/?from=2024-10-01&to=2024-10-31')
+
+    def test_delete_with_comments(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                task = Task.objects.create(title='Task', user=self.user)
+                Comment.objects.bulk_create(Comment(text=f'Comment {i}', task=task, user=self.user)
+                                            for i in range(size))
+                self.assertWithinQueryBudget(TaskDetailAPIView, 'DELETE', f'/task/{task.id}/')
+
+    def test_labels(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_tasks(size)
+                task = Task.objects.last()
+                task.set_labels(['work', 'urgent'])
+                self.assertWithinQueryBudget(TaskListAPIView, 'GET', '/task/?labels=work,urgent&match=all')
+                self.assertWithinQueryBudget(TaskListAPIView, 'POST', '/task/', {**self.task_data, 'labels': ['work']})
+                self.assertWithinQueryBudget(TaskDetailAPIView, 'PATCH', f'/task/{task.id}/', {'labels': ['home']})
+                self.assertWithinQueryBudget(LabelListAPIView, 'GET', '/task/labels/')
+
+    def test_tree(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                root = Task.objects.create(title='Root', user=self.user)
+                Task.objects.bulk_create(Task(title=f'Subtask {i}', user=self.user, parent=root, path=root.subtree_path)
+                                         for i in range(size))
+                self.assertWithinQueryBudget(TaskTreeAPIView, 'GET', f'/task/{root.id}/tree/')
+
+    def test_recurring(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_tasks(size)
+                task = Task.objects.create(title='Daily', user=self.user, recurrence=Task.DAILY,
+                                           due_date=datetime.datetime(2099, 1, 1, tzinfo=datetime.timezone.utc))
+                task.set_labels(['work'])
+                self.assertWithinQueryBudget(TaskListAPIView, 'GET', '/task/?year=2099&page_size=100')
+                self.assertWithinQueryBudget(TaskCalendarAPIView, 'GET',
+                                             '/task/calendar/?from=2099-01-01&to=2099-12-31')
+                path = f'/task/{task.id}/occurrences/2099-01-02T00:00:00Z/'
+                self.assertWithinQueryBudget(TaskOccurrenceAPIView, 'POST', path)
+                self.assertWithinQueryBudget(TaskOccurrenceAPIView, 'PATCH', path.replace('01-02', '01-03'),
+                                             {'status': Task.COMPLETED})
+
+    def test_dependencies(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.grow_tasks(max(size, 3))
+                tasks = list(Task.objects.order_by('-id')[:3])
+                for task, blocker in zip(tasks, tasks[1:]):
+                    task.add_blocker(blocker)
+                self.assertWithinQueryBudget(TaskActionableAPIView, 'GET', '/task/actionable/?limit=500')
+                self.assertWithinQueryBudget(TaskBlockerListAPIView, 'GET', f'/task/{tasks[0].id}/blockers/')
+                self.assertWithinQueryBudget(TaskBlockerListAPIView, 'POST', f'/task/{tasks[0].id}/blockers/',
+                                             {'blocker': tasks[2].id})
+                self.assertWithinQueryBudget(TaskDetailAPIView, 'DELETE', f'/task/{tasks[1].id}/')
+
+    def test_bulk_update(self):
+        label = Label.objects.create(user=self.user, name='work')
+        root = Task.objects.create(title='Root', user=self.user)
+        # never the status of new tasks, so every labelled task is changed
+        statuses = (Task.COMPLETED, Task.IN_PROGRESS, Task.COMPLETED)
+        for size, status in zip(self.sizes, statuses):
+            with self.subTest(size=size):
+                self.grow_tasks(size + 1)
+                # every other new task is a labelled subtask of the root, its completed count is rolled up
+                labelled = list(Task.objects.filter(parent=None).exclude(pk=root.pk).order_by('id')
+                                .values_list('id', flat=True))[::2]
+                Task.labels.through.objects.bulk_create(
+                    Task.labels.through(task_id=pk, label_id=label.id) for pk in labelled
+                )
+                Task.objects.filter(pk__in=labelled).update(parent=root, path=root.subtree_path)
+                Task.objects.filter(pk=root.pk).update(subtask_count=F('subtask_count') + len(labelled))
+                response = self.assertWithinQueryBudget(TaskBulkUpdateAPIView, 'POST', '/task/bulk-update/',
+                                                        {'filter': {'labels': ['work']}, 'patch': {'status': status}})
+                self.assertEqual(response.data['data']['updated'], Task.objects.filter(labels=label).count())
+                self.assertGreater(response.data['data']['updated'], 0)
+                root.refresh_from_db()
+                completed = Task.objects.filter(parent=root, status=Task.COMPLETED).count()
+                self.assertEqual(root.completed_subtask_count, completed)
@@ -1,8 +1,26 @@
 from django.urls import path
 
-from .views import TaskListAPIView, TaskDetailAPIView
+from .views import TaskListAPIView, TaskDetailAPIView, TaskBoardAPIView, TaskCalendarAPIView, TaskImportAPIView, \
+    TaskHistoryAPIView, LabelListAPIView, TaskTreeAPIView, TaskCollaboratorListAPIView, TaskCollaboratorDetailAPIView, \
+    TaskOccurrenceAPIView, TaskActionableAPIView, TaskBlockerListAPIView, TaskBlockerDetailAPIView, \
+    TaskBulkUpdateAPIView, TaskAutosaveStatsAPIView
 
 urlpatterns = [
     path('', TaskListAPIView.as_view(), name='task-list'),
+    path('board/', TaskBoardAPIView.as_view(), name='task-board'),
+    path('calendar/', TaskCalendarAPIView.as_view(), name='task-calendar'),
+    path('labels/', LabelListAPIView.as_view(), name='label-list'),
+    path('actionable/', TaskActionableAPIView.as_view(), name='task-actionable'),
+    path('import/', TaskImportAPIView.as_view(), name='task-import'),
+    path('bulk-update/', TaskBulkUpdateAPIView.as_view(), name='task-bulk-update'),
+    path('autosave/', TaskAutosaveStatsAPIView.as_view(), name='task-autosave'),
     path('<int:pk>/', TaskDetailAPIView.as_view(), name='task-detail'),
-]
\ No newline at end of file
+    path('<int:pk>/history/', TaskHistoryAPIView.as_view(), name='task-history'),
+    path('<int:pk>/tree/', TaskTreeAPIView.as_view(), name='task-tree'),
+    path('<int:pk>/collaborators/', TaskCollaboratorListAPIView.as_view(), name='task-collaborator-list'),
+    path('<int:pk>/collaborators/<int:user_id>/', TaskCollaboratorDetailAPIView.as_view(),
+         name='task-collaborator-detail'),
+    path('<int:pk>/blockers/', TaskBlockerListAPIView.as_view(), name='task-blocker-list'),
+    path('<int:pk>/blockers/<int:blocker_id>/', TaskBlockerDetailAPIView.as_view(), name='task-blocker-detail'),
+    path('<int:pk>/occurrences/<str:due_date>/', TaskOccurrenceAPIView.as_view(), name='task-occurrence'),
+]
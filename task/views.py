@@ -1,20 +1,45 @@
+import base64
+import binascii
+import datetime
+import zoneinfo
+
+from django.db import router, transaction
+from django.db.models import Count, F, prefetch_related_objects, Window
+from django.db.models.functions import RowNumber, TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiParameter, OpenApiResponse
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Task
-from .serializers import TaskSerializer
+from . import autosave, history
+from .importers import import_tasks, guess_format, IMPORT_FORMATS
+from .models import Collaborator, Dependency, expand_occurrences, Label, Task, TaskHistory
+from .serializers import BlockerSerializer, CollaboratorSerializer, LabelSerializer, TaskSerializer, \
+    TaskHistorySerializer, TaskPatchSerializer
 
 from rest_framework import status
 
+from todo_proweb.concurrency import get_expected_version, VersionConflict, IF_MATCH_PARAMETER
+from todo_proweb.idempotency import idempotent, IDEMPOTENCY_KEY_PARAMETER
+from todo_proweb.sharding import get_shard
+
 
 class TaskListAPIView(APIView):
+    # the labels of the page are prefetched, setting labels on a new task takes four more queries.
+    # Filtering by due date looks up the recurring tasks and their saved occurrences in the period
+    query_budget = {'GET': 5, 'POST': 6}
 
     @extend_schema(
         tags=['Tasks'],
         summary="Retrieve a list of tasks",
-        description="This endpoint retrieves tasks filtered by status, due date, or specific year, month, and day.",
+        description="This endpoint retrieves tasks filtered by status, due date, or specific year, month, and day. "
+                    "With a due date filter recurring tasks are listed as their occurrences in that period, "
+                    "occurrences that were not changed yet have no `id` but their `recurrence_of` and "
+                    "`original_due_date`.",
         parameters=[
             OpenApiParameter(name='status', description="Filter by task status ('P', 'IP', 'C')", required=False,
                              type=str, examples=[
@@ -25,6 +50,17 @@ class TaskListAPIView(APIView):
             OpenApiParameter(name='year', description="Filter by year of due date", required=False, type=int),
             OpenApiParameter(name='month', description="Filter by month of due date", required=False, type=int),
             OpenApiParameter(name='day', description="Filter by day of due date", required=False, type=int),
+            OpenApiParameter(name='due_after', description="Filter by due date at or after this ISO 8601 time",
+                             required=False, type=str),
+            OpenApiParameter(name='due_before', description="Filter by due date before this ISO 8601 time",
+                             required=False, type=str),
+            OpenApiParameter(name='ordering', description="'activity' to show the most recently commented tasks first",
+                             required=False, type=str, enum=['activity']),
+            OpenApiParameter(name='labels', description="Comma separated label names to filter by", required=False,
+                             type=str, examples=[OpenApiExample('Labels', value='work,urgent')]),
+            OpenApiParameter(name='match', description="'any' (default) to show tasks with any of the labels, 'all' "
+                                                       "to show tasks with all of them",
+                             required=False, type=str, enum=['any', 'all']),
             OpenApiParameter(name='page', description="Page number", required=False, type=int),
             OpenApiParameter(name='page_size', description="Number of items per page", required=False, type=int)
         ],
@@ -97,41 +133,37 @@ class TaskListAPIView(APIView):
     )
     def get(self, request):  # noqa
         try:
-            tasks = Task.objects.filter(user=request.user)
+            tasks = Task.objects.visible_to(request.user).prefetch_related('labels')
+
+            try:
+                tasks, due_date_filters, window = filter_tasks(tasks, request.user, request.query_params)
+            except ValueError as e:
+                return Response({"msg": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            status_filter = request.query_params.get('status', None)
-            if status_filter:
-                if status_filter not in ['P', 'IP', 'C']:
-                    return Response({"msg": "Invalid status filter"}, status=status.HTTP_400_BAD_REQUEST)
-                tasks = tasks.filter(status=status_filter)
-
-            year = request.query_params.get('year', None)
-            month = request.query_params.get('month', None)
-            day = request.query_params.get('day', None)
-
-            if year:
-                try:
-                    tasks = tasks.filter(due_date__year=int(year))
-                except ValueError:
-                    return Response({"msg": "Invalid year format"}, status=status.HTTP_400_BAD_REQUEST)
-
-            if month:
-                if not year:
-                    return Response({"msg": "Year is required when filtering by month"},
-                                    status=status.HTTP_400_BAD_REQUEST)
-                try:
-                    tasks = tasks.filter(due_date__month=int(month))
-                except ValueError:
-                    return Response({"msg": "Invalid month format"}, status=status.HTTP_400_BAD_REQUEST)
-
-            if day:
-                if not year and not month:
-                    return Response({"msg": "Year and month are required when filtering by day"},
-                                    status=status.HTTP_400_BAD_REQUEST)
-                try:
-                    tasks = tasks.filter(due_date__day=int(day))
-                except ValueError:
-                    return Response({"msg": "Invalid day format"}, status=status.HTTP_400_BAD_REQUEST)
+            ordering = request.query_params.get('ordering', None)
+            if ordering and ordering != 'activity':
+                return Response({"msg": "Invalid ordering"}, status=status.HTTP_400_BAD_REQUEST)
+
+            # recurring tasks are listed as their occurrences when filtering by due date
+            series = list(tasks.recurring(*window).prefetch_related(None)) if window is not None else []
+            tasks = tasks.filter(**due_date_filters)
+            if ordering:
+                # matches task_user_activity_idx
+                tasks = tasks.order_by(F('last_commented_at').desc(nulls_last=True), '-id')
+
+            if series:
+                # the tasks due in the window are loaded to merge the occurrences in, which only exist in memory
+                tasks = list(tasks.filter(recurrence=Task.NO_RECURRENCE).prefetch_related(None))
+                prefetch_related_objects(tasks + series, 'labels')
+                occurrences = expand_occurrences(series, *window)
+                day = due_date_filters.get('due_date__day')
+                if day and 'due_date__month' not in due_date_filters:
+                    occurrences = [task for task in occurrences if timezone.localtime(task.due_date).day == day]
+                if ordering:
+                    # occurrences have no comments yet
+                    tasks += occurrences
+                else:
+                    tasks = sorted(tasks + occurrences, key=lambda task: (task.due_date, task.pk or 0))
 
             paginator = PageNumberPagination()
             page_size = request.query_params.get('page_size', paginator.page_size)
@@ -139,6 +171,7 @@ class TaskListAPIView(APIView):
             page = paginator.paginate_queryset(tasks, request)
 
             if page is not None:
+                autosave.apply_pending(page)
                 serializer = TaskSerializer(page, many=True)
                 return paginator.get_paginated_response(serializer.data)
 
@@ -146,7 +179,7 @@ class TaskListAPIView(APIView):
 
             data = {
                 "status": "success",
-                "length": tasks.count(),
+                "length": len(tasks) if isinstance(tasks, list) else tasks.count(),
                 "data": serializer.data
             }
 
@@ -157,11 +190,25 @@ class TaskListAPIView(APIView):
         except Exception as e:
             return Response({"status": "error", "msg": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @staticmethod
+    def get_due_date_window(year, month=None, day=None):
+        """Start and end of the year, month or day of the due date filters, in the current timezone."""
+        tz = timezone.get_current_timezone()
+        start = datetime.datetime(year, month or 1, day or 1, tzinfo=tz)
+        if day:
+            end = start + datetime.timedelta(days=1)
+        elif month:
+            end = datetime.datetime(year + month // 12, month % 12 + 1, 1, tzinfo=tz)
+        else:
+            end = datetime.datetime(year + 1, 1, 1, tzinfo=tz)
+        return start, end
+
     @extend_schema(
         tags=['Tasks'],
         summary="Create a new task",
         description="This endpoint allows you to create a new task. ",
         request=TaskSerializer,
+        parameters=[IDEMPOTENCY_KEY_PARAMETER],
         responses={
             201: OpenApiResponse(
                 response=TaskSerializer,
@@ -212,6 +259,7 @@ class TaskListAPIView(APIView):
             )
         }
     )
+    @idempotent
     def post(self, request):  # noqa
         data = request.data
         serializer = TaskSerializer(data=data, context={'request': request})
@@ -227,7 +275,81 @@ class TaskListAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def filter_tasks(tasks, user, params):
+    """
+    Applies the filters of the task list in ``params`` to ``tasks`` of ``user``: ``status``, the ``year``,
+    ``month`` and ``day`` of the due date, ``due_after`` and ``due_before`` and ``labels`` with ``match``.
+    Returns the filtered tasks, the due date filters of the year, month and day, which are not applied
+    yet, and the start and end of that period or ``None``. Raises ``ValueError`` for an invalid filter.
+    """
+    status_filter = params.get('status', None)
+    if status_filter:
+        if status_filter not in ['P', 'IP', 'C']:
+            raise ValueError('Invalid status filter')
+        tasks = tasks.filter(status=status_filter)
+
+    year = params.get('year', None)
+    month = params.get('month', None)
+    day = params.get('day', None)
+    due_date_filters = {}
+
+    if year:
+        try:
+            due_date_filters['due_date__year'] = int(year)
+        except ValueError:
+            raise ValueError('Invalid year format') from None
+
+    if month:
+        if not year:
+            raise ValueError('Year is required when filtering by month')
+        try:
+            due_date_filters['due_date__month'] = int(month)
+        except ValueError:
+            raise ValueError('Invalid month format') from None
+
+    if day:
+        if not year and not month:
+            raise ValueError('Year and month are required when filtering by day')
+        try:
+            due_date_filters['due_date__day'] = int(day)
+        except ValueError:
+            raise ValueError('Invalid day format') from None
+
+    window = None
+    if year:
+        try:
+            window = TaskListAPIView.get_due_date_window(int(year), int(month) if month else None,
+                                                         int(day) if month and day else None)
+        except ValueError:
+            raise ValueError('Invalid date format') from None
+
+    for name, lookup in (('due_after', 'due_date__gte'), ('due_before', 'due_date__lt')):
+        value = params.get(name, None)
+        if value:
+            try:
+                value = parse_datetime(str(value))
+            except ValueError:
+                value = None
+            if value is None:
+                raise ValueError(f'Invalid {name} format')
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            tasks = tasks.filter(**{lookup: value})
+
+    labels = [name.strip() for name in params.get('labels', '').split(',') if name.strip()]
+    match = params.get('match', 'any')
+    if match not in ('any', 'all'):
+        raise ValueError("Invalid match, choose 'any' or 'all'")
+    if labels:
+        tasks = tasks.with_labels(user, labels, match)
+    return tasks, due_date_filters, window
+
+
 class TaskDetailAPIView(APIView):
+    # PUT and PATCH take up to eight more queries than their UPDATE when they also complete, move and label a task.
+    # DELETE loads the subtree, deletes its collaborators, labels, dependencies, comments and tasks and updates the
+    # counters of the ancestors
+    query_budget = {'GET': 3, 'PUT': 10, 'PATCH': 10, 'DELETE': 9}
 
     @extend_schema(
         tags=['Tasks'],
@@ -268,13 +390,14 @@ class TaskDetailAPIView(APIView):
     )
     def get(self, request, pk):  # noqa
         try:
-            task = Task.objects.get(id=pk, user=request.user)
+            task = Task.objects.visible_to(request.user).prefetch_related('labels').get(id=pk)
+            autosave.apply_pending([task])
             serializer = TaskSerializer(task)
             data = {
                 "status": "success",
                 "data": serializer.data
             }
-            return Response(data)
+            return Response(data, headers={'ETag': f'"{task.version}"'})
         except Task.DoesNotExist:
             return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -283,6 +406,7 @@ class TaskDetailAPIView(APIView):
         summary="Update a task by ID",
         description="This endpoint allows you to update a task by its ID.",
         request=TaskSerializer,
+        parameters=[IF_MATCH_PARAMETER],
         responses={
             200: OpenApiResponse(
                 response=TaskSerializer,
@@ -330,31 +454,31 @@ class TaskDetailAPIView(APIView):
                         value={"status": "error", "msg": "Task not found"}
                     )
                 ]
+            ),
+            409: OpenApiResponse(
+                description='Task was changed by another request, or its autosaves are being written',
+                examples=[
+                    OpenApiExample(
+                        'Version Conflict',
+                        value={"status": "error", "msg": "Task was modified by another request"}
+                    ),
+                    OpenApiExample(
+                        'Autosave Locked',
+                        value={"status": "error", "msg": "Task is being saved by another request"}
+                    )
+                ]
             )
         }
     )
     def put(self, request, pk):
-        try:
-            task = Task.objects.get(id=pk, user=request.user)
-        except Task.DoesNotExist:
-            return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        serializer = TaskSerializer(task, data=request.data, context={'request': request})
-        if serializer.is_valid():
-            serializer.save()
-            data = {
-                "status": "success",
-                "msg": "Task updated successfully",
-                "data": serializer.data
-            }
-            return Response(data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return self._update(request, pk, partial=False)
 
     @extend_schema(
         tags=['Tasks'],
         summary="Update a task by ID",
         description="This endpoint allows you to update a task by its ID.",
         request=TaskSerializer,
+        parameters=[IF_MATCH_PARAMETER, autosave.AUTOSAVE_PARAMETER],
         responses={
             200: OpenApiResponse(
                 response=TaskSerializer,
@@ -378,6 +502,28 @@ class TaskDetailAPIView(APIView):
                     )
                 ]
             ),
+            202: OpenApiResponse(
+                response=TaskSerializer,
+                description='Autosaved title and description, written to the database within seconds',
+                examples=[
+                    OpenApiExample(
+                        'Queued',
+                        value={
+                            "status": "success",
+                            "msg": "Task update queued",
+                            "data": {
+                                "id": 1,
+                                "title": "Updated Task",
+                                "description": "Updated description",
+                                "status": "IP",
+                                "due_date": "2024-10-25T12:00:00Z",
+                                "created_at": "2024-10-20T09:00:00Z",
+                                "updated_at": "2024-10-23T10:00:00Z"
+                            }
+                        }
+                    )
+                ]
+            ),
             400: OpenApiResponse(
                 description='Bad request, invalid input',
                 examples=[
@@ -402,30 +548,110 @@ class TaskDetailAPIView(APIView):
                         value={"status": "error", "msg": "Task not found"}
                     )
                 ]
+            ),
+            409: OpenApiResponse(
+                description='Task was changed by another request, or its autosaves are being written',
+                examples=[
+                    OpenApiExample(
+                        'Version Conflict',
+                        value={"status": "error", "msg": "Task was modified by another request"}
+                    ),
+                    OpenApiExample(
+                        'Autosave Locked',
+                        value={"status": "error", "msg": "Task is being saved by another request"}
+                    )
+                ]
             )
         }
     )
     def patch(self, request, pk):
+        return self._update(request, pk, partial=True)
+
+    def _update(self, request, pk, partial):  # noqa
+        serializer = TaskSerializer(data=request.data, partial=partial, context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        changes = dict(serializer.validated_data)
+        try:
+            if autosave.accepts(request, changes):
+                return self._autosave(request, pk, changes)
+        except autosave.Locked:
+            return Response({"status": "error", "msg": "Task is being saved by another request"},
+                            status=status.HTTP_409_CONFLICT)
+        labels = changes.pop('labels', None)
+        moved = 'parent' in changes
+        parent = changes.pop('parent', None)
+        if moved and parent is not None and parent.is_within(pk):
+            return Response({"status": "error", "msg": "A task cannot be moved below itself"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if moved:
+            # only the owner can move a task between their tasks
+            tasks = Task.objects.filter(user=request.user)
+        else:
+            tasks = Task.objects.visible_to(request.user, Collaborator.EDITOR)
+        # pending autosaves of the task come first, once the user is known to be allowed to change it
+        if autosave.is_enabled() and autosave.has_pending(pk) and tasks.filter(id=pk).exists():
+            try:
+                autosave.write(pk)
+            except autosave.Locked:
+                return Response({"status": "error", "msg": "Task is being saved by another request"},
+                                status=status.HTTP_409_CONFLICT)
         try:
-            task = Task.objects.get(id=pk, user=request.user)
+            with transaction.atomic(using=router.db_for_write(Task)):
+                task = tasks.filter(id=pk).versioned_update(
+                    get_expected_version(request), with_previous=True, **changes
+                )
+                completed = task.status == Task.COMPLETED
+                was_completed = task.previous['status'] == Task.COMPLETED
+                if completed != was_completed:
+                    Task.objects.using(task._state.db).roll_up(
+                        dict.fromkeys(task.ancestor_ids, (0, completed - was_completed))
+                    )
+                if moved and task.parent_id != (parent.pk if parent is not None else None):
+                    task.move_to(parent)
+                    changes['parent_id'] = task.parent_id
         except Task.DoesNotExist:
             return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+        except VersionConflict:
+            return Response({"status": "error", "msg": "Task was modified by another request"},
+                            status=status.HTTP_409_CONFLICT)
 
-        serializer = TaskSerializer(task, data=request.data, partial=True, context={'request': request})
-        if serializer.is_valid():
-            serializer.save()
-            data = {
-                "status": "success",
-                "msg": "Task updated successfully",
-                "data": serializer.data
-            }
-            return Response(data)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if labels is not None:
+            task.set_labels(labels)
+
+        changes = history.diff(task.previous, changes)
+        if changes:
+            history.record(task.id, request.user.id, TaskHistory.UPDATED, changes, using=task._state.db)
+
+        data = {
+            "status": "success",
+            "msg": "Task updated successfully",
+            "data": TaskSerializer(task).data
+        }
+        return Response(data, status=status.HTTP_200_OK, headers={'ETag': f'"{task.version}"'})
+
+    @staticmethod
+    def _autosave(request, pk, changes):
+        try:
+            task = Task.objects.visible_to(request.user, Collaborator.EDITOR).prefetch_related('labels').get(id=pk)
+        except Task.DoesNotExist:
+            return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+        for name, value in autosave.autosave_buffer.add(task, request.user.id, changes).items():
+            setattr(task, name, value)
+        data = {
+            "status": "success",
+            "msg": "Task update queued",
+            "data": TaskSerializer(task).data
+        }
+        # no ETag, the version changes once the update is written
+        return Response(data, status=status.HTTP_202_ACCEPTED)
 
     @extend_schema(
         tags=['Tasks'],
         summary="Delete a task by ID",
-        description="This endpoint allows you to delete a task by its ID.",
+        description="This endpoint allows you to delete a task by its ID, together with its subtasks.",
         responses={
             200: OpenApiResponse(
                 description='Task deleted successfully',
@@ -444,6 +670,15 @@ class TaskDetailAPIView(APIView):
                         value={"status": "error", "msg": "Task not found"}
                     )
                 ]
+            ),
+            409: OpenApiResponse(
+                description='Autosaves of the task are being written',
+                examples=[
+                    OpenApiExample(
+                        'Autosave Locked',
+                        value={"status": "error", "msg": "Task is being saved by another request"}
+                    )
+                ]
             )
         }
     )
@@ -454,9 +689,1135 @@ class TaskDetailAPIView(APIView):
             return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({"status": "error", "msg": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        task.delete()
+        if autosave.is_enabled():
+            try:
+                autosave.discard(pk)
+            except autosave.Locked:
+                return Response({"status": "error", "msg": "Task is being saved by another request"},
+                                status=status.HTTP_409_CONFLICT)
+        subtasks, completed = task.roll_up_counts()
+        with transaction.atomic(using=task._state.db):
+            # the whole subtree in one query, instead of cascading level by level
+            Task.objects.using(task._state.db).delete_subtree(task)
+            Task.objects.using(task._state.db).roll_up(dict.fromkeys(task.ancestor_ids, (-subtasks, -completed)))
+        history.record(pk, request.user.id, TaskHistory.DELETED,
+                       history.snapshot(task, history.TASK_FIELDS, deleted=True), using=task._state.db)
         data = {
             "status": "success",
             "msg": "Task deleted successfully"
         }
         return Response(data, status=status.HTTP_200_OK)
+
+
+class TaskBoardAPIView(APIView):
+    query_budget = {'GET': 3}
+    default_limit = 10
+    max_limit = 100
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Retrieve the task board",
+        description="This endpoint returns the newest tasks of every status column together with the number of tasks "
+                    "in the column, in one query. Pass `status` and the column's `next` cursor to load more tasks "
+                    "of that column.",
+        parameters=[
+            OpenApiParameter(name='limit', description="Number of tasks per column (max 100)", required=False,
+                             type=int),
+            OpenApiParameter(name='status', description="Column to load more tasks of ('P', 'IP', 'C')",
+                             required=False, type=str),
+            OpenApiParameter(name='cursor', description="`next` cursor of the column", required=False, type=str)
+        ],
+        responses={
+            200: OpenApiResponse(
+                response=TaskSerializer(many=True),
+                description='Tasks of every column. `count` is the number of tasks in the column from the cursor on.',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "data": {
+                                "P": {
+                                    "count": 12,
+                                    "next": "MTc",
+                                    "results": [
+                                        {
+                                            "id": 20,
+                                            "title": "Task 20",
+                                            "description": "Task 20 description",
+                                            "status": "P",
+                                            "due_date": "2024-10-23T12:00:00Z",
+                                            "created_at": "2024-10-20T09:00:00Z",
+                                            "updated_at": "2024-10-21T10:00:00Z"
+                                        }
+                                    ]
+                                },
+                                "IP": {"count": 0, "next": None, "results": []},
+                                "C": {"count": 0, "next": None, "results": []}
+                            }
+                        }
+                    )
+                ]
+            ),
+            400: OpenApiResponse(
+                description='Bad request, invalid input',
+                examples=[
+                    OpenApiExample(
+                        'Invalid Cursor',
+                        value={"msg": "Invalid cursor"}
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            return Response({"msg": "Invalid limit format"}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"msg": "Invalid limit format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        tasks = Task.objects.visible_to(request.user)
+        columns = [value for value, _ in Task.STATUS_CHOICES]
+
+        status_filter = request.query_params.get('status', None)
+        cursor = request.query_params.get('cursor', None)
+        if status_filter:
+            if status_filter not in columns:
+                return Response({"msg": "Invalid status filter"}, status=status.HTTP_400_BAD_REQUEST)
+            columns = [status_filter]
+            tasks = tasks.filter(status=status_filter)
+        if cursor:
+            if not status_filter:
+                return Response({"msg": "Status is required when passing a cursor"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            try:
+                tasks = tasks.filter(id__lt=self.decode_cursor(cursor))
+            except ValueError:
+                return Response({"msg": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+        tasks = tasks.annotate(
+            row_number=Window(RowNumber(), partition_by=F('status'), order_by=F('id').desc()),
+            column_count=Window(Count('id'), partition_by=F('status')),
+        ).filter(row_number__lte=limit).order_by('status', 'row_number').prefetch_related('labels')
+
+        tasks = list(tasks)
+        autosave.apply_pending(tasks)
+        board = {column: {"count": 0, "next": None, "results": []} for column in columns}
+        for task in tasks:
+            board[task.status]["count"] = task.column_count
+            board[task.status]["results"].append(task)
+
+        for column in board.values():
+            if column["count"] > len(column["results"]):
+                column["next"] = self.encode_cursor(column["results"][-1].id)
+            column["results"] = TaskSerializer(column["results"], many=True).data
+
+        return Response({"status": "success", "data": board}, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def encode_cursor(task_id):
+        return base64.urlsafe_b64encode(str(task_id).encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+        except (binascii.Error, UnicodeDecodeError) as e:
+            raise ValueError(str(e))
+
+
+class TaskCalendarAPIView(APIView):
+    # the recurring tasks and their saved occurrences in the range take one query each
+    query_budget = {'GET': 5}
+    default_per_day = 5
+    max_per_day = 50
+    max_days = 366
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Retrieve tasks grouped by day",
+        description="This endpoint returns the tasks due between two dates, grouped into days of the given timezone. "
+                    "Every day has the number of its tasks and at most `per_day` of them, ordered by due date. "
+                    "Recurring tasks are shown as their occurrences on those days.",
+        parameters=[
+            OpenApiParameter(name='from', description="First day, YYYY-MM-DD", required=True, type=str),
+            OpenApiParameter(name='to', description="Last day (inclusive), YYYY-MM-DD", required=True, type=str),
+            OpenApiParameter(name='tz', description="IANA timezone of the days, defaults to UTC", required=False,
+                             type=str, examples=[OpenApiExample('Tashkent', value='Asia/Tashkent')]),
+            OpenApiParameter(name='per_day', description="Maximum number of tasks per day (1 to 50)", required=False,
+                             type=int)
+        ],
+        responses={
+            200: OpenApiResponse(
+                response=TaskSerializer(many=True),
+                description='Days that have tasks, in order.',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "data": [
+                                {
+                                    "date": "2024-10-23",
+                                    "count": 7,
+                                    "results": [
+                                        {
+                                            "id": 1,
+                                            "title": "Task 1",
+                                            "description": "Task 1 description",
+                                            "status": "P",
+                                            "due_date": "2024-10-23T12:00:00+05:00",
+                                            "created_at": "2024-10-20T09:00:00+05:00",
+                                            "updated_at": "2024-10-21T10:00:00+05:00"
+                                        }
+                                    ]
+                                }
+                            ]
+                        }
+                    )
+                ]
+            ),
+            400: OpenApiResponse(
+                description='Bad request, invalid input',
+                examples=[
+                    OpenApiExample(
+                        'Invalid Date',
+                        value={"msg": "Invalid date format, use YYYY-MM-DD"}
+                    ),
+                    OpenApiExample(
+                        'Invalid Timezone',
+                        value={"msg": "Invalid timezone"}
+                    ),
+                    OpenApiExample(
+                        'Invalid Tasks Per Day',
+                        value={"msg": "per_day must be at least 1"}
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request):
+        try:
+            date_from = datetime.date.fromisoformat(request.query_params.get('from', ''))
+            date_to = datetime.date.fromisoformat(request.query_params.get('to', ''))
+        except ValueError:
+            return Response({"msg": "Invalid date format, use YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        if date_to < date_from:
+            return Response({"msg": "'to' must not be before 'from'"}, status=status.HTTP_400_BAD_REQUEST)
+        if (date_to - date_from).days >= self.max_days:
+            return Response({"msg": f"The range cannot be longer than {self.max_days} days"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            tz = zoneinfo.ZoneInfo(request.query_params.get('tz', 'UTC'))
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            return Response({"msg": "Invalid timezone"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            per_day = int(request.query_params.get('per_day', self.default_per_day))
+        except ValueError:
+            return Response({"msg": "Invalid per_day format"}, status=status.HTTP_400_BAD_REQUEST)
+        if per_day < 1:
+            return Response({"msg": "per_day must be at least 1"}, status=status.HTTP_400_BAD_REQUEST)
+        per_day = min(per_day, self.max_per_day)
+
+        start = datetime.datetime.combine(date_from, datetime.time.min, tzinfo=tz)
+        end = datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min, tzinfo=tz)
+        day = TruncDate('due_date', tzinfo=tz)
+
+        tasks = list(Task.objects.visible_to(request.user).filter(
+            recurrence=Task.NO_RECURRENCE, due_date__gte=start, due_date__lt=end
+        ).annotate(
+            day=day,
+            row_number=Window(RowNumber(), partition_by=day, order_by=[F('due_date').asc(), F('id').asc()]),
+            day_count=Window(Count('id'), partition_by=day),
+        ).filter(row_number__lte=per_day).order_by('due_date', 'id'))
+        series = list(Task.objects.visible_to(request.user).recurring(start, end))
+        prefetch_related_objects(tasks + series, 'labels')
+        # occurrences are expanded from their series with its pending changes
+        autosave.apply_pending(tasks + series)
+
+        days = {}
+        for task in tasks:
+            bucket = days.setdefault(task.day, {"date": task.day.isoformat(), "count": task.day_count, "results": []})
+            bucket["results"].append(task)
+        if series:
+            for occurrence in expand_occurrences(series, start, end):
+                date = occurrence.due_date.astimezone(tz).date()
+                bucket = days.setdefault(date, {"date": date.isoformat(), "count": 0, "results": []})
+                bucket["count"] += 1
+                bucket["results"].append(occurrence)
+            days = dict(sorted(days.items()))
+            for bucket in days.values():
+                bucket["results"] = sorted(bucket["results"], key=lambda task: (task.due_date, task.pk or 0))[:per_day]
+
+        with timezone.override(tz):
+            for bucket in days.values():
+                bucket["results"] = TaskSerializer(bucket["results"], many=True).data
+
+        return Response({"status": "success", "data": list(days.values())}, status=status.HTTP_200_OK)
+
+
+class TaskImportAPIView(APIView):
+    parser_classes = [MultiPartParser]
+    # rows are inserted in equally sized chunks
+    allow_repeated_queries = True
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Import tasks from a file",
+        description="This endpoint imports tasks from an uploaded CSV (with a header row) or NDJSON file. The file is "
+                    "streamed, rows are validated like `POST /task/` and inserted in chunks. Rows can set `title`, "
+                    "`description`, `status`, `due_date` and the `recurrence`, `recurrence_interval` and "
+                    "`recurrence_until` of a recurring task, a row that sets another field of a task is invalid. "
+                    "Invalid rows are skipped and the first 100 of them are reported.",
+        request={
+            'multipart/form-data': {
+                'type': 'object',
+                'properties': {
+                    'file': {'type': 'string', 'format': 'binary'},
+                    'type': {'type': 'string', 'enum': list(IMPORT_FORMATS)}
+                },
+                'required': ['file']
+            }
+        },
+        responses={
+            200: OpenApiResponse(
+                description='Import finished',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "data": {
+                                "created": 99998,
+                                "failed": 2,
+                                "errors": [
+                                    {"row": 17, "errors": {"title": ["This field is required."]}},
+                                    {"row": 503, "errors": {"due_date": ["Due date cannot be in the past."]}}
+                                ]
+                            }
+                        }
+                    )
+                ]
+            ),
+            400: OpenApiResponse(
+                description='Bad request, invalid input',
+                examples=[
+                    OpenApiExample(
+                        'Missing File',
+                        value={"msg": "A file is required"}
+                    ),
+                    OpenApiExample(
+                        'Unknown Format',
+                        value={"msg": "Unknown file type, pass type=csv or type=ndjson"}
+                    )
+                ]
+            )
+        }
+    )
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"msg": "A file is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get('type') or guess_format(upload.name)
+        if file_format not in IMPORT_FORMATS:
+            return Response({"msg": "Unknown file type, pass type=csv or type=ndjson"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        result = import_tasks(upload, request.user, file_format)
+        return Response({"status": "success", "data": result}, status=status.HTTP_200_OK)
+
+
+class TaskBulkUpdateAPIView(APIView):
+    # a changed status counts the subtasks that become or stop being completed and updates their ancestors,
+    # the history of the changed tasks is written by one INSERT ... SELECT before the UPDATE
+    query_budget = {'POST': 5}
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Update every task matching a filter",
+        description="This endpoint applies a `patch` to every task you can edit that matches `filter`, which takes "
+                    "the filters of `GET /task/` as strings, in one UPDATE. Tasks that already have the values are "
+                    "left alone and not counted. Instead of a `due_date` the patch can move the due dates by a "
+                    "`due_date_shift`. Recurring tasks are matched by their first due date, their occurrences "
+                    "are not saved. Pending autosaves of the tasks are written before a patch of their title or "
+                    "description. Every changed task gets the change in its history.",
+        request={
+            'application/json': {
+                'type': 'object',
+                'properties': {
+                    'filter': {'type': 'object', 'additionalProperties': {'type': 'string'}},
+                    'patch': {
+                        'type': 'object',
+                        'properties': {
+                            'title': {'type': 'string'},
+                            'description': {'type': 'string', 'nullable': True},
+                            'status': {'type': 'string', 'enum': [choice for choice, _ in Task.STATUS_CHOICES]},
+                            'due_date': {'type': 'string', 'format': 'date-time', 'nullable': True},
+                            'due_date_shift': {'type': 'string', 'format': 'duration'}
+                        }
+                    }
+                },
+                'required': ['patch']
+            }
+        },
+        parameters=[IDEMPOTENCY_KEY_PARAMETER],
+        examples=[
+            OpenApiExample(
+                'Complete Overdue',
+                value={"filter": {"due_before": "2024-10-23T00:00:00Z"}, "patch": {"status": "C"}},
+                request_only=True
+            ),
+            OpenApiExample(
+                'Postpone A Week',
+                value={"filter": {"due_after": "2024-10-21T00:00:00Z", "due_before": "2024-10-28T00:00:00Z"},
+                       "patch": {"due_date_shift": "P7D"}},
+                request_only=True
+            )
+        ],
+        responses={
+            200: OpenApiResponse(
+                description='Tasks updated',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={"status": "success", "msg": "Tasks updated successfully", "data": {"updated": 1250}}
+                    )
+                ]
+            ),
+            400: OpenApiResponse(
+                description='Bad request, invalid input',
+                examples=[
+                    OpenApiExample(
+                        'Invalid Filter',
+                        value={"msg": "Invalid status filter"}
+                    ),
+                    OpenApiExample(
+                        'Invalid Patch',
+                        value={"patch": {"labels": ["This field cannot be changed in bulk."]}}
+                    )
+                ]
+            ),
+            409: OpenApiResponse(
+                description='Autosaves of a matching task are being written',
+                examples=[
+                    OpenApiExample(
+                        'Autosave Locked',
+                        value={"status": "error", "msg": "Tasks are being saved by another request"}
+                    )
+                ]
+            )
+        }
+    )
+    @idempotent
+    def post(self, request):
+        body = request.data if hasattr(request.data, 'get') else {}
+        filters = body.get('filter') or {}
+        if not isinstance(filters, dict):
+            return Response({"msg": "The filter has to be an object"}, status=status.HTTP_400_BAD_REQUEST)
+        # the query string vocabulary of GET /task/, labels can also be a list
+        params = {name: ','.join(map(str, value)) if isinstance(value, list) else str(value)
+                  for name, value in filters.items() if value is not None}
+
+        tasks = Task.objects.visible_to(request.user, Collaborator.EDITOR)
+        try:
+            tasks, due_date_filters, _ = filter_tasks(tasks, request.user, params)
+        except ValueError as e:
+            return Response({"msg": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = TaskPatchSerializer(data=body.get('patch'), partial=True)
+        if not serializer.is_valid():
+            return Response({"patch": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        tasks = tasks.filter(**due_date_filters)
+        if autosave.is_enabled() and set(serializer.validated_data) & set(autosave.FIELDS):
+            # pending autosaves of the tasks come first, the patch is applied over them
+            try:
+                autosave.write_pending(tasks.values_list('pk', flat=True).iterator(chunk_size=500))
+            except autosave.Locked:
+                return Response({"status": "error", "msg": "Tasks are being saved by another request"},
+                                status=status.HTTP_409_CONFLICT)
+        updated = tasks.patch(history_user_id=request.user.id, **serializer.validated_data)
+        data = {
+            "status": "success",
+            "msg": "Tasks updated successfully",
+            "data": {"updated": updated}
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class TaskAutosaveStatsAPIView(APIView):
+    permission_classes = [IsAdminUser]
+    query_budget = {'GET': 1}
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Autosave counters",
+        description="This endpoint returns how many merged autosaves were written to the database and how many "
+                    "writes merging them saved, across all workers sharing the autosave cache. Staff only.",
+        responses={
+            200: OpenApiResponse(
+                description='Autosave counters',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={"status": "success", "data": {"writes": 1200, "writes_saved": 8400}}
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request):
+        return Response({"status": "success", "data": autosave.stats()}, status=status.HTTP_200_OK)
+
+
+class TaskHistoryPagination(CursorPagination):
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class TaskHistoryAPIView(APIView):
+    query_budget = {'GET': 3}
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Retrieve the change history of a task",
+        description="This endpoint returns the changes anyone made to a task you own or collaborate on and to its "
+                    "comments, newest first, with the old and new value of every changed field. Changes are written "
+                    "in batches and show up here within a few seconds. Follow `next` to load older changes.",
+        parameters=[
+            OpenApiParameter(name='cursor', description="Cursor from `next` or `previous`", required=False, type=str),
+            OpenApiParameter(name='page_size', description="Number of changes per page (max 200)", required=False,
+                             type=int)
+        ],
+        responses={
+            200: OpenApiResponse(
+                response=TaskHistorySerializer(many=True),
+                description='Changes of the task, newest first',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "next": "http://localhost:8000/task/1/history/?cursor=cD0xMjM%3D",
+                            "previous": None,
+                            "results": [
+                                {
+                                    "id": 124,
+                                    "comment_id": None,
+                                    "user": 1,
+                                    "action": "updated",
+                                    "changes": {"status": ["P", "C"]},
+                                    "created_at": "2024-10-26T12:00:00Z"
+                                },
+                                {
+                                    "id": 123,
+                                    "comment_id": 7,
+                                    "user": 1,
+                                    "action": "created",
+                                    "changes": {"text": [None, "Comment 1"]},
+                                    "created_at": "2024-10-26T11:00:00Z"
+                                }
+                            ]
+                        }
+                    )
+                ]
+            ),
+            404: OpenApiResponse(
+                description='Task not found',
+                examples=[
+                    OpenApiExample(
+                        'Task Not Found',
+                        value={"status": "error", "msg": "Task not found"}
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request, pk):
+        if not Task.objects.visible_to(request.user).filter(pk=pk).exists():
+            return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+        # every change to the task, also the ones of its collaborators
+        records = TaskHistory.objects.filter(task_id=pk)
+        paginator = TaskHistoryPagination()
+        page = paginator.paginate_queryset(records, request, view=self)
+        return paginator.get_paginated_response(TaskHistorySerializer(page, many=True).data)
+
+
+class LabelListAPIView(APIView):
+    query_budget = {'GET': 2}
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Retrieve the labels with their number of tasks",
+        description="This endpoint returns the labels of the user in alphabetical order, each with the number of "
+                    "tasks that have it, counted in one query.",
+        responses={
+            200: OpenApiResponse(
+                response=LabelSerializer(many=True),
+                description='Labels of the user',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "data": [
+                                {"id": 2, "name": "urgent", "task_count": 3},
+                                {"id": 1, "name": "work", "task_count": 12}
+                            ]
+                        }
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request):
+        labels = Label.objects.filter(user=request.user).annotate(task_count=Count('tasks')).order_by('name')
+        return Response({"status": "success", "data": LabelSerializer(labels, many=True).data},
+                        status=status.HTTP_200_OK)
+
+
+class TaskTreeAPIView(APIView):
+    query_budget = {'GET': 4}
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Retrieve a task with all of its subtasks",
+        description="This endpoint returns a task with its subtasks nested under `subtasks`, down to the last level, "
+                    "loaded in one query. `subtask_count` and `completed_subtask_count` count every task below a "
+                    "task, not only its direct subtasks.",
+        responses={
+            200: OpenApiResponse(
+                response=TaskSerializer,
+                description='The task and its subtasks',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "data": {
+                                "id": 1,
+                                "title": "Release",
+                                "status": "IP",
+                                "parent": None,
+                                "subtask_count": 2,
+                                "completed_subtask_count": 1,
+                                "subtasks": [
+                                    {
+                                        "id": 2,
+                                        "title": "Write changelog",
+                                        "status": "C",
+                                        "parent": 1,
+                                        "subtask_count": 0,
+                                        "completed_subtask_count": 0,
+                                        "subtasks": []
+                                    },
+                                    {
+                                        "id": 3,
+                                        "title": "Tag version",
+                                        "status": "P",
+                                        "parent": 1,
+                                        "subtask_count": 0,
+                                        "completed_subtask_count": 0,
+                                        "subtasks": []
+                                    }
+                                ]
+                            }
+                        }
+                    )
+                ]
+            ),
+            404: OpenApiResponse(
+                description='Task not found',
+                examples=[
+                    OpenApiExample(
+                        'Task Not Found',
+                        value={"status": "error", "msg": "Task not found"}
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request, pk):
+        try:
+            task = Task.objects.visible_to(request.user).only('id', 'path', 'user').get(pk=pk)
+        except Task.DoesNotExist:
+            return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        tasks = Task.objects.filter(user=task.user_id).subtree(task).order_by('id').prefetch_related('labels')
+        nodes = {}
+        for node in TaskSerializer(tasks, many=True).data:
+            nodes[node['id']] = {**node, "subtasks": []}
+        for node in nodes.values():
+            if node['id'] != task.pk:
+                nodes[node['parent']]["subtasks"].append(node)
+        return Response({"status": "success", "data": nodes[task.pk]}, status=status.HTTP_200_OK)
+
+
+class TaskCollaboratorListAPIView(APIView):
+    query_budget = {'GET': 2, 'POST': 5}
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Retrieve the collaborators of a task",
+        description="This endpoint returns the users a task is shared with and their role. Only the owner of the "
+                    "task can see them.",
+        responses={
+            200: OpenApiResponse(
+                response=CollaboratorSerializer(many=True),
+                description='Collaborators of the task',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "data": [{"user": 2, "role": "editor", "created_at": "2024-10-26T12:00:00Z"}]
+                        }
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request, pk):
+        collaborators = Collaborator.objects.filter(task_id=pk, task__user=request.user).order_by('id')
+        return Response({"status": "success", "data": CollaboratorSerializer(collaborators, many=True).data},
+                        status=status.HTTP_200_OK)
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Share a task",
+        description="This endpoint shares a task with a user. Viewers can read the task and its comments, editors "
+                    "can also change it and comment on it. Sharing a task with a collaborator again changes their "
+                    "role. Only the owner of the task can share it. With sharding, only with users kept on the "
+                    "owner's database.",
+        request=CollaboratorSerializer,
+        responses={
+            201: OpenApiResponse(
+                response=CollaboratorSerializer,
+                description='Task shared',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "data": {"user": 2, "role": "editor", "created_at": "2024-10-26T12:00:00Z"}
+                        }
+                    )
+                ]
+            ),
+            404: OpenApiResponse(
+                description='Task not found',
+                examples=[
+                    OpenApiExample(
+                        'Task Not Found',
+                        value={"status": "error", "msg": "Task not found"}
+                    )
+                ]
+            ),
+            400: OpenApiResponse(
+                description='Bad request, invalid input',
+                examples=[
+                    OpenApiExample(
+                        'Other Shard',
+                        value={"status": "error", "msg": "The task cannot be shared with a user on another shard"}
+                    )
+                ]
+            )
+        }
+    )
+    def post(self, request, pk):
+        serializer = CollaboratorSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            task = Task.objects.only('id', 'user').get(pk=pk, user=request.user)
+        except Task.DoesNotExist:
+            return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+        if serializer.validated_data['user'].pk == request.user.pk:
+            return Response({"status": "error", "msg": "A task cannot be shared with its owner"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if get_shard(serializer.validated_data['user'].pk) != get_shard(request.user.pk):
+            # their reads go to their own shard, they would never see it
+            return Response({"status": "error", "msg": "The task cannot be shared with a user on another shard"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        collaborator, _ = Collaborator.objects.using(task._state.db).update_or_create(
+            task=task, user=serializer.validated_data['user'],
+            defaults={'role': serializer.validated_data.get('role', Collaborator.VIEWER)}
+        )
+        return Response({"status": "success", "data": CollaboratorSerializer(collaborator).data},
+                        status=status.HTTP_201_CREATED)
+
+
+class TaskCollaboratorDetailAPIView(APIView):
+    query_budget = {'DELETE': 2}
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Stop sharing a task with a user",
+        description="This endpoint removes a collaborator from a task. Only the owner of the task can remove them.",
+        responses={
+            200: OpenApiResponse(
+                description='Collaborator removed',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={"status": "success", "msg": "Collaborator removed"}
+                    )
+                ]
+            ),
+            404: OpenApiResponse(
+                description='Collaborator not found',
+                examples=[
+                    OpenApiExample(
+                        'Collaborator Not Found',
+                        value={"status": "error", "msg": "Collaborator not found"}
+                    )
+                ]
+            )
+        }
+    )
+    def delete(self, request, pk, user_id):
+        deleted, _ = Collaborator.objects.filter(task_id=pk, task__user=request.user, user_id=user_id).delete()
+        if not deleted:
+            return Response({"status": "error", "msg": "Collaborator not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"status": "success", "msg": "Collaborator removed"}, status=status.HTTP_200_OK)
+
+
+OCCURRENCE_PARAMETER = OpenApiParameter(
+    name='due_date', type=str, location=OpenApiParameter.PATH,
+    description="Date the occurrence is originally due, in ISO 8601 like its `original_due_date`",
+    examples=[OpenApiExample('Occurrence', value='2024-10-23T09:00:00Z')]
+)
+
+
+class TaskOccurrenceAPIView(TaskDetailAPIView):
+    # a saved occurrence is read and deleted like any other task
+    http_method_names = ['post', 'put', 'patch', 'options']
+    # looking up the recurring task and saving the occurrence with its labels and collaborators takes six
+    # queries, changing it then takes the queries of TaskDetailAPIView
+    query_budget = {'POST': 7, 'PUT': 16, 'PATCH': 16}
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Save an occurrence of a recurring task",
+        description="This endpoint saves an occurrence of a recurring task as a task of its own, for example to "
+                    "comment on it. Saving an occurrence that was saved before returns it.",
+        request=None,
+        parameters=[OCCURRENCE_PARAMETER],
+        responses={
+            201: OpenApiResponse(
+                response=TaskSerializer,
+                description='Occurrence saved',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "msg": "Occurrence saved",
+                            "data": {
+                                "id": 7,
+                                "title": "Standup",
+                                "status": "P",
+                                "due_date": "2024-10-23T09:00:00Z",
+                                "recurrence": "",
+                                "recurrence_of": 1,
+                                "original_due_date": "2024-10-23T09:00:00Z"
+                            }
+                        }
+                    )
+                ]
+            ),
+            400: OpenApiResponse(
+                description='No occurrence is due at this date',
+                examples=[
+                    OpenApiExample(
+                        'Invalid Occurrence',
+                        value={"status": "error", "msg": "No occurrence of the task is due at this date"}
+                    )
+                ]
+            ),
+            404: OpenApiResponse(
+                description='Task not found',
+                examples=[
+                    OpenApiExample(
+                        'Task Not Found',
+                        value={"status": "error", "msg": "Task not found"}
+                    )
+                ]
+            )
+        }
+    )
+    def post(self, request, pk, due_date):
+        try:
+            task, created = self.materialize(request, pk, due_date)
+        except Task.DoesNotExist:
+            return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+        except ValueError:
+            return Response({"status": "error", "msg": "No occurrence of the task is due at this date"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        data = {
+            "status": "success",
+            "msg": "Occurrence saved",
+            "data": TaskSerializer(task).data
+        }
+        return Response(data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+                        headers={'ETag': f'"{task.version}"'})
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Update an occurrence of a recurring task",
+        description="This endpoint saves an occurrence of a recurring task and updates it like `PUT /task/{id}/`.",
+        request=TaskSerializer,
+        parameters=[OCCURRENCE_PARAMETER, IF_MATCH_PARAMETER],
+        responses={200: TaskSerializer}
+    )
+    def put(self, request, pk, due_date):
+        return self._update_occurrence(request, pk, due_date, partial=False)
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Update an occurrence of a recurring task",
+        description="This endpoint saves an occurrence of a recurring task and updates it like `PATCH /task/{id}/`, "
+                    "for example `{\"status\": \"C\"}` to complete it.",
+        request=TaskSerializer,
+        parameters=[OCCURRENCE_PARAMETER, IF_MATCH_PARAMETER],
+        responses={200: TaskSerializer}
+    )
+    def patch(self, request, pk, due_date):
+        return self._update_occurrence(request, pk, due_date, partial=True)
+
+    def _update_occurrence(self, request, pk, due_date, partial):
+        # the occurrence is only kept if the update succeeds
+        with transaction.atomic(using=router.db_for_write(Task)):
+            try:
+                task, _ = self.materialize(request, pk, due_date)
+            except Task.DoesNotExist:
+                return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+            except ValueError:
+                return Response({"status": "error", "msg": "No occurrence of the task is due at this date"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            response = self._update(request, task.pk, partial)
+            if response.status_code >= 400:
+                transaction.set_rollback(True)
+            return response
+
+    @staticmethod
+    def materialize(request, pk, due_date):
+        """
+        Returns the occurrence of the recurring task ``pk`` originally due at ``due_date``, saved if it
+        was not yet, and whether it was saved now. Owners and editors of the recurring task can save it.
+        """
+        due_date = parse_datetime(due_date)
+        if due_date is None or timezone.is_naive(due_date):
+            raise ValueError('Invalid due date')
+        series = Task.objects.visible_to(request.user, Collaborator.EDITOR).prefetch_related('labels').get(pk=pk)
+        task, created = series.materialize(due_date)
+        if created:
+            history.record(task.id, request.user.id, TaskHistory.CREATED,
+                           history.snapshot(task, history.TASK_FIELDS), using=task._state.db)
+        return task, created
+
+
+class TaskActionableAPIView(APIView):
+    query_budget = {'GET': 3}
+    default_limit = 50
+    max_limit = 500
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Retrieve the tasks that can be worked on now",
+        description="This endpoint returns the tasks you own or collaborate on that are not completed and not blocked "
+                    "by a task that is not completed, directly or through other tasks that are not completed, soonest "
+                    "due first. The dependency graph is resolved with a recursive query in the database.",
+        parameters=[
+            OpenApiParameter(name='limit', description="Maximum number of tasks (max 500)", required=False, type=int)
+        ],
+        responses={
+            200: OpenApiResponse(
+                response=TaskSerializer(many=True),
+                description='Actionable tasks',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "length": 1,
+                            "data": [
+                                {
+                                    "id": 2,
+                                    "title": "Write changelog",
+                                    "status": "P",
+                                    "due_date": "2024-10-23T12:00:00Z"
+                                }
+                            ]
+                        }
+                    )
+                ]
+            ),
+            400: OpenApiResponse(
+                description='Bad request, invalid input',
+                examples=[
+                    OpenApiExample(
+                        'Invalid Limit',
+                        value={"msg": "Invalid limit format"}
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            return Response({"msg": "Invalid limit format"}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"msg": "Invalid limit format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        tasks = list(Task.objects.visible_to(request.user).actionable(request.user).order_by(
+            F('due_date').asc(nulls_last=True), 'id'
+        ).prefetch_related('labels')[:limit])
+        autosave.apply_pending(tasks)
+        data = TaskSerializer(tasks, many=True).data
+        return Response({"status": "success", "length": len(data), "data": data}, status=status.HTTP_200_OK)
+
+
+class TaskBlockerListAPIView(APIView):
+    query_budget = {'GET': 3, 'POST': 4}
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Retrieve every task blocking a task",
+        description="This endpoint returns the tasks that have to be completed before a task, directly or through "
+                    "other tasks, collected with a recursive query in the database.",
+        responses={
+            200: OpenApiResponse(
+                response=TaskSerializer(many=True),
+                description='Tasks blocking the task',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "data": [
+                                {"id": 1, "title": "Design", "status": "C"},
+                                {"id": 3, "title": "Review", "status": "P"}
+                            ]
+                        }
+                    )
+                ]
+            ),
+            404: OpenApiResponse(
+                description='Task not found',
+                examples=[
+                    OpenApiExample(
+                        'Task Not Found',
+                        value={"status": "error", "msg": "Task not found"}
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request, pk):
+        # the task itself is part of the result, so a task that is not visible is found in the same query
+        tasks = {task.pk: task for task in Task.objects.visible_to(request.user).with_blockers(pk)
+                 .order_by('id').prefetch_related('labels')}
+        if tasks.pop(pk, None) is None:
+            return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+        data = TaskSerializer(tasks.values(), many=True).data
+        return Response({"status": "success", "data": data}, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Block a task by another task",
+        description="This endpoint makes a task wait for another task of yours to be completed. Only the owner of "
+                    "both can add it. A task cannot be blocked by a task it blocks.",
+        request=BlockerSerializer,
+        responses={
+            201: OpenApiResponse(
+                description='Blocker added',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={"status": "success", "msg": "Blocker added"}
+                    )
+                ]
+            ),
+            400: OpenApiResponse(
+                description='The blocker would create a cycle',
+                examples=[
+                    OpenApiExample(
+                        'Cycle',
+                        value={"status": "error", "msg": "A task cannot be blocked by a task it blocks"}
+                    )
+                ]
+            ),
+            404: OpenApiResponse(
+                description='Task not found',
+                examples=[
+                    OpenApiExample(
+                        'Task Not Found',
+                        value={"status": "error", "msg": "Task not found"}
+                    )
+                ]
+            )
+        }
+    )
+    def post(self, request, pk):
+        serializer = BlockerSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        blocker_id = serializer.validated_data['blocker']
+        tasks = {task.pk: task for task in Task.objects.filter(user=request.user, pk__in=[pk, blocker_id])
+                 .only('id', 'user')}
+        if pk not in tasks or blocker_id not in tasks:
+            return Response({"status": "error", "msg": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            added = tasks[pk].add_blocker(tasks[blocker_id])
+        except ValueError:
+            return Response({"status": "error", "msg": "A task cannot be blocked by a task it blocks"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not added:
+            return Response({"status": "success", "msg": "Blocker already added"}, status=status.HTTP_200_OK)
+        return Response({"status": "success", "msg": "Blocker added"}, status=status.HTTP_201_CREATED)
+
+
+class TaskBlockerDetailAPIView(APIView):
+    query_budget = {'DELETE': 2}
+
+    @extend_schema(
+        tags=['Tasks'],
+        summary="Stop blocking a task by another task",
+        description="This endpoint removes a blocker from a task. Only the owner of the task can remove it.",
+        responses={
+            200: OpenApiResponse(
+                description='Blocker removed',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={"status": "success", "msg": "Blocker removed"}
+                    )
+                ]
+            ),
+            404: OpenApiResponse(
+                description='Blocker not found',
+                examples=[
+                    OpenApiExample(
+                        'Blocker Not Found',
+                        value={"status": "error", "msg": "Blocker not found"}
+                    )
+                ]
+            )
+        }
+    )
+    def delete(self, request, pk, blocker_id):
+        deleted, _ = Dependency.objects.filter(task_id=pk, task__user=request.user, blocker_id=blocker_id).delete()
+        if not deleted:
+            return Response({"status": "error", "msg": "Blocker not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"status": "success", "msg": "Blocker removed"}, status=status.HTTP_200_OK)
@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.contrib import admin
+from django.http import QueryDict
+from django.utils.translation import gettext_lazy as _
+
+from .sharding import SHARDED_APPS
+
+SHARD_PARAMETER = 'shard'
+
+
+def get_admin_shard(request):
+    """
+    Returns the shard an admin request reads from: the ``shard`` query parameter of the changelist,
+    also when it is only kept in the preserved filters of a change or delete page, else the first shard.
+    """
+    if not settings.DATABASE_SHARDS:
+        return None
+    shard = request.GET.get(SHARD_PARAMETER)
+    if shard is None:
+        shard = QueryDict(request.GET.get('_changelist_filters', '')).get(SHARD_PARAMETER)
+    return shard if shard in settings.DATABASE_SHARDS else settings.DATABASE_SHARDS[0]
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Picks the shard of the changelist. There is no "All": ids are only unique within a shard."""
+
+    title = _('shard')
+    parameter_name = SHARD_PARAMETER
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.shard = get_admin_shard(request)
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in settings.DATABASE_SHARDS]
+
+    def queryset(self, request, queryset):
+        # ShardedModelAdmin.get_queryset() already reads from the shard
+        return queryset
+
+    def choices(self, changelist):
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.shard == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+
+class ShardedModelAdmin(admin.ModelAdmin):
+    """
+    Admin of a sharded model. The shard router would send its queries to the shard of the staff user,
+    so every read names the shard picked with ``ShardListFilter`` instead. Saves and deletes follow the
+    router, which keeps a loaded object on its database and puts a new one on the shard of its owner.
+    Users are kept on the primary database, relations to them are prefetched from there instead of joined.
+    """
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if settings.DATABASE_SHARDS:
+            return (ShardListFilter, *list_filter)
+        return list_filter
+
+    def _is_sharded(self, name):
+        return self.model._meta.get_field(name).related_model._meta.app_label in SHARDED_APPS
+
+    def get_list_select_related(self, request):
+        if settings.DATABASE_SHARDS:
+            return tuple(name for name in self.list_select_related if self._is_sharded(name))
+        return super().get_list_select_related(request)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        shard = get_admin_shard(request)
+        if shard is None:
+            return queryset
+        unsharded = [name for name in self.list_select_related if not self._is_sharded(name)]
+        return queryset.using(shard).prefetch_related(*unsharded)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if settings.DATABASE_SHARDS and db_field.related_model._meta.app_label in SHARDED_APPS:
+            kwargs['using'] = get_admin_shard(request)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if settings.DATABASE_SHARDS and db_field.related_model._meta.app_label in SHARDED_APPS:
+            kwargs['using'] = get_admin_shard(request)
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
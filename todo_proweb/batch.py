@@ -0,0 +1,205 @@
+import contextvars
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.db import connections, router, transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import resolve, Resolver404
+from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiResponse
+from rest_framework import serializers, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from task.models import Task
+from .routers import _current_request
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 20
+MAX_PARALLEL_WORKERS = 4
+ALLOWED_PREFIXES = ('/task/', '/comment/')
+FORWARDED_META = ('REMOTE_ADDR', 'SERVER_NAME', 'SERVER_PORT', 'HTTP_HOST', 'HTTP_USER_AGENT', 'wsgi.url_scheme')
+
+
+class BatchSubRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+    path = serializers.CharField(max_length=2048)
+    body = serializers.JSONField(required=False)
+    headers = serializers.DictField(child=serializers.CharField(), required=False)
+
+    def validate_path(self, value):  # noqa
+        if not value.startswith(ALLOWED_PREFIXES):
+            raise serializers.ValidationError(f'Path must start with one of {", ".join(ALLOWED_PREFIXES)}')
+        return value
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchSubRequestSerializer(many=True, allow_empty=False, max_length=MAX_BATCH_SIZE)
+    atomic = serializers.BooleanField(default=False)
+    parallel = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if attrs['parallel']:
+            if attrs['atomic']:
+                raise serializers.ValidationError('Parallel batches cannot be atomic.')
+            if any(sub['method'] != 'GET' for sub in attrs['requests']):
+                raise serializers.ValidationError('Only batches of GET requests can run in parallel.')
+        return attrs
+
+
+def _build_sub_request(request, sub):
+    """Builds a plain HttpRequest for ``sub`` that reuses the batch request's authentication."""
+    url = urlsplit(sub['path'])
+    body = json.dumps(sub['body']).encode() if 'body' in sub else b''
+
+    http_request = HttpRequest()
+    http_request.method = sub['method']
+    http_request.path = http_request.path_info = url.path
+    http_request.META = {key: request.META[key] for key in FORWARDED_META if key in request.META}
+    http_request.META.update({
+        'REQUEST_METHOD': sub['method'],
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+    })
+    for name, value in sub.get('headers', {}).items():
+        http_request.META['HTTP_' + name.upper().replace('-', '_')] = value
+    http_request.GET = QueryDict(url.query)
+    # the replica router reads the pin cookie of the user from the current request
+    http_request.COOKIES = request.COOKIES
+    http_request._stream = BytesIO(body)
+    http_request._read_started = False
+
+    # DRF uses these instead of running the authentication classes again
+    http_request.user = request.user
+    http_request._force_auth_user = request.user
+    http_request._force_auth_token = request.auth
+    return http_request
+
+
+def _dispatch(request, sub, http_request=None):
+    http_request = http_request or _build_sub_request(request, sub)
+    try:
+        match = resolve(http_request.path_info)
+    except Resolver404:
+        return {"status": status.HTTP_404_NOT_FOUND, "body": {"status": "error", "msg": "Not found"}}
+
+    try:
+        response = match.func(http_request, *match.args, **match.kwargs)
+    except Exception:  # noqa, one failing request must not fail the others
+        logger.exception('Batch request %s %s failed', sub['method'], sub['path'])
+        return {"status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                "body": {"status": "error", "msg": "An internal server error occurred"}}
+
+    if response.streaming:
+        # files are not embedded in the batch response. Only their resources are closed, response.close()
+        # would also send request_finished, which closes the database connections of an atomic batch
+        for closer in response._resource_closers:
+            closer()
+        response._resource_closers.clear()
+        body = None
+    elif hasattr(response, 'data'):
+        body = response.data
+    else:
+        content = response.content.decode(response.charset or 'utf-8')
+        body = json.loads(content) if response.get('Content-Type', '').startswith('application/json') else content
+    return {"status": response.status_code, "body": body}
+
+
+def _dispatch_in_thread(request, sub):
+    """
+    Runs a GET of a parallel batch as the current request of the thread's context, so the routers send its
+    reads to a replica or the user's shard like a GET of its own, instead of the primary of the batch POST.
+    """
+    http_request = _build_sub_request(request, sub)
+    token = _current_request.set(http_request)
+    try:
+        return _dispatch(request, sub, http_request)
+    finally:
+        _current_request.reset(token)
+        connections.close_all()
+
+
+class BatchAPIView(APIView):
+    # sub-requests to the same route legitimately run the same queries
+    allow_repeated_queries = True
+
+    @extend_schema(
+        tags=['Batch'],
+        summary="Run several task and comment requests in one round trip",
+        description="This endpoint runs up to 20 requests to `/task/` and `/comment/` routes with the caller's "
+                    "authentication. With `atomic` all of them run in one transaction that is rolled back if any "
+                    "of them fails. With `parallel` a batch of GET requests runs concurrently. File downloads "
+                    "are answered with their status and a `null` body.",
+        request=BatchSerializer,
+        responses={
+            200: OpenApiResponse(
+                description='Status code and body of every request, in order',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "data": [
+                                {"status": 200, "body": {"status": "success", "data": {"id": 1, "title": "Task 1"}}},
+                                {"status": 404, "body": {"status": "error", "msg": "Task not found"}}
+                            ]
+                        }
+                    )
+                ]
+            ),
+            400: OpenApiResponse(
+                description='Invalid batch, or an atomic batch was rolled back',
+                examples=[
+                    OpenApiExample(
+                        'Rolled Back',
+                        value={
+                            "status": "error",
+                            "msg": "Batch rolled back",
+                            "data": [
+                                {"status": 201, "body": {"status": "success", "msg": "Task created successfully"}},
+                                {"status": 400, "body": {"title": ["This field is required."]}}
+                            ]
+                        }
+                    )
+                ]
+            )
+        }
+    )
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        batch = serializer.validated_data
+        if all(sub['method'] == 'GET' for sub in batch['requests']):
+            # nothing is written, the user is not pinned to the primary database
+            request._request._read_only = True
+
+        if batch['parallel']:
+            # every thread gets its own copy of the context to set its sub-request in
+            contexts = [contextvars.copy_context() for _ in batch['requests']]
+            with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_WORKERS, len(batch['requests']))) as executor:
+                results = list(executor.map(lambda context, sub: context.run(_dispatch_in_thread, request, sub),
+                                            contexts, batch['requests']))
+            return Response({"status": "success", "data": results}, status=status.HTTP_200_OK)
+
+        if not batch['atomic']:
+            results = [_dispatch(request, sub) for sub in batch['requests']]
+            return Response({"status": "success", "data": results}, status=status.HTTP_200_OK)
+
+        results = []
+        # the caller's tasks and comments are on one shard, the transaction has to be opened on it
+        using = router.db_for_write(Task, instance=request.user)
+        with transaction.atomic(using=using):
+            for sub in batch['requests']:
+                result = _dispatch(request, sub)
+                results.append(result)
+                if result['status'] >= 400:
+                    transaction.set_rollback(True, using=using)
+                    return Response({"status": "error", "msg": "Batch rolled back", "data": results},
+                                    status=status.HTTP_400_BAD_REQUEST)
+        return Response({"status": "success", "data": results}, status=status.HTTP_200_OK)
@@ -0,0 +1,99 @@
+from django.db import connections, models, router
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.db.models.sql import UpdateQuery
+from django.utils import timezone
+from drf_spectacular.utils import OpenApiParameter
+
+
+IF_MATCH_PARAMETER = OpenApiParameter(
+    name='If-Match', type=str, location=OpenApiParameter.HEADER, required=False,
+    description="Version the change is based on, as returned in the ETag header or the `version` field. "
+                "The update is rejected with 409 if the object was changed in the meantime."
+)
+
+
+class VersionConflict(Exception):
+    pass
+
+
+def get_expected_version(request):
+    """
+    Returns the version the client based its change on, from the ``If-Match`` header
+    (``"3"``, ``W/"3"`` or ``3``) or the ``version`` field of the body, or ``None``.
+    """
+    value = request.META.get('HTTP_IF_MATCH')
+    if value is None:
+        value = request.data.get('version') if hasattr(request.data, 'get') else None
+    if value is None or value == '*':
+        return None
+    try:
+        return int(str(value).removeprefix('W/').strip('"'))
+    except ValueError:
+        return None
+
+
+def _from_db(field, value, connection):
+    """Converts ``value`` of ``field`` read outside the model's columns, such as a datetime SQLite returns as text."""
+    col = field.get_col(field.model._meta.db_table)
+    for converter in connection.ops.get_db_converters(col) + col.get_db_converters(connection):
+        value = converter(value, col, connection)
+    return value
+
+
+class VersionedQuerySet(models.QuerySet):
+
+    def versioned_update(self, version=None, with_previous=False, **changes):
+        """
+        Applies ``changes`` to the single row matched by this queryset and returns it, in one
+        ``UPDATE ... RETURNING`` statement that only sets the given columns and bumps ``version``.
+
+        With ``with_previous`` the values the row had before the update are set as a
+        ``{attname: value}`` dict on the ``previous`` attribute of the returned row. They are read
+        by a materialized CTE of the same statement, which the UPDATE refers to so it is read first.
+
+        Raises ``VersionConflict`` if ``version`` is given and the row has moved on, and the
+        model's ``DoesNotExist`` if no row matches.
+        """
+        queryset = self.filter(version=version) if version is not None else self
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        connection = connections[using]
+
+        for field in self.model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False):
+                changes.setdefault(field.name, timezone.now())
+        changes['version'] = F('version') + 1
+
+        quote_name = connection.ops.quote_name
+        table = quote_name(self.model._meta.db_table)
+        fields = self.model._meta.concrete_fields
+        columns = ', '.join(f'{table}.{quote_name(field.column)}' for field in fields)
+        prefix, prefix_params = '', ()
+        if with_previous:
+            pk = quote_name(self.model._meta.pk.column)
+            previous, prefix_params = queryset.order_by().values(
+                *(field.attname for field in fields)
+            ).query.get_compiler(using).as_sql()
+            prefix = (f'WITH previous({", ".join(quote_name(field.column) for field in fields)}) '
+                      f'AS MATERIALIZED ({previous}) ')
+            queryset = queryset.filter(pk__in=RawSQL(f'SELECT {pk} FROM previous', ()))
+            columns += ''.join(f', (SELECT previous.{quote_name(field.column)} FROM previous '
+                               f'WHERE previous.{pk} = {table}.{pk}) AS {quote_name("previous_" + field.column)}'
+                               for field in fields)
+
+        query = queryset.query.chain(UpdateQuery)
+        query.add_update_values(changes)
+        sql, params = query.get_compiler(using).as_sql()
+        rows = list(self.model.objects.using(using).raw(
+            f'{prefix}{sql} RETURNING {columns}', (*prefix_params, *params)
+        ))
+
+        if rows:
+            row = rows[0]
+            if with_previous:
+                row.previous = {field.attname: _from_db(field, getattr(row, f'previous_{field.column}'), connection)
+                                for field in fields}
+            return row
+        if version is not None and self.using(using).exists():
+            raise VersionConflict()
+        raise self.model.DoesNotExist()
@@ -0,0 +1,88 @@
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IN_FLIGHT = 'in-flight'
+
+IDEMPOTENCY_KEY_PARAMETER = OpenApiParameter(
+    name='Idempotency-Key', type=str, location=OpenApiParameter.HEADER, required=False,
+    description="Unique key of this request. Retrying with the same key returns the first response "
+                "instead of creating a duplicate."
+)
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'IDEMPOTENCY', {}).get(name, default)
+
+
+def _fingerprint(request):
+    return hashlib.sha256(request.body).hexdigest()
+
+
+def idempotent(view_method):
+    """
+    Replays the first response for an ``Idempotency-Key`` header instead of running the view again.
+
+    Responses are kept per (user, path, key) in the cache configured by ``IDEMPOTENCY['CACHE']``
+    for ``IDEMPOTENCY['TTL']`` seconds, so expiry and pruning are left to the cache backend.
+    A retry that arrives while the first request is still running waits up to ``IDEMPOTENCY['WAIT_TIMEOUT']``
+    seconds for its response and is answered with 409 after that. Only one request at a time holds the key.
+    Requests without the header are not affected.
+    """
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({"status": "error", "msg": "Idempotency-Key is too long"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        cache = caches[_get_setting('CACHE', 'default')]
+        ttl = _get_setting('TTL', 60 * 60 * 24)
+        lock_timeout = _get_setting('LOCK_TIMEOUT', 30)
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        cache_key = f'idempotency:{request.user.pk}:{request.path}:{digest}'
+        fingerprint = _fingerprint(request)
+
+        # a sync worker waits for the first request only briefly, then the client retries
+        deadline = time.monotonic() + _get_setting('WAIT_TIMEOUT', 0.5)
+        while not cache.add(cache_key, IN_FLIGHT, lock_timeout):
+            stored = cache.get(cache_key)
+            # with None the first request failed or its lock expired, the next add() handles this one as the first
+            if stored is not None and stored != IN_FLIGHT:
+                if stored['fingerprint'] != fingerprint:
+                    return Response({"status": "error",
+                                     "msg": "Idempotency-Key was already used with a different request body"},
+                                    status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                return Response(stored['data'], status=stored['status'], headers={'Idempotent-Replayed': 'true'})
+            if time.monotonic() >= deadline:
+                return Response({"status": "error", "msg": "A request with this Idempotency-Key is in progress"},
+                                status=status.HTTP_409_CONFLICT)
+            time.sleep(0.05)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+
+        if response.status_code >= 500:
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, {
+                'fingerprint': fingerprint,
+                'status': response.status_code,
+                'data': response.data,
+            }, ttl)
+        return response
+
+    return wrapper
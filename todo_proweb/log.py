@@ -0,0 +1,129 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# attributes every LogRecord has, anything else was passed in ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one line of JSON, with the fields passed in ``extra`` next to the message."""
+
+    def format(self, record):
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a share of the records below WARNING of the loggers in ``rates``
+    (``{'comment': 0.01}``), the rate of the closest configured ancestor applies.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def get_rate(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.get_rate(record.name)
+
+
+class _BufferedStreamHandler(logging.StreamHandler):
+
+    def emit(self, record):
+        # StreamHandler.emit without the flush, the listener flushes once the queue is drained
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except RecursionError:
+            raise
+        except Exception:  # noqa
+            self.handleError(record)
+
+
+class _Listener(QueueListener):
+
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Puts records on an in-process queue that a listener thread formats and writes to ``stream``,
+    so the thread that logs does no formatting and no I/O. Writes go through a buffer that is
+    flushed whenever the queue runs empty, and on exit.
+
+    Records are queued as they are: their arguments are only formatted by the listener, so code
+    that logs must not change them afterwards.
+    """
+
+    def __init__(self, stream=None, buffer_size=64 * 1024):
+        super().__init__(queue.SimpleQueue())
+        stream = stream or sys.stdout
+        try:
+            # our own buffered writer, stdout is unbuffered with PYTHONUNBUFFERED=1
+            stream = open(stream.fileno(), 'w', buffering=buffer_size, closefd=False, encoding='utf-8')
+        except (AttributeError, OSError, ValueError):
+            pass
+        self.target = _BufferedStreamHandler(stream)
+        self.listener = None
+        self._start()
+        atexit.register(self.close)
+
+    def _start(self):
+        self._pid = os.getpid()
+        self.listener = _Listener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        return record
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            # the listener thread does not survive a fork, e.g. of a preloaded gunicorn app
+            self.queue = queue.SimpleQueue()
+            self._start()
+        super().emit(record)
+
+    def close(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self.target.flush()
+        super().close()
+
+
+def parse_sample_rates(value):
+    """Parses ``"comment=0.01,task.views=0.1"`` into ``{'comment': 0.01, 'task.views': 0.1}``."""
+    rates = {}
+    for item in filter(None, value.split(',')):
+        name, _, rate = item.strip().partition('=')
+        rates[name] = float(rate)
+    return rates
@@ -0,0 +1,39 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimate_count(queryset):
+    """
+    Returns PostgreSQL's estimate of the number of rows in ``queryset``: the table statistics for
+    an unfiltered queryset and the planner's row estimate otherwise. ``None`` on other databases.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            # reltuples is -1 until the table is first vacuumed or analyzed
+            return int(row[0]) if row and row[0] >= 0 else None
+
+        sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        return int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists of large tables. Reports ``estimate_count`` instead of running
+    an exact ``COUNT(*)`` once the estimate reaches ``exact_count_threshold`` rows.
+    """
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < self.exact_count_threshold:
+            return super().count
+        return estimate
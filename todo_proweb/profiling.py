@@ -0,0 +1,280 @@
+import cProfile
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse
+from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiResponse
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .query_budget import QueryRecorder
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Profile'
+TOKEN_SALT = 'todo_proweb.profiling'
+
+# cProfile cannot profile two threads of a worker at once on every Python version, one is enough anyway
+_lock = threading.Lock()
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'PROFILING', {}).get(name, default)
+
+
+def get_dir():
+    return Path(_get_setting('DIR', 'profiles'))
+
+
+def make_token(user):
+    """
+    A value of the ``X-Profile`` header that has the requests of ``user`` carrying it profiled, for
+    ``TOKEN_MAX_AGE``.
+    """
+    return signing.dumps({'by': user.pk}, salt=TOKEN_SALT)
+
+
+def _requested_by(request):
+    """The id of the user the ``X-Profile`` header of ``request`` was issued to, ``None`` without a valid one."""
+    token = request.headers.get(HEADER)
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=_get_setting('TOKEN_MAX_AGE', 60 * 60))['by']
+    except (signing.BadSignature, KeyError, TypeError):
+        return None
+
+
+def _issued_to(request, user_id):
+    # DRF authenticates inside the view and sets request.user, so it is only known once the view answered
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated and user.is_staff and user.pk == user_id
+
+
+class TimedQueryRecorder(QueryRecorder):
+    """A ``QueryRecorder`` that also records how long every query took."""
+
+    def __init__(self):
+        super().__init__()
+        self.durations = []
+
+    def __call__(self, execute, sql, params, many, context):
+        count = len(self.queries)
+        start = time.perf_counter()
+        try:
+            return super().__call__(execute, sql, params, many, context)
+        finally:
+            # savepoints are not recorded
+            if len(self.queries) > count:
+                self.durations.append(time.perf_counter() - start)
+
+    def summary(self):
+        """Every query shape with how often it ran and how long it took in total, slowest first."""
+        shapes = defaultdict(lambda: [0, 0.0])
+        for shape, duration in zip(self.queries, self.durations):
+            shapes[shape][0] += 1
+            shapes[shape][1] += duration
+        return sorted(shapes.items(), key=lambda item: item[1][1], reverse=True)
+
+
+def _save(profile, recorder, meta):
+    directory = get_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = meta['id']
+    profile.dump_stats(directory / f'{profile_id}.pstats')
+    with open(directory / f'{profile_id}.sql', 'w') as f:
+        f.write(f'{meta["queries"]} queries in {meta["sql_ms"]:.1f} ms\n')
+        for shape, (count, duration) in recorder.summary():
+            f.write(f'\n{count}x {duration * 1000:.1f} ms\n{shape}\n')
+    # written last, listing only shows profiles that are complete
+    with open(directory / f'{profile_id}.json', 'w') as f:
+        json.dump(meta, f)
+
+    # the ids start with the time, so the oldest come first
+    saved = sorted(directory.glob('*.json'))
+    for path in saved[:max(len(saved) - _get_setting('MAX_PROFILES', 100), 0)]:
+        for suffix in ('.json', '.pstats', '.sql'):
+            path.with_suffix(suffix).unlink(missing_ok=True)
+
+
+def list_profiles():
+    profiles = []
+    for path in sorted(get_dir().glob('*.json'), reverse=True):
+        try:
+            with open(path) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            # removed by another worker in the meantime
+            continue
+    return profiles
+
+
+class ProfilingMiddleware:
+    """
+    Runs requests carrying an ``X-Profile`` header from ``POST /profiles/token/``, and a random
+    ``PROFILING['SAMPLE_RATE']`` share of all others, under cProfile while recording their SQL.
+    The profile of a request with the header is only kept when it was authenticated as the staff
+    user the header was issued to.
+    Keeps the ``.pstats``, a summary of the SQL and the request's details of the last
+    ``PROFILING['MAX_PROFILES']`` in ``PROFILING['DIR']``. Other requests only pay for a header
+    lookup and a random number.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = _get_setting('SAMPLE_RATE', 0)
+        requested_by = _requested_by(request)
+        sampled = bool(sample_rate) and random.random() < sample_rate
+        if requested_by is None and not sampled:
+            return self.get_response(request)
+        if request.path.startswith('/profiles/') or not _lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            with TimedQueryRecorder() as recorder:
+                profile.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profile.disable()
+            duration = time.perf_counter() - start
+        finally:
+            _lock.release()
+
+        requested = requested_by is not None and _issued_to(request, requested_by)
+        if not requested and not sampled:
+            # the header was issued to another user, the profile is dropped
+            return response
+
+        meta = {
+            'id': f'{time.time_ns()}-{uuid.uuid4().hex[:8]}',
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'requested': requested,
+            'duration_ms': round(duration * 1000, 1),
+            'queries': recorder.count,
+            'sql_ms': round(sum(recorder.durations) * 1000, 1),
+            'created_at': time.time(),
+        }
+        try:
+            _save(profile, recorder, meta)
+        except OSError:
+            logger.exception('Could not save the profile of %s %s', request.method, request.path)
+            return response
+        if requested:
+            response['X-Profile-Id'] = meta['id']
+        return response
+
+
+class ProfileTokenAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        tags=['Profiling'],
+        summary="Get a header value that has requests profiled",
+        description="This endpoint returns a signed value for the `X-Profile` header. Your requests carrying it "
+                    "are profiled until it expires, and answered with the `X-Profile-Id` of their profile. Requests "
+                    "of other users carrying it are not. Staff only.",
+        request=None,
+        responses={
+            200: OpenApiResponse(
+                description='Header value and seconds it is valid for',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={"status": "success", "data": {"header": "X-Profile", "value": "eyJieSI6MX0:1t...",
+                                                             "expires_in": 3600}}
+                    )
+                ]
+            )
+        }
+    )
+    def post(self, request):
+        data = {"header": HEADER, "value": make_token(request.user),
+                "expires_in": _get_setting('TOKEN_MAX_AGE', 60 * 60)}
+        return Response({"status": "success", "data": data}, status=status.HTTP_200_OK)
+
+
+class ProfileListAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        tags=['Profiling'],
+        summary="List the captured profiles",
+        description="This endpoint lists the profiles kept on this worker's host, newest first. Staff only.",
+        responses={
+            200: OpenApiResponse(
+                description='Captured profiles',
+                examples=[
+                    OpenApiExample(
+                        'Success',
+                        value={
+                            "status": "success",
+                            "data": [
+                                {
+                                    "id": "1729674000000000000-1a2b3c4d",
+                                    "method": "GET",
+                                    "path": "/task/?status=P",
+                                    "status": 200,
+                                    "requested": True,
+                                    "duration_ms": 182.4,
+                                    "queries": 4,
+                                    "sql_ms": 151.0,
+                                    "created_at": 1729674000.0
+                                }
+                            ]
+                        }
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request):
+        return Response({"status": "success", "data": list_profiles()}, status=status.HTTP_200_OK)
+
+
+class ProfileDownloadAPIView(APIView):
+    permission_classes = [IsAdminUser]
+    suffixes = {'pstats': '.pstats', 'sql': '.sql'}
+
+    @extend_schema(
+        tags=['Profiling'],
+        summary="Download a captured profile",
+        description="This endpoint downloads the cProfile stats of a profile (`pstats`, open with `python -m pstats` "
+                    "or snakeviz) or the summary of its SQL (`sql`). Staff only.",
+        responses={
+            200: OpenApiResponse(description='The file'),
+            404: OpenApiResponse(
+                description='Profile not found',
+                examples=[
+                    OpenApiExample(
+                        'Profile Not Found',
+                        value={"status": "error", "msg": "Profile not found"}
+                    )
+                ]
+            )
+        }
+    )
+    def get(self, request, profile_id, kind):
+        path = get_dir() / f'{profile_id}{self.suffixes[kind]}'
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return Response({"status": "error", "msg": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(file, as_attachment=True, filename=path.name,
+                            content_type='text/plain' if kind == 'sql' else 'application/octet-stream')
@@ -0,0 +1,145 @@
+import logging
+import re
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+IGNORED_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def _get_setting(name, default):
+    return getattr(settings, 'QUERY_BUDGET', {}).get(name, default)
+
+
+def get_query_budget(view_class, method):
+    """
+    Returns the number of queries ``view_class`` may run for ``method``, from its ``query_budget``
+    attribute (``{'GET': 3, 'POST': 2}``), or ``None`` if it declares none.
+    """
+    budget = getattr(view_class, 'query_budget', None)
+    if isinstance(budget, dict):
+        return budget.get(method.upper())
+    return budget
+
+
+def _cache_tables():
+    """The tables of the database caches, whose queries are the cache's and not counted against a view."""
+    tables = [cache['LOCATION'] for cache in settings.CACHES.values()
+              if cache['BACKEND'].endswith('DatabaseCache')]
+    return re.compile(r'\b(?:%s)\b' % '|'.join(map(re.escape, tables))) if tables else None
+
+
+def _project_stack():
+    frames = [frame for frame in traceback.extract_stack()[:-3]
+              if frame.filename.startswith(str(settings.BASE_DIR)) and 'site-packages' not in frame.filename]
+    return ''.join(traceback.format_list(frames))
+
+
+class QueryRecorder:
+    """
+    Records the SQL run on every database connection while active, except for the queries of the
+    database caches. Queries with the same shape (SQL with placeholders, IN lists collapsed) are
+    what an N+1 pattern repeats.
+    """
+
+    def __init__(self, capture_stacks=False):
+        self.capture_stacks = capture_stacks
+        self.queries = []
+        self.stacks = {}
+        self._exit_stack = None
+        self._cache_tables = _cache_tables()
+
+    def __enter__(self):
+        self._exit_stack = ExitStack()
+        for connection in connections.all():
+            self._exit_stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._exit_stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        ignored = sql.lstrip().upper().startswith(IGNORED_STATEMENTS) or \
+            (self._cache_tables is not None and self._cache_tables.search(sql))
+        if not ignored:
+            shape = _IN_LIST.sub('(%s...)', sql)
+            self.queries.append(shape)
+            if self.capture_stacks and shape not in self.stacks:
+                self.stacks[shape] = _project_stack()
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def repeated(self, threshold):
+        return [(shape, count) for shape, count in Counter(self.queries).items() if count >= threshold]
+
+    def problems(self, budget=None, threshold=None):
+        """Returns a description of every budget overrun and repeated query shape, with stack traces."""
+        problems = []
+        if budget is not None and self.count > budget:
+            problems.append(f'{self.count} queries run, the budget is {budget}:\n' + '\n'.join(self.queries))
+        if threshold is not None:
+            for shape, count in self.repeated(threshold):
+                problems.append(f'Query repeated {count} times (possible N+1):\n{shape}\n'
+                                f'{self.stacks.get(shape, "")}')
+        return problems
+
+
+class QueryBudgetMiddleware:
+    """
+    Development and test aid, enabled with ``QUERY_BUDGET['ENABLED']``. Checks every request
+    against its view's ``query_budget`` and for repeated query shapes, then logs the problems
+    with stack traces or, with ``QUERY_BUDGET['RAISE']``, raises ``QueryBudgetExceeded``.
+    """
+
+    def __init__(self, get_response):
+        if not _get_setting('ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder(capture_stacks=True) as recorder:
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        view_class = getattr(match.func, 'view_class', None) if match else None
+        threshold = None if getattr(view_class, 'allow_repeated_queries', False) \
+            else _get_setting('REPEAT_THRESHOLD', 3)
+        problems = recorder.problems(get_query_budget(view_class, request.method), threshold)
+
+        if problems:
+            message = f'{request.method} {request.path}: ' + '\n\n'.join(problems)
+            if _get_setting('RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class QueryBudgetTestMixin:
+    """Assertions for ``TestCase`` classes that check views against their query budgets."""
+
+    def assertWithinQueryBudget(self, view_class, method, path, data=None, **extra):  # noqa
+        budget = get_query_budget(view_class, method)
+        self.assertIsNotNone(budget, f'{view_class.__name__} declares no query budget for {method}')
+
+        with QueryRecorder() as recorder:
+            response = getattr(self.client, method.lower())(path, data, format='json', **extra)
+
+        self.assertLess(response.status_code, 400, response.data)
+        self.assertLessEqual(recorder.count, budget,
+                             f'{method} {path} ran {recorder.count} queries:\n' + '\n'.join(recorder.queries))
+        self.assertEqual(recorder.repeated(_get_setting('REPEAT_THRESHOLD', 3)), [])
+        return response
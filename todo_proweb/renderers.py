@@ -0,0 +1,81 @@
+import datetime
+
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def _microseconds(value):
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return (value - EPOCH) // MICROSECOND
+
+
+def _dictionary_encode(values):
+    """The indexes of ``values`` in the returned list of their distinct values, in order of appearance."""
+    indexes = {}
+    return [None if value is None else indexes.setdefault(value, len(indexes)) for value in values], list(indexes)
+
+
+def _delta_encode(values):
+    """``values`` as microseconds since the previous value that is not ``None``, the first since the epoch."""
+    encoded, previous = [], 0
+    for value in values:
+        if value is None:
+            encoded.append(None)
+            continue
+        moment = _microseconds(value)
+        encoded.append(moment - previous)
+        previous = moment
+    return encoded
+
+
+def encode_columns(rows):
+    """
+    Returns ``rows``, a list of dicts with the same keys, as ``{"fields": [...], "columns": [...]}`` with one
+    list of values per field. When the rows come from a serializer, the values of its choice fields are
+    indexes into ``dictionaries[field]`` and the timestamps of its date-time fields are delta encoded, see
+    ``_delta_encode()``, for the fields listed in ``deltas``.
+    """
+    serializer = getattr(rows, 'serializer', None)
+    declared = getattr(getattr(serializer, 'child', None), 'fields', {})
+    fields = list(rows[0]) if rows else [name for name, field in declared.items() if not field.write_only]
+
+    columns, dictionaries, deltas = [], {}, []
+    for name in fields:
+        column = [row.get(name) for row in rows]
+        field = declared.get(name)
+        if isinstance(field, serializers.ChoiceField) and not isinstance(field, serializers.MultipleChoiceField):
+            column, dictionaries[name] = _dictionary_encode(column)
+        elif isinstance(field, serializers.DateTimeField):
+            try:
+                column = _delta_encode(column)
+                deltas.append(name)
+            except (TypeError, ValueError):
+                # not a timestamp, e.g. with a custom format, sent as it is
+                pass
+        columns.append(column)
+    return {"fields": fields, "columns": columns, "dictionaries": dictionaries, "deltas": deltas}
+
+
+class ColumnarRenderer(JSONRenderer):
+    """
+    Renders the rows of a list response, its ``data`` or paginated ``results``, with ``encode_columns()``
+    instead of repeating every key on every row. Chosen with ``Accept: application/vnd.todo.columnar+json``
+    or ``?format=columnar``, responses without rows are rendered as plain JSON.
+    """
+    media_type = 'application/vnd.todo.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            for key in ('data', 'results'):
+                rows = data.get(key)
+                if isinstance(rows, list) and all(isinstance(row, dict) for row in rows):
+                    data = {**data, key: encode_columns(rows)}
+                    break
+        return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,106 @@
+import logging
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_DB = 'default'
+REPLICATED_APPS = ('task', 'comment')
+
+_current_request = ContextVar('current_request', default=None)
+
+
+PIN_COOKIE = 'replica_pin'
+PIN_SALT = 'todo_proweb.routers'
+
+
+def _pin_key(user):
+    return f'replica_pin:{user.pk}'
+
+
+def _is_pinned(request, user):
+    # requests carrying the cookie only pay for checking its signature
+    if PIN_COOKIE in request.COOKIES:
+        pinned = request.get_signed_cookie(PIN_COOKIE, default=None, salt=PIN_SALT,
+                                           max_age=settings.REPLICA_PIN_SECONDS)
+        if pinned == str(user.pk):
+            return True
+    if not settings.REPLICA_PIN_CACHE:
+        return False
+    try:
+        return caches[settings.REPLICA_PIN_CACHE].get(_pin_key(user)) is not None
+    except Exception:  # noqa, without the pin the user may not see their writes, the primary has them
+        return True
+
+
+def _pin(response, user):
+    response.set_signed_cookie(PIN_COOKIE, user.pk, salt=PIN_SALT, max_age=settings.REPLICA_PIN_SECONDS,
+                               httponly=True, samesite='Lax')
+    if settings.REPLICA_PIN_CACHE:
+        try:
+            caches[settings.REPLICA_PIN_CACHE].set(_pin_key(user), 1, settings.REPLICA_PIN_SECONDS)
+        except Exception:  # noqa, the write succeeded, clients keeping the cookie are still pinned
+            logger.exception('Could not pin user %s to the primary database', user.pk)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Makes the current request visible to ``PrimaryReplicaRouter`` and ``ShardRouter`` and pins users to the
+    primary database for ``REPLICA_PIN_SECONDS`` after they write, so they read their own changes. The pin
+    is a signed cookie, so whichever worker serves the next request sees it without a lookup, and with
+    ``REPLICA_PIN_CACHE`` also kept by user id for clients that drop cookies, such as mobile apps using JWTs.
+    Writes in the sub-requests of a batch pin the user through the batch request, a batch of only GETs does not.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _current_request.set(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+        user = getattr(request, 'user', None)
+        if (settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS and response.status_code < 400
+                and not getattr(request, '_read_only', False) and user is not None and user.is_authenticated):
+            _pin(response, user)
+        return response
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads of task and comment data made by GET requests to one of ``DATABASE_REPLICAS``
+    and everything else to the primary database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or model._meta.app_label not in REPLICATED_APPS:
+            return PRIMARY_DB
+
+        request = _current_request.get()
+        if request is None or request.method not in SAFE_METHODS:
+            return PRIMARY_DB
+
+        # DRF authenticates inside the view and sets request.user, so the alias
+        # is chosen on the first query that runs after that
+        alias = getattr(request, '_replica_alias', None)
+        if alias is None:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated and _is_pinned(request, user):
+                alias = PRIMARY_DB
+            else:
+                alias = random.choice(settings.DATABASE_REPLICAS)
+            request._replica_alias = alias
+        return alias
+
+    def db_for_write(self, model, **hints):  # noqa
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):  # noqa
+        return True
@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import threading
+
+import yaml
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SpectacularAPIView
+
+
+def _accepts_gzip(accept_encoding):
+    """Whether an ``Accept-Encoding`` header gives ``gzip`` a quality above 0, by name or through ``*``."""
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, *params = coding.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+class CachedSpectacularAPIView(SpectacularAPIView):
+    """
+    Serves the OpenAPI schema from memory.
+
+    The schema is read from ``OPENAPI_SCHEMA_FILE`` (written by
+    ``python manage.py spectacular --file schema.yml``) or generated once if the
+    file is missing. Every renderer's output is kept together with its gzip body
+    and ETag. With ``DEBUG`` on the schema is regenerated on each request as before.
+    """
+    _schema = None
+    _rendered = {}
+    _lock = threading.Lock()
+
+    @extend_schema(exclude=True)
+    def get(self, request, *args, **kwargs):
+        if settings.DEBUG:
+            return super().get(request, *args, **kwargs)
+
+        renderer, media_type = self.perform_content_negotiation(request)
+        body, gzipped, etag = self._get_rendered(request, renderer)
+
+        if _accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            response = HttpResponse(gzipped, content_type=media_type)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(body, content_type=media_type)
+
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        patch_cache_control(response, no_cache=True)
+        # answers 304 for a matching If-None-Match, with the headers above
+        return get_conditional_response(request, etag=etag, response=response)
+
+    def _get_rendered(self, request, renderer):
+        cls = type(self)
+        key = renderer.media_type
+        if key not in cls._rendered:
+            with cls._lock:
+                if key not in cls._rendered:
+                    body = renderer.render(self._get_schema(request), renderer.media_type)
+                    etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+                    cls._rendered[key] = (body, gzip.compress(body), etag)
+        return cls._rendered[key]
+
+    def _get_schema(self, request):
+        cls = type(self)
+        if cls._schema is None:
+            schema_file = getattr(settings, 'OPENAPI_SCHEMA_FILE', None)
+            if schema_file and schema_file.exists():
+                with open(schema_file, encoding='utf-8') as f:
+                    cls._schema = yaml.safe_load(f)
+            else:
+                generator = self.generator_class(urlconf=self.urlconf, api_version=self.api_version,
+                                                 patterns=self.patterns)
+                cls._schema = generator.get_schema(request=None, public=self.serve_public)
+        return cls._schema
@@ -11,7 +11,14 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 from datetime import timedelta
 from pathlib import Path
-from config import SECRET_KEY, DEBUG, DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
+from config import (
+    SECRET_KEY, DEBUG, DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS, DB_CONN_MAX_AGE, DB_REPLICA_HOSTS,
+    DB_REPLICA_PIN_SECONDS, DB_SHARD_HOSTS, LOG_LEVEL, LOG_SAMPLE_RATES, ATTACHMENTS_ROOT, ATTACHMENT_MAX_SIZE,
+    ATTACHMENTS_ACCEL_REDIRECT, PROFILING_DIR, PROFILING_SAMPLE_RATE, PROFILING_MAX_PROFILES, AUTOSAVE_ENABLED,
+    AUTOSAVE_WINDOW, AUTOSAVE_CACHE, CACHE_REDIS_URL
+)
+
+from .log import parse_sample_rates
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -55,6 +62,9 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'todo_proweb.routers.ReplicaRoutingMiddleware',
+    'todo_proweb.profiling.ProfilingMiddleware',
+    'todo_proweb.query_budget.QueryBudgetMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -65,8 +75,7 @@ ROOT_URLCONF = 'todo_proweb.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [BASE_DIR / 'templates']
-        ,
+        'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -93,7 +102,152 @@ DATABASES = {
         'PASSWORD': DB_PASS,
         'HOST': DB_HOST,
         'PORT': DB_PORT,
+        # keep the connection a worker opens at warm-up, see todo_proweb/warmup.py
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# GET requests read tasks and comments from the replicas, see todo_proweb/routers.py
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, DB_REPLICA_HOSTS.split(',')), start=1):
+    replica_host, _, replica_port = replica.strip().partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DB_PORT,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{number}')
+
+# tasks and comments are spread over the primary and these shards by a consistent hash of
+# their user, see todo_proweb/sharding.py; `python manage.py rebalance_shards` moves users
+# whose shard changed after the list was edited
+DATABASE_SHARDS = []
+for number, shard in enumerate(filter(None, DB_SHARD_HOSTS.split(',')), start=1):
+    shard_host, _, shard_port = shard.strip().partition(':')
+    DATABASES[f'shard_{number}'] = {
+        **DATABASES['default'],
+        'HOST': shard_host,
+        'PORT': shard_port or DB_PORT,
+    }
+    DATABASE_SHARDS.append(f'shard_{number}')
+if DATABASE_SHARDS:
+    DATABASE_SHARDS.insert(0, 'default')
+SHARD_VIRTUAL_NODES = 128
+
+DATABASE_ROUTERS = ['todo_proweb.sharding.ShardRouter', 'todo_proweb.routers.PrimaryReplicaRouter']
+
+# users read from the primary for this many seconds after a write, pinned by a signed cookie and, for clients
+# that drop cookies, by their user id in this cache, which has to be shared by the workers outside the database
+REPLICA_PIN_SECONDS = DB_REPLICA_PIN_SECONDS
+REPLICA_PIN_CACHE = 'shared' if CACHE_REDIS_URL else None
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.1/topics/logging/
+# records of the project loggers are written as JSON lines by a background thread, see todo_proweb/log.py
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'todo_proweb.log.JSONFormatter'},
+    },
+    'filters': {
+        'sampling': {'()': 'todo_proweb.log.SamplingFilter', 'rates': parse_sample_rates(LOG_SAMPLE_RATES)},
+    },
+    'handlers': {
+        'background': {
+            '()': 'todo_proweb.log.BackgroundHandler',
+            'stream': 'ext://sys.stdout',
+            'formatter': 'json',
+            'filters': ['sampling'],
+        },
+    },
+    'loggers': {
+        name: {'handlers': ['background'], 'level': LOG_LEVEL, 'propagate': False}
+        for name in ('task', 'comment', 'todo_proweb')
+    },
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # create the table with `python manage.py createcachetable`
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'idempotency_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+
+# shared between workers and kept out of the database
+if CACHE_REDIS_URL:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
     }
+
+# task and comment changes are buffered per process and written in batches, see task/history.py
+HISTORY = {
+    'BUFFER_SIZE': 500,
+    'FLUSH_INTERVAL': 2,
+    'SPOOL_DIR': BASE_DIR / 'history_spool',
+}
+
+# PATCHes of only a task's title and description with an `X-Autosave: 1` header are merged in CACHE and written
+# once, WINDOW seconds after the first, see task/autosave.py. The workers have to share the CACHE to read each
+# other's pending changes, autosave stays off with a cache local to the process or kept in the database
+AUTOSAVE = {
+    'ENABLED': AUTOSAVE_ENABLED,
+    'WINDOW': AUTOSAVE_WINDOW,
+    'CACHE': AUTOSAVE_CACHE,
+    # how long a request waits for the lock on a task's pending changes, and how long a lock is held at most
+    'LOCK_WAIT': 1,
+    'LOCK_TIMEOUT': 5,
+    'PENDING_TIMEOUT': 60 * 60,
+}
+
+# comment attachments are stored once per content hash, see comment/attachments.py. With
+# ACCEL_REDIRECT downloads are handed to nginx, from an `internal` location aliased to ROOT
+ATTACHMENTS = {
+    'ROOT': Path(ATTACHMENTS_ROOT) if ATTACHMENTS_ROOT else BASE_DIR / 'attachments',
+    'MAX_SIZE': ATTACHMENT_MAX_SIZE,
+    'ACCEL_REDIRECT': ATTACHMENTS_ACCEL_REDIRECT,
+}
+
+# profiles requests with a signed X-Profile header from POST /profiles/token/ and a SAMPLE_RATE
+# share of all others, keeping the last MAX_PROFILES in DIR, see todo_proweb/profiling.py
+PROFILING = {
+    'DIR': Path(PROFILING_DIR) if PROFILING_DIR else BASE_DIR / 'profiles',
+    'SAMPLE_RATE': PROFILING_SAMPLE_RATE,
+    'MAX_PROFILES': PROFILING_MAX_PROFILES,
+    'TOKEN_MAX_AGE': 60 * 60,
+}
+
+IDEMPOTENCY = {
+    'CACHE': 'idempotency',
+    'TTL': 60 * 60 * 24,
+    'LOCK_TIMEOUT': 30,
+    'WAIT_TIMEOUT': 0.5,
+}
+
+
+# Checks every request against its view's `query_budget` and for repeated (N+1) queries,
+# see todo_proweb/query_budget.py. Logs the problems, or raises with RAISE.
+QUERY_BUDGET = {
+    'ENABLED': DEBUG,
+    'RAISE': False,
+    'REPEAT_THRESHOLD': 3,
 }
 
 
@@ -147,6 +301,12 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # ColumnarRenderer only answers requests that ask for it, with Accept or ?format=columnar
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'todo_proweb.renderers.ColumnarRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 10
 }
@@ -167,6 +327,9 @@ SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True,
 }
 
+# Precomputed schema served by /schema/, written with `python manage.py spectacular --file schema.yml`
+OPENAPI_SCHEMA_FILE = BASE_DIR / 'schema.yml'
+
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
@@ -206,4 +369,4 @@ SIMPLE_JWT = {
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
     "SLIDING_TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer",
-}
\ No newline at end of file
+}
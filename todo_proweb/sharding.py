@@ -0,0 +1,87 @@
+import bisect
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .routers import _current_request
+
+SHARDED_APPS = ('task', 'comment')
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hash of keys onto database aliases. Every alias owns ``virtual_nodes`` points on
+    the ring, so adding or removing an alias only moves the keys of the points it gains or loses.
+    """
+
+    def __init__(self, aliases, virtual_nodes=128):
+        self.points = sorted((_hash(f'{alias}#{node}'), alias) for alias in aliases for node in range(virtual_nodes))
+        self.hashes = [point for point, _ in self.points]
+
+    def get(self, key):
+        index = bisect.bisect(self.hashes, _hash(key)) % len(self.points)
+        return self.points[index][1]
+
+
+@lru_cache(maxsize=8)
+def _get_ring(aliases, virtual_nodes):
+    return HashRing(aliases, virtual_nodes)
+
+
+def get_shard(user_id):
+    """Returns the alias of the database holding the tasks and comments of ``user_id``."""
+    if not settings.DATABASE_SHARDS:
+        return None
+    return _get_ring(tuple(settings.DATABASE_SHARDS), settings.SHARD_VIRTUAL_NODES).get(user_id)
+
+
+def _get_user_id(hints):
+    instance = hints.get('instance')
+    if instance is not None:
+        if isinstance(instance, get_user_model()):
+            return instance.pk
+        # a new comment or collaborator goes to the shard of its task's owner, a new task to its owner's
+        task = instance._state.fields_cache.get('task')
+        if task is not None:
+            return task.user_id
+        return getattr(instance, 'user_id', None)
+
+    request = _current_request.get()
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.pk
+    return None
+
+
+class ShardRouter:
+    """
+    Sends queries on task and comment data to the shard of the user they belong to, taken from
+    the ``instance`` hint or else the user of the current request, when ``DATABASE_SHARDS`` is set.
+    An ``instance`` that already has a database stays on it: comments and history records are created
+    on the database of their task, the shard of its owner, also when a collaborator wrote them.
+    Leaves everything else, and queries it cannot attribute to a user, to the next router.
+    """
+
+    def _db_for(self, model, **hints):
+        if not settings.DATABASE_SHARDS or model._meta.app_label not in SHARDED_APPS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._meta.app_label in SHARDED_APPS and instance._state.db is not None:
+            return instance._state.db
+        user_id = _get_user_id(hints)
+        return get_shard(user_id) if user_id is not None else None
+
+    db_for_read = _db_for
+    db_for_write = _db_for
+
+    def allow_relation(self, obj1, obj2, **hints):  # noqa
+        if (settings.DATABASE_SHARDS and obj1._meta.app_label in SHARDED_APPS
+                and obj2._meta.app_label in SHARDED_APPS):
+            return obj1._state.db == obj2._state.db
+        return None
@@ -0,0 +1,57 @@
+"""
+Settings for running the test suite without PostgreSQL:
+
+    python manage.py test --settings=todo_proweb.test_settings
+
+Uses SQLite databases: the primary, a read replica, and two shards that the sharding tests
+enable with ``override_settings(DATABASE_SHARDS=[...])``.
+"""
+from .settings import *  # noqa
+
+SECRET_KEY = SECRET_KEY or 'test-secret-key'  # noqa: F405
+SIMPLE_JWT['SIGNING_KEY'] = SECRET_KEY  # noqa: F405
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test_db.sqlite3',  # noqa: F405
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test_replica.sqlite3',  # noqa: F405
+    },
+    'shard_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test_shard_1.sqlite3',  # noqa: F405
+    },
+    'shard_2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test_shard_2.sqlite3',  # noqa: F405
+    },
+}
+
+DATABASE_REPLICAS = ['replica']
+DATABASE_SHARDS = []
+
+# tests flush the history buffer themselves
+HISTORY = {**HISTORY, 'FLUSH_INTERVAL': None, 'SPOOL_DIR': BASE_DIR / 'test_history_spool'}  # noqa: F405
+
+# shared between the processes of a host outside the database, in place of redis
+CACHES = {
+    **CACHES,  # noqa: F405
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'test_cache',  # noqa: F405
+    },
+}
+
+REPLICA_PIN_CACHE = 'shared'
+
+PROFILING = {**PROFILING, 'DIR': BASE_DIR / 'test_profiles', 'SAMPLE_RATE': 0}  # noqa: F405
+
+ATTACHMENTS = {**ATTACHMENTS, 'ROOT': BASE_DIR / 'test_attachments', 'ACCEL_REDIRECT': ''}  # noqa: F405
+
+for logger in LOGGING['loggers'].values():  # noqa: F405
+    logger['level'] = 'WARNING'
+
+QUERY_BUDGET = {**QUERY_BUDGET, 'ENABLED': True, 'RAISE': True}  # noqa: F405
@@ -1,7 +1,7 @@
 
 from django.contrib import admin
-from django.urls import path, include
-from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from django.urls import path, include, re_path
+from drf_spectacular.views import SpectacularRedocView, SpectacularSwaggerView
 
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -9,13 +9,25 @@ from rest_framework_simplejwt.views import (
     TokenVerifyView
 )
 
+from .batch import BatchAPIView
+from .profiling import ProfileDownloadAPIView, ProfileListAPIView, ProfileTokenAPIView
+from .schema import CachedSpectacularAPIView
+from .warmup import LivenessAPIView, ReadinessAPIView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('task/', include('task.urls')),
     path('comment/', include('comment.urls')),
+    path('batch/', BatchAPIView.as_view(), name='batch'),
+    path('health/live/', LivenessAPIView.as_view(), name='health-live'),
+    path('health/ready/', ReadinessAPIView.as_view(), name='health-ready'),
+    path('profiles/', ProfileListAPIView.as_view(), name='profile-list'),
+    path('profiles/token/', ProfileTokenAPIView.as_view(), name='profile-token'),
+    re_path(r'^profiles/(?P<profile_id>[0-9]+-[0-9a-f]{8})/(?P<kind>pstats|sql)/$', ProfileDownloadAPIView.as_view(),
+            name='profile-download'),
     path('swagger/', SpectacularSwaggerView.as_view(), name='swagger-ui'),
     path('redoc/', SpectacularRedocView.as_view(), name='redoc'),
-    path('schema/', SpectacularAPIView.as_view(), name='schema'),
+    path('schema/', CachedSpectacularAPIView.as_view(), name='schema'),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/token/verify/', TokenVerifyView.as_view(), name='token_verify'),
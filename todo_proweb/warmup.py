@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+from django.urls import get_resolver, resolve
+from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiResponse
+from rest_framework import status
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_PATHS = ('/task/', '/task/1/', '/comment/', '/comment/1/', '/batch/')
+
+_warm = threading.Event()
+_lock = threading.Lock()
+
+
+def is_warm():
+    return _warm.is_set()
+
+
+def warm_up():
+    """
+    Does the work the first requests to a fresh worker would otherwise pay for: populates the URL
+    resolver, builds the task and comment serializer fields, sets up the JWT backend by validating
+    a token and opens the connections to every database. Runs once per process.
+    """
+    from comment.serializers import CommentSerializer
+    from task.serializers import TaskSerializer
+
+    with _lock:
+        if _warm.is_set():
+            return
+        started = time.monotonic()
+
+        resolver = get_resolver()
+        for path in WARM_UP_PATHS:
+            resolve(path)
+        resolver.reverse('schema')
+
+        for serializer_class in (TaskSerializer, CommentSerializer):
+            serializer_class().fields  # noqa
+
+        token = AccessToken()
+        JWTAuthentication().get_validated_token(str(token).encode())
+
+        for alias in dict.fromkeys(['default', *settings.DATABASE_REPLICAS, *settings.DATABASE_SHARDS]):
+            connections[alias].ensure_connection()
+
+        _warm.set()
+        logger.info('Worker warmed up in %.0f ms', (time.monotonic() - started) * 1000)
+
+
+class LivenessAPIView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    query_budget = {'GET': 0}
+
+    @extend_schema(
+        tags=['Health'],
+        summary="Liveness check",
+        description="This endpoint answers as long as the worker process is running.",
+        responses={200: OpenApiResponse(description='Worker is alive',
+                                        examples=[OpenApiExample('Alive', value={"status": "success"})])}
+    )
+    def get(self, request):  # noqa
+        return Response({"status": "success"}, status=status.HTTP_200_OK)
+
+
+class ReadinessAPIView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    query_budget = {'GET': 1}
+
+    @extend_schema(
+        tags=['Health'],
+        summary="Readiness check",
+        description="This endpoint reports ready once the worker has been warmed up and the database answers. "
+                    "A worker that was not warmed up at start warms up on its first check and reports ready "
+                    "from then on.",
+        responses={
+            200: OpenApiResponse(description='Worker is ready for traffic',
+                                 examples=[OpenApiExample('Ready', value={"status": "success"})]),
+            503: OpenApiResponse(description='Worker is not ready',
+                                 examples=[OpenApiExample('Not Ready',
+                                                          value={"status": "error", "msg": "Database unavailable"})])
+        }
+    )
+    def get(self, request):  # noqa
+        try:
+            warm_up()
+            with connections['default'].cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError:
+            logger.exception('Readiness check failed')
+            return Response({"status": "error", "msg": "Database unavailable"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({"status": "success"}, status=status.HTTP_200_OK)